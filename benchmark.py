@@ -0,0 +1,316 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from downloads import save_atomically
+from main import IDMAPPING_HDR, import_annotations_from_gaf, import_hgnc_to_sqlite, import_mappings_to_sqlite
+
+log = logging.getLogger('GO-db')
+
+BENCH_FOLDER = 'bench'
+SCALES = (1, 10, 100)
+
+# sizes of the 1x fixtures, every other scale multiplies them
+BASE_SIZES = {
+    'terms': 4_000,
+    'genes': 2_000,
+    'annotations': 20_000,
+    'interactions': 8_000,
+}
+NAMESPACES = ['biological_process', 'cellular_component', 'molecular_function']
+ROOTS = {'biological_process': 'GO:0008150', 'cellular_component': 'GO:0005575', 'molecular_function': 'GO:0003674'}
+ASPECTS = {'biological_process': 'P', 'cellular_component': 'C', 'molecular_function': 'F'}
+EVIDENCE_CODES = ['IEA', 'IDA', 'IPI', 'IMP', 'ISS', 'TAS', 'IBA', 'HDA', 'NAS', 'IGI']
+EVIDENCE_WEIGHTS = [0.45, 0.12, 0.12, 0.07, 0.05, 0.05, 0.07, 0.03, 0.02, 0.02]
+
+
+def fixture_sizes(scale) -> dict:
+    return {k: int(v * scale) for k, v in BASE_SIZES.items()}
+
+
+def go_id(i) -> str:
+    return f'GO:{i + 1_000_000:07d}'
+
+
+def ensembl_id(g) -> str:
+    return f'ENSG{g:011d}'
+
+
+def uniprot_ac(g) -> str:
+    return f'{"PQO"[g % 3]}{g:06d}'
+
+
+def generate_obo(obo_file, n_terms, rng):
+    """
+    GO-like DAG: three namespaces under their usual roots, is_a parents drawn towards recently added terms so the
+    graph gets deep, extra is_a parents and part_of links on a fraction of the terms, and a few alt_ids.
+    """
+    namespaces = rng.choice(len(NAMESPACES), n_terms, p=[0.6, 0.2, 0.2])
+    pools = {ns: [ROOTS[ns]] for ns in NAMESPACES}
+    with open(obo_file, 'w', encoding='utf-8') as f:
+        f.write('format-version: 1.2\nontology: go\n\n')
+        for ns in NAMESPACES:
+            f.write(f'[Term]\nid: {ROOTS[ns]}\nname: {ns.replace("_", " ")}\nnamespace: {ns}\n\n')
+        for i in range(n_terms):
+            ns = NAMESPACES[namespaces[i]]
+            pool = pools[ns]
+            parents = {pool[int(len(pool) * rng.random() ** 0.5)] for _ in range(rng.geometric(0.6))}
+            term = go_id(i)
+            lines = ['[Term]', f'id: {term}', f'name: synthetic {ns.split("_")[0]} term {i}', f'namespace: {ns}']
+            if rng.random() < 0.02:
+                lines.append(f'alt_id: {go_id(n_terms + i)}')
+            lines += [f'is_a: {p} ! parent' for p in sorted(parents)]
+            if rng.random() < 0.2 and len(pool) > 1:
+                lines.append(f'relationship: part_of {pool[rng.integers(len(pool))]} ! whole')
+            f.write('\n'.join(lines) + '\n\n')
+            pool.append(term)
+    return pools
+
+
+def generate_categories(categories_file, pools):
+    # early terms have the largest subtrees, as the real category roots near the top of GO
+    bp, cc = pools['biological_process'], pools['cellular_component']
+    categories = {'categories': [
+        {'name': 'cell_cycle', 'sheet': 'CelCycle-GO', 'roots': [bp[3], bp[7]],
+         'relationships': ['part_of'], 'evidence_codes': None},
+        {'name': 'mitochondria', 'sheet': 'Mitochondria-GO', 'roots': [cc[2]],
+         'relationships': ['part_of'], 'evidence_codes': ['IDA', 'IPI', 'IMP', 'HDA']},
+    ]}
+    with open(categories_file, 'w') as f:
+        json.dump(categories, f, indent=2)
+
+
+def generate_huri(huri_file, n_genes, n_interactions, rng):
+    # heavy tailed degrees, as in HuRI where a few hubs have hundreds of partners
+    weights = 1 / np.arange(1, n_genes + 1) ** 0.8
+    weights /= weights.sum()
+    genes = rng.permutation(n_genes)
+    p1 = genes[rng.choice(n_genes, n_interactions, p=weights)]
+    p2 = genes[rng.choice(n_genes, n_interactions, p=weights)]
+    pairs = pd.DataFrame({'p1': np.minimum(p1, p2), 'p2': np.maximum(p1, p2)}).drop_duplicates()
+    with open(huri_file, 'w') as f:
+        for a, b in pairs.itertuples(index=False, name=None):
+            f.write(f'{ensembl_id(a)}\t{ensembl_id(b)}\n')
+
+
+def generate_idmapping(mapping_file, n_genes, rng):
+    """
+    idmapping_selected.tab rows: one per gene accession, a second Ensembl gene on some, and as many accessions
+    again without any Ensembl cross-reference (other species, unreviewed entries), interleaved.
+    """
+    ensembl_col = IDMAPPING_HDR.index('Ensembl')
+    width = len(IDMAPPING_HDR)
+    with gzip.open(mapping_file, 'wt', encoding='utf-8') as f:
+        for g in range(n_genes):
+            row = [''] * width
+            row[0] = uniprot_ac(g)
+            row[1] = f'{uniprot_ac(g)}_HUMAN'
+            row[2] = str(g + 1)
+            row[12] = '9606'
+            genes = [ensembl_id(g)]
+            if rng.random() < 0.05:
+                genes.append(ensembl_id(n_genes + g))
+            row[ensembl_col] = '; '.join(genes)
+            f.write('\t'.join(row) + '\n')
+            other = [''] * width
+            other[0] = f'A{g:09d}'
+            other[12] = '10090'
+            f.write('\t'.join(other) + '\n')
+
+
+def generate_hgnc(hgnc_file, n_genes, rng):
+    genes = np.flatnonzero(rng.random(n_genes) < 0.9)
+    pd.DataFrame({
+        'hgnc_id': [f'HGNC:{g + 1}' for g in genes],
+        'symbol': [f'SYN{g}' for g in genes],
+        'name': [f'synthetic gene {g}' for g in genes],
+        'status': 'Approved',
+        'alias_symbol': [f'ALIAS{g}' if g % 4 == 0 else '' for g in genes],
+        'alias_name': '',
+        'locus_group': 'protein-coding gene',
+        'locus_type': 'gene with protein product',
+        'entrez_id': genes + 1,
+        'ensembl_gene_id': [ensembl_id(g) for g in genes],
+        'uniprot_ids': [uniprot_ac(g) for g in genes],
+    }).to_csv(hgnc_file, sep='\t', index=False)
+
+
+def generate_gaf(gaf_file, n_genes, n_annotations, namespace_terms: dict, rng):
+    """
+    GAF 2.2 lines, annotation counts per gene skewed like in GOA, a small share on accessions unknown to HGNC.
+    """
+    weights = 1 / np.arange(1, n_genes + 1) ** 0.5
+    weights /= weights.sum()
+    genes = rng.choice(n_genes, n_annotations, p=weights)
+    namespaces = rng.choice(len(NAMESPACES), n_annotations, p=[0.5, 0.3, 0.2])
+    evidence = rng.choice(len(EVIDENCE_CODES), n_annotations, p=EVIDENCE_WEIGHTS)
+    unknown = rng.random(n_annotations) < 0.03
+    with gzip.open(gaf_file, 'wt', encoding='utf-8') as f:
+        f.write('!gaf-version: 2.2\n!generated-by: benchmark.py\n')
+        for g, ns_i, e, u in zip(genes, namespaces, evidence, unknown):
+            ns = NAMESPACES[ns_i]
+            terms = namespace_terms[ns]
+            term = terms[rng.integers(len(terms))]
+            ac = f'X{g:07d}' if u else uniprot_ac(g)
+            f.write('\t'.join(['UniProtKB', ac, f'SYN{g}', 'involved_in', term, 'PMID:1', EVIDENCE_CODES[e], '',
+                               ASPECTS[ns], f'synthetic gene {g}', '', 'protein', 'taxon:9606', '20240101',
+                               'UniProt', '', '']) + '\n')
+
+
+def generate_fixtures(folder, scale, seed=0, force=False) -> dict:
+    """
+    Writes the synthetic inputs of one scale to folder, reusing them when they were generated with the same
+    parameters. Returns the paths by input name.
+    """
+    sizes = fixture_sizes(scale)
+    params = {'scale': scale, 'seed': seed, 'sizes': sizes}
+    paths = {
+        'obo': os.path.join(folder, 'go.obo'),
+        'categories': os.path.join(folder, 'categories.json'),
+        'huri': os.path.join(folder, 'HI-union.tsv'),
+        'idmapping': os.path.join(folder, 'idmapping_selected.tab.gz'),
+        'hgnc': os.path.join(folder, 'hgnc_complete_set.txt'),
+        'gaf': os.path.join(folder, 'goa_human.gaf.gz'),
+    }
+    params_file = os.path.join(folder, 'params.json')
+    if not force and os.path.exists(params_file):
+        with open(params_file) as f:
+            if json.load(f) == params and all(os.path.exists(p) for p in paths.values()):
+                return paths
+
+    os.makedirs(folder, exist_ok=True)
+    log.info(f'Generating {scale}x fixtures in {folder}.')
+    rng = np.random.default_rng(seed)
+    pools = generate_obo(paths['obo'], sizes['terms'], rng)
+    generate_categories(paths['categories'], pools)
+    generate_huri(paths['huri'], sizes['genes'], sizes['interactions'], rng)
+    generate_idmapping(paths['idmapping'], sizes['genes'], rng)
+    generate_hgnc(paths['hgnc'], sizes['genes'], rng)
+    generate_gaf(paths['gaf'], sizes['genes'], sizes['annotations'], pools, rng)
+    with open(params_file, 'w') as f:
+        json.dump(params, f)
+    return paths
+
+
+def run_pipeline(paths: dict, work_folder, workers=None) -> list:
+    """
+    Builds a fresh database from the fixtures and runs the Cytoscape queries on it, all inside work_folder
+    so caches start cold. Returns the instrument records of the run.
+    """
+    # imported here as load_to_cytoscape needs py4cytoscape and goatools
+    from goatools.godag.go_tasks import get_go2children
+    from goatools.obo_parser import GODag
+    from load_to_cytoscape import filtered_nodes, get_children, interactors
+
+    paths = {k: os.path.abspath(p) for k, p in paths.items()}
+    cwd = os.getcwd()
+    os.chdir(work_folder)
+    instrument.reset()
+    try:
+        db_sqlite = os.path.join(work_folder, 'go-interactome.db')
+        import_mappings_to_sqlite(db_sqlite, paths['huri'], paths['idmapping'])
+        import_hgnc_to_sqlite(db_sqlite, hgnc_file=paths['hgnc'])
+        import_annotations_from_gaf(db_sqlite, gaf_files=[paths['gaf']], workers=workers)
+
+        with instrument.stage('godag_load') as s:
+            dag = GODag(paths['obo'], optional_attrs={'relationship'}, prt=None)
+            s.add(rows=len(dag))
+        with open(paths['categories']) as f:
+            roots = [r for c in json.load(f)['categories'] for r in c['roots']]
+        with instrument.stage('get_children') as s:
+            all_children = get_go2children(dag, {'is_a', 'part_of'})
+            for root in roots:
+                s.add(rows=len(get_children(dag, root, levels=100, all_children=all_children)))
+
+        interactors(db_sqlite, categories_file=paths['categories'], obo_file=paths['obo'],
+                    category_names=('cell_cycle', 'mitochondria'))
+        filtered_nodes(db_sqlite)
+    finally:
+        os.chdir(cwd)
+    return instrument.records()
+
+
+def run_benchmarks(scales=SCALES, bench_folder=BENCH_FOLDER, seed=0, workers=None) -> dict:
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'scales': dict(),
+    }
+    for scale in scales:
+        paths = generate_fixtures(os.path.join(bench_folder, 'fixtures', f'{scale}x'), scale, seed)
+        with tempfile.TemporaryDirectory(dir=bench_folder) as work_folder:
+            records = run_pipeline(paths, work_folder, workers)
+        results['scales'][str(scale)] = {'sizes': fixture_sizes(scale), 'stages': records}
+        log.info(f'{scale}x done:\n{summary(results, scale).to_string(index=False)}')
+    return results
+
+
+def summary(results: dict, scale=None) -> pd.DataFrame:
+    rows = list()
+    for s, run in results['scales'].items():
+        if scale is not None and s != str(scale):
+            continue
+        for r in run['stages']:
+            rows.append({'scale': int(s), 'stage': r['stage'], 'wall_s': r['wall_s'], 'cpu_s': r['cpu_s'],
+                         'rows': r['rows'], 'peak_rss_mb': r['peak_rss_mb']})
+    return pd.DataFrame(rows, columns=['scale', 'stage', 'wall_s', 'cpu_s', 'rows', 'peak_rss_mb'])
+
+
+def compare(results: dict, baseline: dict) -> pd.DataFrame:
+    """
+    Wall time of every stage against the baseline, ratio > 1 is slower. Rows that differ mean the fixtures or
+    the pipeline output changed and the timings are not comparable.
+    """
+    df = summary(results).merge(summary(baseline), on=['scale', 'stage'], how='outer',
+                                suffixes=('', '_baseline'))
+    df['ratio'] = df['wall_s'] / df['wall_s_baseline']
+    df['same_rows'] = df['rows'] == df['rows_baseline']
+    return df[['scale', 'stage', 'wall_s_baseline', 'wall_s', 'ratio', 'same_rows']]
+
+
+def write_results(results: dict, results_file):
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+
+    def write(tmp_file):
+        with open(tmp_file, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    save_atomically(results_file, write)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the database build and Cytoscape queries on synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--folder', default=BENCH_FOLDER, help='fixtures, work space and results')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='GAF parser processes')
+    parser.add_argument('--baseline', default=os.path.join(BENCH_FOLDER, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    pd.set_option('display.width', 200)
+    os.makedirs(args.folder, exist_ok=True)
+    results = run_benchmarks(args.scales, args.folder, args.seed, args.workers)
+    results_file = os.path.join(args.folder, f'results-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json')
+    write_results(results, results_file)
+    print(f'Results written to {results_file}')
+
+    if args.save_baseline:
+        write_results(results, args.baseline)
+        print(f'Baseline written to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            print(compare(results, json.load(f)).to_string(index=False))
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from downloads import MANIFEST_FILE, Manifest, sha256_file
+
+log = logging.getLogger('GO-db')
+
+BUILD_STATE_DDL = '''CREATE TABLE IF NOT EXISTS "build_state" (
+                    "table_name"	TEXT PRIMARY KEY,
+                    "source_hash"	TEXT,
+                    "sources"	TEXT,
+                    "built_at"	TEXT
+                );'''
+
+
+_digests = dict()
+_digests_lock = threading.Lock()
+
+
+def file_digest(path) -> str:
+    """
+    sha256 of a file, computed once per (path, mtime, size) in this process.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = _file_digest(path)
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def _file_digest(path) -> str:
+    # reuse the sha256 recorded by the downloader when the file is unchanged since it was fetched
+    manifest_file = os.path.join(os.path.dirname(os.path.abspath(path)), MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        manifest = Manifest(manifest_file)
+        entry = manifest.get(path)
+        if manifest.is_complete(path) and entry.get('sha256'):
+            return entry['sha256']
+    return sha256_file(path).hexdigest()
+
+
+def sources_digest(*paths, **params) -> str:
+    """
+    Content hash of all input files of a build step, plus any parameter that changes the table it produces.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def table_exists(db: sqlite3.Connection, table) -> bool:
+    cur = db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table,))
+    return cur.fetchone() is not None
+
+
+def get_state(db: sqlite3.Connection, table):
+    db.execute(BUILD_STATE_DDL)
+    row = db.execute('SELECT source_hash FROM build_state WHERE table_name=?;', (table,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def is_current(db: sqlite3.Connection, table, digest) -> bool:
+    if digest is not None and table_exists(db, table) and get_state(db, table) == digest:
+        log.info(f'Table {table} is up to date, skipping.')
+        return True
+    return False
+
+
+def begin_shadow(db: sqlite3.Connection, table) -> str:
+    """
+    Returns the name of an empty shadow table to build the new version of `table` into.
+    """
+    shadow = f'{table}__shadow'
+    db.execute(f'DROP TABLE IF EXISTS "{shadow}";')
+    db.commit()
+    return shadow
+
+
+def record_state(db: sqlite3.Connection, name, digest, sources=()):
+    """
+    Records the source hash of a build product, inside the caller's transaction.
+    """
+    db.execute(BUILD_STATE_DDL)
+    db.execute('INSERT OR REPLACE INTO build_state (table_name, source_hash, sources, built_at) '
+               'VALUES (?, ?, ?, ?);',
+               (name, digest, json.dumps([os.path.basename(s) for s in sources]),
+                datetime.now(timezone.utc).isoformat()))
+
+
+def swap_in(db: sqlite3.Connection, table, digest, index_sql=(), sources=()):
+    """
+    Atomically replaces `table` by its shadow, (re)creates its indexes and records the source hash.
+    Readers see either the old table or the complete new one.
+    """
+    shadow = f'{table}__shadow'
+    db.commit()
+    db.execute('BEGIN;')
+    try:
+        db.execute(BUILD_STATE_DDL)
+        db.execute(f'DROP TABLE IF EXISTS "{table}";')
+        db.execute(f'ALTER TABLE "{shadow}" RENAME TO "{table}";')
+        for sql in index_sql:
+            db.execute(sql)
+        record_state(db, table, digest, sources)
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    log.info(f'Table {table} rebuilt.')
+
+
+def database_version(db: sqlite3.Connection) -> str:
+    """
+    Hash over the build state of all tables, changes whenever any table is rebuilt from new inputs.
+    """
+    digest = hashlib.sha256()
+    if not table_exists(db, 'build_state'):
+        # also works on read-only connections, where the table cannot be created
+        return digest.hexdigest()
+    for table_name, source_hash in db.execute('SELECT table_name, source_hash FROM build_state ORDER BY table_name;'):
+        digest.update(f'{table_name}={source_hash};'.encode())
+    return digest.hexdigest()
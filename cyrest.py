@@ -0,0 +1,175 @@
+import json
+import logging
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from instrument import count, instrumented
+
+log = logging.getLogger('GO-db')
+
+CYREST_URL = 'http://127.0.0.1:1234/v1'
+BATCH_SIZE = 5000
+
+
+class CyRestError(Exception):
+    pass
+
+
+class CyRestClient:
+    """
+    Minimal JSON client for the CyREST API, every call is a single HTTP request.
+    """
+
+    def __init__(self, base_url=CYREST_URL, timeout=600):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, params=None, body=None):
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method,
+                                     headers={'Content-Type': 'application/json', 'Accept': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                payload = r.read()
+        except urllib.error.HTTPError as e:
+            raise CyRestError(f'{method} {url} failed with {e.code}: {e.read()[:500]!r}') from e
+        return json.loads(payload) if payload else None
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params)
+
+    def post(self, path, body=None, params=None):
+        return self.request('POST', path, params, body)
+
+    def put(self, path, body=None, params=None):
+        return self.request('PUT', path, params, body)
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+
+def batches(items, batch_size=BATCH_SIZE):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def edge_name(source, interaction, target) -> str:
+    # same convention as Cytoscape and py4cytoscape, used as the edge key when updating a network
+    return f'{source} ({interaction}) {target}'
+
+
+def find_network(client: CyRestClient, title):
+    suids = client.get('networks', params={'column': 'name', 'query': title})
+    return suids[0] if suids else None
+
+
+def create_network(client: CyRestClient, title, collection) -> int:
+    body = {'data': {'name': title}, 'elements': {'nodes': [], 'edges': []}}
+    return client.post('networks', body, params={'title': title, 'collection': collection})['networkSUID']
+
+
+def table_rows(client: CyRestClient, suid, table, columns) -> pd.DataFrame:
+    rows = client.get(f'networks/{suid}/tables/{table}/rows')
+    return pd.DataFrame(rows, columns=columns) if rows else pd.DataFrame(columns=columns)
+
+
+def add_nodes(client: CyRestClient, suid, names, batch_size=BATCH_SIZE) -> dict:
+    node_suids = dict()
+    for batch in batches(list(names), batch_size):
+        for node in client.post(f'networks/{suid}/nodes', batch):
+            node_suids[node['name']] = node['SUID']
+    return node_suids
+
+
+def add_edges(client: CyRestClient, suid, edges: pd.DataFrame, node_suids: dict, batch_size=BATCH_SIZE) -> list:
+    body = [{'source': node_suids[s], 'target': node_suids[t], 'directed': False, 'interaction': i}
+            for s, t, i in zip(edges['source'], edges['target'], edges['interaction'])]
+    edge_suids = list()
+    for batch in batches(body, batch_size):
+        edge_suids.extend(e['SUID'] for e in client.post(f'networks/{suid}/edges', batch))
+    return edge_suids
+
+
+def load_table(client: CyRestClient, suid, table, df: pd.DataFrame, key='name', data_key='name',
+               batch_size=BATCH_SIZE):
+    """
+    Bulk upload of attribute columns, matched on the Cytoscape column `key` and the data column `data_key`.
+    """
+    df = df.replace({np.nan: None})
+    for batch in batches(df.to_dict(orient='records'), batch_size):
+        client.put(f'networks/{suid}/tables/{table}', {'key': key, 'dataKey': data_key, 'data': batch})
+
+
+def delete_elements(client: CyRestClient, suid, kind, element_suids, batch_size=BATCH_SIZE):
+    # one 'network delete' command per batch, instead of one DELETE request per element
+    list_param = {'nodes': 'nodeList', 'edges': 'edgeList'}[kind]
+    for batch in batches(list(element_suids), batch_size):
+        client.post('commands/network/delete',
+                    {'network': f'SUID:{suid}', list_param: ','.join(f'SUID:{e}' for e in batch)})
+
+
+@instrumented('cytoscape_push')
+def push_network(nodes: pd.DataFrame, edges: pd.DataFrame, title, collection, client: CyRestClient = None,
+                 suid=None, batch_size=BATCH_SIZE, style=None) -> int:
+    """
+    Creates or updates a Cytoscape network from node and edge tables in bounded batches.
+    nodes needs an 'id' column, edges 'source', 'target' (node ids) and optionally 'interaction'; all columns are
+    uploaded as node/edge attributes. An existing network (given by SUID, or found by title) is diff-updated:
+    only missing nodes and edges are added, stale ones removed, and the attribute tables reloaded.
+    """
+    client = client or CyRestClient()
+    edges = edges.copy()
+    if 'interaction' not in edges.columns:
+        edges['interaction'] = 'interacts with'
+    edges['name'] = [edge_name(s, i, t) for s, i, t in zip(edges['source'], edges['interaction'], edges['target'])]
+    edges = edges.drop_duplicates(subset='name')
+    node_ids = pd.unique(pd.concat([nodes['id'], edges['source'], edges['target']], ignore_index=True))
+
+    if suid is None:
+        suid = find_network(client, title)
+    if suid is None:
+        suid = create_network(client, title, collection)
+        log.info(f'Created network {title} ({suid}).')
+        node_suids = dict()
+        existing_edges = pd.DataFrame(columns=['SUID', 'name'])
+    else:
+        current = table_rows(client, suid, 'defaultnode', ['SUID', 'id'])
+        keep = current['id'].isin(node_ids)
+        node_suids = dict(zip(current.loc[keep, 'id'], current.loc[keep, 'SUID']))
+        stale = current.loc[~keep, 'SUID']
+        # removing a node also removes its edges
+        delete_elements(client, suid, 'nodes', stale, batch_size)
+        existing_edges = table_rows(client, suid, 'defaultedge', ['SUID', 'name'])
+        stale_edges = existing_edges[~existing_edges['name'].isin(edges['name'])]
+        delete_elements(client, suid, 'edges', stale_edges['SUID'], batch_size)
+        existing_edges = existing_edges[existing_edges['name'].isin(edges['name'])]
+        log.info(f'Updating network {title} ({suid}): removed {len(stale)} nodes and {len(stale_edges)} edges.')
+
+    new_nodes = [n for n in node_ids if n not in node_suids]
+    node_suids.update(add_nodes(client, suid, new_nodes, batch_size))
+
+    new_edges = edges[~edges['name'].isin(existing_edges['name'])]
+    edge_suids = add_edges(client, suid, new_edges, node_suids, batch_size)
+    log.info(f'Added {len(new_nodes)} nodes and {len(edge_suids)} edges.')
+    count(rows=len(new_nodes) + len(edge_suids), nodes=len(node_ids), edges=len(edges))
+
+    # attribute tables are keyed by SUID, so the node 'name' column can hold the gene symbol while 'id' keeps
+    # the Ensembl id used to match nodes on the next update
+    node_table = nodes.drop_duplicates(subset='id').assign(SUID=lambda df: df['id'].map(node_suids))
+    load_table(client, suid, 'defaultnode', node_table, key='SUID', data_key='SUID', batch_size=batch_size)
+    edge_table = pd.concat([
+        pd.DataFrame({'SUID': edge_suids, 'name': new_edges['name'].values}),
+        existing_edges[['SUID', 'name']],
+    ]).merge(edges.drop(columns=['source', 'target']), on='name')
+    load_table(client, suid, 'defaultedge', edge_table, key='SUID', data_key='SUID', batch_size=batch_size)
+
+    if style is not None:
+        client.get(f'apply/styles/{urllib.parse.quote(style)}/{suid}')
+    return suid
@@ -0,0 +1,226 @@
+import logging
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.special import digamma, polygamma
+from scipy.stats import t as t_dist
+
+from enrichment import benjamini_hochberg
+from proteomics import COHORTS, load_cohort_peptides
+
+log = logging.getLogger('GO-db')
+
+AGGREGATIONS = ('sum', 'median', 'topn')
+
+
+def _codes(values) -> tuple:
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        return np.asarray(values.cat.codes), values.cat.categories
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def protein_matrix(peptides: pd.DataFrame, values=None, method='sum', n=3, protein_column='Proteins',
+                   sample_columns=('group', 'replicate')) -> pd.DataFrame:
+    """
+    Protein group x sample intensities aggregated from peptide rows, NaN where a sample has no peptide of the group.
+    method is 'sum', 'median' or 'topn' (mean of the n most intense peptides, Silva et al. 2006).
+    values default to the peptide 'Intensity' column; non-positive and missing values are ignored.
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f'Unknown aggregation {method}, expected one of {AGGREGATIONS}.')
+    values = np.asarray(peptides['Intensity'] if values is None else values, dtype=np.float64)
+    proteins, protein_index = _codes(peptides[protein_column])
+    samples, sample_index = pd.MultiIndex.from_frame(peptides[list(sample_columns)]).factorize(sort=True)
+
+    valid = (proteins >= 0) & (samples >= 0) & np.isfinite(values) & (values > 0)
+    n_samples = len(sample_index)
+    keys = proteins[valid].astype(np.int64) * n_samples + samples[valid]
+    values = values[valid]
+    size = len(protein_index) * n_samples
+    counts = np.bincount(keys, minlength=size)
+
+    if method == 'sum':
+        out = np.bincount(keys, weights=values, minlength=size)
+    elif method == 'median':
+        out = pd.Series(values).groupby(keys).median().reindex(np.arange(size)).values
+    else:
+        # sort descending within each key, then keep the first n ranks of each key
+        order = np.lexsort((-values, keys))
+        sorted_keys = keys[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_keys)) + 1]
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        top = rank < n
+        out = np.bincount(sorted_keys[top], weights=values[order][top], minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = out / np.minimum(counts, n)
+    out = np.where(counts > 0, out, np.nan).reshape(len(protein_index), n_samples)
+
+    columns = pd.MultiIndex.from_tuples(list(sample_index), names=list(sample_columns))
+    return pd.DataFrame(out, index=pd.Index(protein_index, name=protein_column), columns=columns)
+
+
+def normalize(matrix: pd.DataFrame, method='median') -> pd.DataFrame:
+    """
+    log2 intensities, with 'median' every sample (replicate) is shifted to the common median.
+    """
+    log2 = np.log2(matrix)
+    if method == 'median':
+        medians = log2.median(axis=0)
+        log2 = log2 - medians + medians.median()
+    elif method is not None and method != 'none':
+        raise ValueError(f'Unknown normalization {method}.')
+    return log2
+
+
+def trigamma_inverse(x: float) -> float:
+    # Newton iteration of limma's trigammaInverse
+    y = 0.5 + 1.0 / x
+    for _ in range(50):
+        tri = polygamma(1, y)
+        step = tri * (1 - tri / x) / polygamma(2, y)
+        y += step
+        if -step / y < 1e-8:
+            break
+    return y
+
+
+def fit_prior(s2: np.ndarray, df: np.ndarray) -> tuple:
+    """
+    Prior degrees of freedom d0 and variance s0^2 of the sample variances (Smyth 2004, moment estimates
+    on the log scale). d0 is inf when the variances are no more dispersed than sampling alone explains.
+    """
+    e = np.log(s2) - digamma(df / 2) + np.log(df / 2)
+    e_mean = e.mean()
+    e_var = ((e - e_mean) ** 2).sum() / (len(e) - 1) - polygamma(1, df / 2).mean()
+    if e_var > 0:
+        d0 = 2 * trigamma_inverse(e_var)
+        return d0, np.exp(e_mean + digamma(d0 / 2) - np.log(d0 / 2))
+    return np.inf, np.exp(e_mean)
+
+
+def moderated_t(log2: pd.DataFrame, groups=('A', 'B'), group_level='group', min_replicates=2) -> pd.DataFrame:
+    """
+    Difference of groups[1] over groups[0] for every protein at once, with empirical Bayes moderated
+    t-statistics (limma eBayes for a two group design) and BH adjusted p-values.
+    Proteins with fewer than min_replicates values in either group are left untested (NaN).
+    """
+    a = log2.xs(groups[0], axis=1, level=group_level).values
+    b = log2.xs(groups[1], axis=1, level=group_level).values
+    n_a, n_b = np.isfinite(a).sum(axis=1), np.isfinite(b).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_a, mean_b = np.nanmean(a, axis=1), np.nanmean(b, axis=1)
+        ss = np.nansum((a - mean_a[:, None]) ** 2, axis=1) + np.nansum((b - mean_b[:, None]) ** 2, axis=1)
+        df = (n_a + n_b - 2).astype(np.float64)
+        s2 = ss / df
+
+    tested = (n_a >= min_replicates) & (n_b >= min_replicates) & (s2 > 0)
+    d0, s0_2 = fit_prior(s2[tested], df[tested])
+    if np.isinf(d0):
+        s2_post = np.full(len(s2), s0_2)
+    else:
+        s2_post = (d0 * s0_2 + df * s2) / (d0 + df)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log2fc = mean_b - mean_a
+        t = log2fc / np.sqrt(s2_post * (1 / n_a + 1 / n_b))
+    df_total = df + d0
+    p = np.full(len(t), np.nan)
+    p[tested] = 2 * t_dist.sf(np.abs(t[tested]), df_total[tested])
+    q = np.full(len(t), np.nan)
+    q[tested] = benjamini_hochberg(np.zeros(tested.sum(), dtype=np.int64), p[tested], tested.sum())
+    log.info(f'moderated t: {tested.sum()} proteins tested, prior df {d0:.2f}, prior variance {s0_2:.4f}.')
+
+    return pd.DataFrame({
+        f'mean_{groups[0]}': mean_a,
+        f'mean_{groups[1]}': mean_b,
+        f'n_{groups[0]}': n_a,
+        f'n_{groups[1]}': n_b,
+        'log2fc': np.where(tested, log2fc, np.nan),
+        't': np.where(tested, t, np.nan),
+        'df': np.where(tested, df_total, np.nan),
+        'p': p,
+        'q': q,
+    }, index=log2.index)
+
+
+def differential_abundance(peptides: pd.DataFrame, groups=('A', 'B'), method='sum', n=3, normalization='median',
+                           min_replicates=2, values=None) -> pd.DataFrame:
+    matrix = protein_matrix(peptides, values=values, method=method, n=n)
+    return moderated_t(normalize(matrix, normalization), groups, min_replicates=min_replicates)
+
+
+def split_accessions(protein_groups) -> pd.DataFrame:
+    """
+    (protein group, accession) pairs of MaxQuant ids like 'P12345-2;CON__Q9Y6K9', isoform suffixes removed
+    and decoys dropped.
+    """
+    df = pd.DataFrame({'protein_group': pd.Index(protein_groups).astype(str)})
+    df['accession'] = df['protein_group'].str.split(';')
+    df = df.explode('accession')
+    df = df[~df['accession'].str.startswith('REV__')]
+    df['accession'] = df['accession'].str.replace(r'^CON__', '', regex=True).str.replace(r'-\d+$', '', regex=True)
+    return df.drop_duplicates(ignore_index=True)
+
+
+# Ensembl genes of the loaded accessions through HGNC (indexed on uniprot_ids) and the UniProt ID mapping
+# (a single pass over mapping probing the temp table), with the HGNC symbol of each gene
+SQL_PROTEIN_GENES = """
+    SELECT G.accession, G.Ensembl, H.symbol
+    FROM (
+        SELECT P.accession, H.ensembl_gene_id AS Ensembl
+        FROM temp.proteins AS P
+        CROSS JOIN hgnc H ON H.uniprot_ids = P.accession
+        WHERE H.ensembl_gene_id IS NOT NULL
+        UNION
+        SELECT M.UniProtKB_AC, M.Ensembl FROM mapping M
+        WHERE M.UniProtKB_AC IN (SELECT accession FROM temp.proteins)
+    ) AS G
+    LEFT JOIN hgnc H ON H.ensembl_gene_id = G.Ensembl;
+    """
+
+
+def map_to_genes(db: sqlite3.Connection, protein_groups) -> pd.DataFrame:
+    pairs = split_accessions(protein_groups)
+    cur = db.cursor()
+    cur.execute('DROP TABLE IF EXISTS temp.proteins;')
+    cur.execute('CREATE TEMP TABLE proteins ("accession" TEXT PRIMARY KEY) WITHOUT ROWID;')
+    cur.executemany('INSERT OR IGNORE INTO temp.proteins (accession) VALUES (?);',
+                    ((a,) for a in pairs['accession'].unique()))
+    genes = pd.DataFrame(cur.execute(SQL_PROTEIN_GENES).fetchall(), columns=['accession', 'Ensembl', 'symbol'])
+    cur.execute('DROP TABLE temp.proteins;')
+    return pairs.merge(genes, on='accession')
+
+
+def node_attributes(db_sqlite, results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Differential abundance per Ensembl gene, keyed by the node 'id' of the interactome networks.
+    When several protein groups map to one gene the most significant one is kept.
+    """
+    db = sqlite3.connect(f"file:{db_sqlite}?mode=ro", uri=True)
+    genes = map_to_genes(db, results.index)
+    db.close()
+
+    df = results.reset_index(names='protein_group').merge(genes.drop(columns='accession').drop_duplicates(),
+                                                          on='protein_group')
+    df = df.sort_values(by=['Ensembl', 'p'], na_position='last', kind='stable')
+    n_groups = df.groupby('Ensembl')['protein_group'].nunique()
+    df = df.drop_duplicates(subset='Ensembl').rename(columns={'Ensembl': 'id'})
+    df['protein_groups'] = df['id'].map(n_groups).values
+    log.info(f'{len(df)} genes with differential abundance from {len(results)} protein groups.')
+    return df.reset_index(drop=True)
+
+
+def annotate_nodes(nodes: pd.DataFrame, attributes: pd.DataFrame) -> pd.DataFrame:
+    return nodes.merge(attributes.drop(columns=['symbol'], errors='ignore'), on='id', how='left')
+
+
+if __name__ == '__main__':
+    folder = Path('/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/dev-proteome-vila2017-PXD005713/txt/')
+    db_sqlite = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go-interactome.db'
+
+    peptides, _ = load_cohort_peptides(folder, COHORTS)
+    results = differential_abundance(peptides, groups=('A', 'B'), method='topn', n=3)
+    print(results.sort_values(by='p').head(20))
+    print(node_attributes(db_sqlite, results))
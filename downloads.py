@@ -1,8 +1,71 @@
+import hashlib
+import json
+import logging
 import os
+import shutil
+import threading
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 
+from instrument import instrumented
+
+log = logging.getLogger('GO-db')
+
+DATA_FOLDER = 'data'
+# derived files (parsed ontology, graphs, identifier index) that can be rebuilt from the data at any time
+CACHE_FOLDER = os.path.join(DATA_FOLDER, '.cache')
+MANIFEST_FILE = '.manifest.json'
+CHUNK_SIZE = 1 << 20
+
+URLS = [
+    # ontologies
+    'http://geneontology.org/ontology/go.owl',
+    # ontologies from amigo
+    'http://purl.obolibrary.org/obo/cl/cl-simple.owl',
+    'http://purl.obolibrary.org/obo/wbbt.owl',
+    'http://purl.obolibrary.org/obo/uberon/basic.owl',
+    'http://purl.obolibrary.org/obo/po/imports/ncbitaxon_import.owl',
+    'http://purl.obolibrary.org/obo/eco/eco-basic.owl',
+    'http://purl.obolibrary.org/obo/chebi.owl',
+    'http://purl.obolibrary.org/obo/po.owl',
+    'http://purl.obolibrary.org/obo/go/extensions/go-gaf.owl',
+    'http://purl.obolibrary.org/obo/po/imports/ro_import.owl',
+    'http://purl.obolibrary.org/obo/go/extensions/gorel.owl',
+    'http://purl.obolibrary.org/obo/ncbitaxon/subsets/taxslim.owl',
+    'http://purl.obolibrary.org/obo/pato.owl',
+    'http://purl.obolibrary.org/obo/go/extensions/go-modules-annotations.owl',
+    'http://purl.obolibrary.org/obo/go/extensions/go-taxon-subsets.owl',
+
+    'http://geneontology.org/ontology/go.obo',
+    'http://ftp.ebi.ac.uk/pub/databases/genenames/hgnc/tsv/hgnc_complete_set.txt',
+    'http://www.interactome-atlas.org/data/HI-union.tsv',
+    'https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/idmapping_selected.tab.gz',
+    'http://geneontology.org/gene-associations/goa_human.gaf.gz',  # annotations for homo sapiens
+    'http://current.geneontology.org/annotations/fb.gaf.gz',  # annotations for drosophila
+
+    # annotations from amigo
+    'http://skyhook.berkeleybop.org/release/products/annotations/paint_other.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/aspgd.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/cgd.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/dictybase.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/ecocyc.gaf.gz',
+    # 'http://skyhook.berkeleybop.org/release/annotations/fb.gaf.gz',
+    # 'http://skyhook.berkeleybop.org/release/annotations/goa_human.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/goa_human_complex.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/goa_human_rna.gaf.gz',
+    'http://skyhook.berkeleybop.org/release/annotations/goa_uniprot_all_noiea.gaf.gz',
+
+    # annotations from StringDB
+    # 'https://stringdb-static.org/download/database.schema.v11.5.pdf',
+    'https://stringdb-static.org/download/items_schema.v11.5.sql.gz',
+    'https://stringdb-static.org/download/network_schema.v11.5.sql.gz',
+    'https://stringdb-static.org/download/evidence_schema.v11.5.sql.gz',
+    'https://stringdb.meringlab.org/download/homology_schema.v11.5.sql.gz',
+]
+
 
 class DownloadProgressBar(tqdm):
     def update_to(self, b=1, bsize=1, tsize=None):
@@ -11,61 +74,229 @@ class DownloadProgressBar(tqdm):
         self.update(b * bsize - self.n)
 
 
-def download_url(url, output_path):
-    if os.path.exists(output_path):
-        return
-    with DownloadProgressBar(unit='B', unit_scale=True,
-                             miniters=1, desc=url.split('/')[-1]) as t:
-        urllib.request.urlretrieve(url, filename=output_path, reporthook=t.update_to)
+def save_atomically(path, write, suffix=''):
+    """
+    Calls write(tmp_path) and renames the result onto path, so concurrent readers never see a half written file
+    or folder. suffix is kept at the end of the temporary name, for writers that append their own extension.
+    """
+    tmp_path = f'{path}.tmp{os.getpid()}{suffix}'
+    try:
+        write(tmp_path)
+        if os.path.isdir(tmp_path):
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # a folder cannot replace another one, some other process saved it first
+                shutil.rmtree(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Manifest:
+    """
+    Local record of completed downloads, keyed by output path.
+    Each entry keeps the url, size, ETag/Last-Modified validators and sha256 of the finished file.
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self._lock = threading.Lock()
+        self.entries = dict()
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.entries = json.load(f)
+
+    def get(self, output_path):
+        with self._lock:
+            return self.entries.get(os.path.abspath(output_path))
+
+    def is_complete(self, output_path) -> bool:
+        entry = self.get(output_path)
+        return (entry is not None and os.path.exists(output_path)
+                and os.path.getsize(output_path) == entry['size'])
+
+    def update(self, output_path, entry):
+        with self._lock:
+            self.entries[os.path.abspath(output_path)] = entry
+            self._save()
+
+    def _save(self):
+        def write(tmp_file):
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+        save_atomically(self.manifest_file, write)
+
+
+def sha256_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest
+
 
+def _head(url, timeout):
+    req = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return r.headers
 
-def download_to_data(url):
+
+def _adopt_existing(url, output_path, manifest, timeout):
+    # a file left by an older run without a manifest entry is only accepted if the server agrees on its size,
+    # otherwise it is turned into a partial download and resumed
+    part_path = f'{output_path}.part'
+    try:
+        size = int(_head(url, timeout).get('Content-Length', -1))
+    except (urllib.error.URLError, ValueError):
+        size = -1
+    if size == os.path.getsize(output_path):
+        log.info(f'Adopting existing file {output_path} into the manifest.')
+        manifest.update(output_path, {'url': url, 'size': size, 'etag': None, 'last_modified': None,
+                                      'sha256': sha256_file(output_path).hexdigest()})
+        return True
+    os.replace(output_path, part_path)
+    return False
+
+
+def download_url(url, output_path, manifest=None, timeout=60, position=None):
+    if manifest is None:
+        manifest = Manifest(os.path.join(os.path.dirname(os.path.abspath(output_path)), MANIFEST_FILE))
+    if manifest.is_complete(output_path):
+        return manifest.get(output_path)
+    if os.path.exists(output_path) and manifest.get(output_path) is None:
+        if _adopt_existing(url, output_path, manifest, timeout):
+            return manifest.get(output_path)
+
+    part_path = f'{output_path}.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = dict()
+    previous = manifest.get(output_path) or dict()
+    if offset > 0:
+        headers['Range'] = f'bytes={offset}-'
+        validator = previous.get('etag') or previous.get('last_modified')
+        if validator:
+            # if the remote file changed since the partial download, the server answers with the full body
+            headers['If-Range'] = validator
+
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        r = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or offset == 0:
+            raise
+        # the range starts at or past the end: the partial file is either complete (a crash right before the
+        # rename, or a complete file moved aside by _adopt_existing) or longer than the remote file
+        total = _range_total(e.headers.get('Content-Range'))
+        if total is None:
+            try:
+                total = int(_head(url, timeout).get('Content-Length', -1))
+            except (urllib.error.URLError, ValueError):
+                total = -1
+        if total == offset:
+            log.info(f'Partial download of {url} is already complete.')
+            return _finish(url, part_path, output_path, manifest, sha256_file(part_path),
+                           previous.get('etag'), previous.get('last_modified'))
+        log.warning(f'Partial download of {url} does not match the remote file, restarting.')
+        os.remove(part_path)
+        return download_url(url, output_path, manifest, timeout, position)
+
+    with r:
+        if r.status == 206:
+            start = _range_start(r.headers.get('Content-Range'))
+            if start != offset:
+                log.warning(f'Server resumed {url} at byte {start} instead of {offset}, restarting.')
+                r.close()
+                os.remove(part_path)
+                return download_url(url, output_path, manifest, timeout, position)
+            digest = sha256_file(part_path)
+            mode = 'ab'
+        else:
+            offset = 0
+            digest = hashlib.sha256()
+            mode = 'wb'
+        length = r.headers.get('Content-Length')
+        total = offset + int(length) if length is not None else None
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        manifest.update(output_path, {'url': url, 'size': None, 'etag': etag, 'last_modified': last_modified,
+                                      'sha256': None})
+
+        with open(part_path, mode) as f, \
+                DownloadProgressBar(unit='B', unit_scale=True, miniters=1, total=total, initial=offset,
+                                    position=position, leave=position is None,
+                                    desc=url.split('/')[-1]) as t:
+            for block in iter(lambda: r.read(CHUNK_SIZE), b''):
+                f.write(block)
+                digest.update(block)
+                t.update(len(block))
+
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise IOError(f'Incomplete download of {url}: got {size} of {total} bytes.')
+    return _finish(url, part_path, output_path, manifest, digest, etag, last_modified)
+
+
+def _range_start(content_range):
+    # "bytes 100-199/200" -> 100
+    try:
+        return int(content_range.split()[1].split('-', 1)[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _range_total(content_range):
+    # "bytes */200" or "bytes 100-199/200" -> 200, None when the length is unknown ("*")
+    try:
+        return int(content_range.rsplit('/', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _finish(url, part_path, output_path, manifest, digest, etag, last_modified):
+    size = os.path.getsize(part_path)
+    os.replace(part_path, output_path)
+    entry = {'url': url, 'size': size, 'etag': etag, 'last_modified': last_modified, 'sha256': digest.hexdigest()}
+    manifest.update(output_path, entry)
+    return entry
+
+
+def download_to_data(url, manifest=None, position=None):
     fname = os.path.basename(url)
-    download_url(url, os.path.abspath(os.path.join('data', fname)))
+    return download_url(url, os.path.abspath(os.path.join(DATA_FOLDER, fname)),
+                        manifest=manifest, position=position)
 
 
-def download_files():
-    # ontologies
-    download_to_data('http://geneontology.org/ontology/go.owl')
-    # ontologies from amigo
-    download_to_data('http://purl.obolibrary.org/obo/cl/cl-simple.owl')
-    download_to_data('http://purl.obolibrary.org/obo/wbbt.owl')
-    download_to_data('http://purl.obolibrary.org/obo/uberon/basic.owl')
-    download_to_data('http://purl.obolibrary.org/obo/po/imports/ncbitaxon_import.owl')
-    download_to_data('http://purl.obolibrary.org/obo/eco/eco-basic.owl')
-    download_to_data('http://purl.obolibrary.org/obo/chebi.owl')
-    download_to_data('http://purl.obolibrary.org/obo/po.owl')
-    download_to_data('http://purl.obolibrary.org/obo/go/extensions/go-gaf.owl')
-    download_to_data('http://purl.obolibrary.org/obo/po/imports/ro_import.owl')
-    download_to_data('http://purl.obolibrary.org/obo/go/extensions/gorel.owl')
-    download_to_data('http://purl.obolibrary.org/obo/ncbitaxon/subsets/taxslim.owl')
-    download_to_data('http://purl.obolibrary.org/obo/pato.owl')
-    download_to_data('http://purl.obolibrary.org/obo/go/extensions/go-modules-annotations.owl')
-    download_to_data('http://purl.obolibrary.org/obo/go/extensions/go-taxon-subsets.owl')
-
-    download_to_data('http://geneontology.org/ontology/go.obo')
-    download_to_data('http://ftp.ebi.ac.uk/pub/databases/genenames/hgnc/tsv/hgnc_complete_set.txt')
-    download_to_data('http://www.interactome-atlas.org/data/HI-union.tsv')
-    download_to_data(
-        'https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/idmapping_selected.tab.gz')
-    download_to_data('http://geneontology.org/gene-associations/goa_human.gaf.gz')  # annotations for homo sapiens
-    download_to_data('http://current.geneontology.org/annotations/fb.gaf.gz')  # annotations for drosophila
+def download_all(urls, workers=4, data_folder=DATA_FOLDER):
+    os.makedirs(data_folder, exist_ok=True)
+    manifest = Manifest(os.path.join(data_folder, MANIFEST_FILE))
+    failed = dict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_url, url, os.path.abspath(os.path.join(data_folder, os.path.basename(url))),
+                               manifest, 60, i % workers): url
+                   for i, url in enumerate(urls)}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                future.result()
+            except (urllib.error.URLError, IOError) as e:
+                log.error(f'Download of {url} failed: {e}')
+                failed[url] = e
+    return failed
 
-    # annotations from amigo
-    download_to_data('http://skyhook.berkeleybop.org/release/products/annotations/paint_other.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/aspgd.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/cgd.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/dictybase.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/ecocyc.gaf.gz')
-    # download_to_data('http://skyhook.berkeleybop.org/release/annotations/fb.gaf.gz')
-    # download_to_data('http://skyhook.berkeleybop.org/release/annotations/goa_human.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/goa_human_complex.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/goa_human_rna.gaf.gz')
-    download_to_data('http://skyhook.berkeleybop.org/release/annotations/goa_uniprot_all_noiea.gaf.gz')
 
-    # annotations from StringDB
-    # download_to_data('https://stringdb-static.org/download/database.schema.v11.5.pdf')
-    download_to_data('https://stringdb-static.org/download/items_schema.v11.5.sql.gz')
-    download_to_data('https://stringdb-static.org/download/network_schema.v11.5.sql.gz')
-    download_to_data('https://stringdb-static.org/download/evidence_schema.v11.5.sql.gz')
-    download_to_data('https://stringdb.meringlab.org/download/homology_schema.v11.5.sql.gz')
+@instrumented('download')
+def download_files(workers=4, data_folder=DATA_FOLDER):
+    """
+    Downloads every file of URLS, raising once all are done if any failed, so a build never runs on missing
+    or stale inputs.
+    """
+    failed = download_all(URLS, workers=workers, data_folder=data_folder)
+    if failed:
+        raise IOError(f'{len(failed)} of {len(URLS)} downloads failed: {", ".join(failed)}') \
+            from next(iter(failed.values()))
@@ -0,0 +1,154 @@
+import logging
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.stats import hypergeom
+
+from go_closure import closure_is_current, compute_closure
+from ontology import DEFAULT_RELATIONSHIPS, load_ontology, relationship_set_key
+
+log = logging.getLogger('GO-db')
+
+
+class AnnotationMatrix:
+    """
+    Sparse genes x terms matrix of GO annotations propagated to all ancestor terms.
+    Genes are the UniProtKB accessions of the annotations table, optionally restricted to a universe.
+    """
+
+    def __init__(self, genes: np.ndarray, terms: np.ndarray, matrix: csr_matrix):
+        self.genes = genes
+        self.terms = terms
+        self.matrix = matrix
+        self.gene_index = pd.Index(genes)
+        self.term_sizes = np.asarray(matrix.sum(axis=0)).ravel()
+
+    @classmethod
+    def from_db(cls, db: sqlite3.Connection, relationships=DEFAULT_RELATIONSHIPS, evidence_codes=None,
+                universe=None, obo_file='data/go.obo'):
+        sql = "SELECT DISTINCT id, goId FROM annotations WHERE db='UniProtKB'"
+        params = list()
+        if evidence_codes:
+            sql += f' AND evidenceCode IN ({", ".join("?" * len(evidence_codes))})'
+            params += list(evidence_codes)
+        direct = pd.read_sql(sql, db, params=params)
+        if universe is not None:
+            direct = direct[direct['id'].isin(set(universe))]
+
+        closure = ancestor_pairs(db, relationships, obo_file)
+        genes, gene_codes = np.unique(direct['id'].values.astype(str), return_inverse=True)
+        terms = np.unique(np.concatenate([closure['descendant'].values, closure['ancestor'].values]).astype(str))
+        term_index = pd.Index(terms)
+
+        # annotations to terms missing from the ontology (obsolete ids) are dropped
+        term_codes = term_index.get_indexer(direct['goId'].values.astype(str))
+        known = term_codes >= 0
+        a = coo_matrix((np.ones(known.sum(), dtype=np.int32), (gene_codes[known], term_codes[known])),
+                       shape=(len(genes), len(terms))).tocsr()
+        up = coo_matrix((np.ones(len(closure), dtype=np.int32),
+                         (term_index.get_indexer(closure['descendant'].values),
+                          term_index.get_indexer(closure['ancestor'].values))),
+                        shape=(len(terms), len(terms))).tocsr()
+
+        propagated = (a @ up).tocsr()
+        propagated.data[:] = 1
+        propagated = propagated.astype(np.int8)
+        # keep only terms with at least one gene in the population
+        used = np.flatnonzero(np.asarray(propagated.sum(axis=0)).ravel() > 0)
+        return cls(genes, terms[used], propagated[:, used].tocsr())
+
+    def query_matrix(self, gene_sets) -> csr_matrix:
+        """
+        Sparse sets x genes indicator matrix, genes outside the population are ignored.
+        """
+        rows, cols = list(), list()
+        for i, gene_set in enumerate(gene_sets):
+            codes = self.gene_index.get_indexer(pd.Index(list(set(gene_set)), dtype=object))
+            codes = codes[codes >= 0]
+            rows.append(np.full(len(codes), i))
+            cols.append(codes)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        return coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                          shape=(len(gene_sets), len(self.genes))).tocsr()
+
+
+def ancestor_pairs(db: sqlite3.Connection, relationships, obo_file='data/go.obo') -> pd.DataFrame:
+    """
+    (descendant, ancestor) pairs of the ontology closure, self pairs included.
+    Read from the go_closure table when it was built for this relationship set from this release of obo_file,
+    computed otherwise.
+    """
+    if closure_is_current(db, obo_file, relationships):
+        return pd.read_sql('SELECT descendant, ancestor FROM go_closure WHERE relationship_set=?;', db,
+                           params=[relationship_set_key(relationships)])
+
+    closure = compute_closure(load_ontology(obo_file, relationships).go2parents())
+    return pd.DataFrame([(d, a) for d, ancestors in closure.items() for a in ancestors],
+                        columns=['descendant', 'ancestor'])
+
+
+def benjamini_hochberg(set_ids: np.ndarray, pvalues: np.ndarray, n_tests: int) -> np.ndarray:
+    """
+    BH adjusted p-values computed independently for each gene set.
+    Only the listed p-values are ranked, the remaining n_tests of each set are assumed to be 1.
+    """
+    order = np.lexsort((pvalues, set_ids))
+    sorted_sets, sorted_p = set_ids[order], pvalues[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_sets)) + 1]
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)])) + 1
+    q = sorted_p * n_tests / ranks
+    # running minimum from the largest p-value down, within each set
+    q = pd.Series(q[::-1]).groupby(sorted_sets[::-1]).cummin().values[::-1]
+    adjusted = np.empty_like(q)
+    adjusted[order] = np.minimum(q, 1.0)
+    return adjusted
+
+
+def enrich(annotations: AnnotationMatrix, gene_sets, min_term_size=1, max_term_size=None, alpha=None,
+           set_names=None) -> pd.DataFrame:
+    """
+    Over-representation of every term in every gene set at once (one-sided hypergeometric test,
+    equivalent to Fisher's exact test for enrichment), BH-corrected over the tested terms of each set.
+    """
+    gene_sets = list(gene_sets)
+    set_names = list(range(len(gene_sets))) if set_names is None else list(set_names)
+    tested = annotations.term_sizes >= min_term_size
+    if max_term_size is not None:
+        tested &= annotations.term_sizes <= max_term_size
+    tested_terms = np.flatnonzero(tested)
+
+    q = annotations.query_matrix(gene_sets)
+    set_sizes = np.asarray(q.sum(axis=1)).ravel()
+    overlap = (q @ annotations.matrix[:, tested_terms]).tocoo()
+
+    population = len(annotations.genes)
+    k = overlap.data.astype(np.int64)
+    big_k = annotations.term_sizes[tested_terms][overlap.col]
+    n = set_sizes[overlap.row]
+    # the same (k, K, n) triple recurs across sets and terms, evaluate each distinct one once
+    radix = population + 1
+    if radix ** 3 < np.iinfo(np.int64).max:
+        keys, inverse = np.unique((k * radix + big_k) * radix + n, return_inverse=True)
+        triples = np.stack([keys // (radix * radix), keys // radix % radix, keys % radix])
+    else:
+        triples, inverse = np.unique(np.stack([k, big_k, n]), axis=1, return_inverse=True)
+    pvalues = hypergeom.sf(triples[0] - 1, population, triples[1], triples[2])[inverse.ravel()]
+    qvalues = benjamini_hochberg(overlap.row, pvalues, len(tested_terms))
+
+    df = pd.DataFrame({
+        'set': np.asarray(set_names, dtype=object)[overlap.row],
+        'goId': annotations.terms[tested_terms][overlap.col],
+        'k': k,
+        'n': n,
+        'K': big_k,
+        'N': population,
+        'fold': (k / n) / (big_k / population),
+        'p': pvalues,
+        'q': qvalues,
+    })
+    if alpha is not None:
+        df = df[df['q'] <= alpha]
+    return df.sort_values(by=['set', 'p'], kind='stable', ignore_index=True)
@@ -0,0 +1,133 @@
+import logging
+import os
+from xml.sax.saxutils import quoteattr, escape
+
+import numpy as np
+import pandas as pd
+
+from instrument import count, instrumented
+
+log = logging.getLogger('GO-db')
+
+# writers for single tables, called as writer(df, path)
+TABLE_EXPORTERS = dict()
+# writers for the network, called as writer(nodes, edges, path)
+GRAPH_EXPORTERS = dict()
+
+
+def table_exporter(fmt, extension):
+    def register(writer):
+        TABLE_EXPORTERS[fmt] = (writer, extension)
+        return writer
+    return register
+
+
+def graph_exporter(fmt, extension):
+    def register(writer):
+        GRAPH_EXPORTERS[fmt] = (writer, extension)
+        return writer
+    return register
+
+
+@table_exporter('parquet', '.parquet')
+def write_parquet(df: pd.DataFrame, path):
+    df.to_parquet(path, index=False)
+
+
+@table_exporter('feather', '.feather')
+def write_feather(df: pd.DataFrame, path):
+    df.reset_index(drop=True).to_feather(path)
+
+
+@table_exporter('tsv', '.tsv')
+def write_tsv(df: pd.DataFrame, path):
+    df.to_csv(path, sep='\t', index=False)
+
+
+@graph_exporter('sif', '.sif')
+def write_sif(nodes: pd.DataFrame, edges: pd.DataFrame, path):
+    interaction = edges['interaction'] if 'interaction' in edges.columns else 'interacts'
+    pd.DataFrame({'source': edges['source'], 'interaction': interaction, 'target': edges['target']}) \
+        .to_csv(path, sep='\t', index=False, header=False)
+
+
+@graph_exporter('edgelist', '.edges.tsv')
+def write_edgelist(nodes: pd.DataFrame, edges: pd.DataFrame, path):
+    edges.to_csv(path, sep='\t', index=False)
+
+
+def _graphml_type(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series):
+        return 'long'
+    if pd.api.types.is_float_dtype(series):
+        return 'double'
+    return 'string'
+
+
+def _graphml_data(row, keys) -> str:
+    return ''.join(f'<data key="{k}">{escape(str(v))}</data>'
+                   for k, v in zip(keys, row) if not (isinstance(v, float) and np.isnan(v)) and v is not None)
+
+
+@graph_exporter('graphml', '.graphml')
+def write_graphml(nodes: pd.DataFrame, edges: pd.DataFrame, path):
+    node_attrs = [c for c in nodes.columns if c != 'id']
+    edge_attrs = [c for c in edges.columns if c not in ('source', 'target')]
+    node_keys = [f'n{i}' for i in range(len(node_attrs))]
+    edge_keys = [f'e{i}' for i in range(len(edge_attrs))]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for key, c in zip(node_keys, node_attrs):
+            f.write(f'<key id="{key}" for="node" attr.name={quoteattr(c)} attr.type="{_graphml_type(nodes[c])}"/>\n')
+        for key, c in zip(edge_keys, edge_attrs):
+            f.write(f'<key id="{key}" for="edge" attr.name={quoteattr(c)} attr.type="{_graphml_type(edges[c])}"/>\n')
+        f.write('<graph edgedefault="undirected">\n')
+        for node_id, *row in nodes[['id'] + node_attrs].itertuples(index=False, name=None):
+            f.write(f'<node id={quoteattr(str(node_id))}>{_graphml_data(row, node_keys)}</node>\n')
+        for source, target, *row in edges[['source', 'target'] + edge_attrs].itertuples(index=False, name=None):
+            f.write(f'<edge source={quoteattr(str(source))} target={quoteattr(str(target))}>'
+                    f'{_graphml_data(row, edge_keys)}</edge>\n')
+        f.write('</graph>\n</graphml>\n')
+
+
+def write_excel(tables: dict, excel_file):
+    # a single write of all sheets, the workbook is never re-opened
+    with pd.ExcelWriter(excel_file, mode='w') as writer:
+        for sheet, df in tables.items():
+            df.to_excel(writer, sheet_name=sheet[:31], index=False)
+
+
+@instrumented('export')
+def export_results(out_folder, tables: dict, nodes: pd.DataFrame = None, edges: pd.DataFrame = None,
+                   formats=('parquet',), graph_formats=('sif', 'graphml'), excel_file=None, prefix='') -> list:
+    """
+    Writes every table in each tabular format and the network (nodes with an 'id' column, edges with
+    'source'/'target') in each graph format, in one pass. Excel, when requested, is written last and once.
+    Returns the written paths.
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    written = list()
+    for fmt in formats:
+        writer, extension = TABLE_EXPORTERS[fmt]
+        for name, df in tables.items():
+            path = os.path.join(out_folder, f'{prefix}{name}{extension}')
+            writer(df, path)
+            count(rows=len(df))
+            written.append(path)
+    if edges is not None:
+        if nodes is None:
+            nodes = pd.DataFrame({'id': pd.unique(pd.concat([edges['source'], edges['target']]))})
+        for fmt in graph_formats:
+            writer, extension = GRAPH_EXPORTERS[fmt]
+            path = os.path.join(out_folder, f'{prefix}network{extension}')
+            writer(nodes, edges, path)
+            count(rows=len(nodes) + len(edges))
+            written.append(path)
+    if excel_file is not None:
+        write_excel(tables, excel_file)
+        written.append(excel_file)
+    log.info(f'Exported {len(written)} files to {out_folder}.')
+    return written
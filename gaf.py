@@ -0,0 +1,173 @@
+import gzip
+import logging
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Full
+
+log = logging.getLogger('GO-db')
+
+# every GAF fetched by downloads.download_files
+GAF_FILES = [
+    'data/goa_human.gaf.gz',
+    'data/fb.gaf.gz',
+    'data/paint_other.gaf.gz',
+    'data/aspgd.gaf.gz',
+    'data/cgd.gaf.gz',
+    'data/dictybase.gaf.gz',
+    'data/ecocyc.gaf.gz',
+    'data/goa_human_complex.gaf.gz',
+    'data/goa_human_rna.gaf.gz',
+    'data/goa_uniprot_all_noiea.gaf.gz',
+]
+
+# GAF 2.x column positions of the fields stored in the annotations table
+GAF_COLUMNS = {
+    'db': 0,
+    'id': 1,
+    'objectSymbol': 2,
+    'goId': 4,
+    'evidenceCode': 6,
+    'aspect': 8,
+    'objectName': 9,
+    'objectType': 11,
+    'taxon': 12,
+    'date': 13,
+    'assignedBy': 14,
+    'annotationExtension': 15,
+    'geneProductFromId': 16,
+}
+ANNOTATION_FIELDS = list(GAF_COLUMNS.keys()) + ['source']
+GAF_WIDTH = 17
+
+_queue = None
+_cancel = None
+
+
+def gaf_source(path) -> str:
+    name = os.path.basename(path)
+    for ext in ('.gz', '.gaf'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def parse_gaf_line(line, source):
+    """
+    Splits one GAF line into an annotations row, without building a dict per record.
+    GAF 1.0 lines lack the last two columns and are padded with empty values.
+    """
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) < GAF_WIDTH:
+        fields.extend([''] * (GAF_WIDTH - len(fields)))
+    row = [fields[i] for i in GAF_COLUMNS.values()]
+    # keep the primary taxon only, "taxon:9606|taxon:11676" -> 9606
+    taxon = row[8].split('|', 1)[0]
+    row[8] = int(taxon[6:]) if taxon.startswith('taxon:') and taxon[6:].isdigit() else None
+    row.append(source)
+    return tuple(row)
+
+
+def iter_gaf_batches(path, batch_size=100_000, source=None):
+    source = source or gaf_source(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    batch = list()
+    with opener(path, 'rt', encoding='utf-8') as handle:
+        for line in handle:
+            if line.startswith('!') or not line.strip():
+                continue
+            batch.append(parse_gaf_line(line, source))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = list()
+    if batch:
+        yield batch
+
+
+def _init_worker(queue, cancel):
+    global _queue, _cancel
+    _queue = queue
+    _cancel = cancel
+
+
+def _put(item) -> bool:
+    # blocks while the queue is full, but gives up once the writer cancelled the load
+    while not _cancel.is_set():
+        try:
+            _queue.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _parse_to_queue(path, batch_size):
+    source = gaf_source(path)
+    rows = 0
+    try:
+        for batch in iter_gaf_batches(path, batch_size, source):
+            if not _put(batch):
+                return rows
+            rows += len(batch)
+    finally:
+        # always signal the writer, failures are re-raised from the future
+        _put(source)
+    return rows
+
+
+def _drain(queue, futures, timeout=1):
+    # keeps reading so workers blocked on a full queue (or flushing it on exit) can finish
+    while True:
+        try:
+            queue.get(timeout=timeout)
+        except Empty:
+            if all(f.done() for f in futures):
+                return
+
+
+def load_gaf_files(db, table, gaf_files, workers=None, batch_size=100_000, max_pending=32, poll_interval=5):
+    """
+    Parses the GAF files in a process pool and inserts all rows through the calling connection.
+    Workers hand over row batches through a bounded queue, so memory stays flat no matter how large a file is,
+    and decompression/parsing of each file overlaps with the single SQLite writer.
+    """
+    cur = db.cursor()
+    insert_sql = (f'INSERT INTO "{table}" ({", ".join(ANNOTATION_FIELDS)}) '
+                  f'VALUES ({", ".join("?" * len(ANNOTATION_FIELDS))});')
+    workers = workers or min(len(gaf_files), os.cpu_count() or 1)
+    ctx = mp.get_context()
+
+    rows = 0
+    queue = ctx.Queue(maxsize=max_pending)
+    cancel = ctx.Event()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(queue, cancel)) as pool:
+        futures = [pool.submit(_parse_to_queue, path, batch_size) for path in gaf_files]
+        try:
+            pending = len(futures)
+            while pending:
+                try:
+                    item = queue.get(timeout=poll_interval)
+                except Empty:
+                    # a worker that died never sends its sentinel, its future fails instead
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+                    continue
+                if isinstance(item, str):
+                    pending -= 1
+                    log.info(f'GAF source {item} parsed.')
+                    continue
+                cur.executemany(insert_sql, item)
+                rows += len(item)
+            for future in futures:
+                future.result()
+        except BaseException:
+            # stop the workers before the pool waits for them
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            _drain(queue, futures)
+            raise
+    db.commit()
+    return rows
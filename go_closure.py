@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+from collections import deque
+
+from build_state import get_state, record_state, sources_digest, table_exists
+from instrument import count, instrumented
+from ontology import DEFAULT_RELATIONSHIPS, Ontology, load_ontology, relationship_set_key
+
+log = logging.getLogger('GO-db')
+
+GO_CLOSURE_DDL = '''CREATE TABLE IF NOT EXISTS "go_closure" (
+                    "ancestor"	TEXT NOT NULL,
+                    "descendant"	TEXT NOT NULL,
+                    "relationship_set"	TEXT NOT NULL,
+                    "depth"	INTEGER NOT NULL,
+                    PRIMARY KEY ("relationship_set", "ancestor", "descendant")
+                ) WITHOUT ROWID;'''
+GO_CLOSURE_INDEX = '''CREATE INDEX IF NOT EXISTS "go_closure_desc_index" ON "go_closure" (
+                    "relationship_set" ASC,
+                    "descendant" ASC,
+                    "ancestor" ASC
+                );'''
+
+
+def topological_order(go2parents: dict) -> list:
+    """
+    Kahn's algorithm, returns every term after all of its parents.
+    """
+    terms = set(go2parents.keys()).union(*go2parents.values())
+    go2children = {t: list() for t in terms}
+    pending = dict()
+    for term in terms:
+        parents = go2parents.get(term, ())
+        pending[term] = len(parents)
+        for p in parents:
+            go2children[p].append(term)
+
+    queue = deque(sorted(t for t, n in pending.items() if n == 0))
+    order = list()
+    while queue:
+        term = queue.popleft()
+        order.append(term)
+        for child in go2children[term]:
+            pending[child] -= 1
+            if pending[child] == 0:
+                queue.append(child)
+    if len(order) != len(terms):
+        raise ValueError('The ontology graph contains a cycle for the selected relationships.')
+    return order
+
+
+def compute_closure(go2parents: dict) -> dict:
+    """
+    Maps every term to {ancestor: shortest depth}, including itself at depth 0.
+    Each term is visited once in topological order and merges the already complete closures of its parents,
+    so shared subgraphs are never walked again.
+    """
+    closure = dict()
+    for term in topological_order(go2parents):
+        ancestors = {term: 0}
+        for p in go2parents.get(term, ()):
+            for a, d in closure[p].items():
+                if d + 1 < ancestors.get(a, d + 2):
+                    ancestors[a] = d + 1
+        closure[term] = ancestors
+    return closure
+
+
+@instrumented()
+def build_go_closure(db_sqlite_file, obo_file='data/go.obo', relationships=DEFAULT_RELATIONSHIPS,
+                     ontology: Ontology = None, force=False):
+    rel_key = relationship_set_key(relationships)
+    state_name = f'go_closure[{rel_key}]'
+    digest = sources_digest(obo_file, relationships=rel_key)
+
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        if not force and table_exists(db, 'go_closure') and get_state(db, state_name) == digest:
+            log.info(f'Table go_closure is up to date for {rel_key}, skipping.')
+            return
+
+        if ontology is None:
+            ontology = load_ontology(obo_file, relationships)
+        closure = compute_closure(ontology.go2parents())
+
+        db.commit()
+        db.execute('BEGIN;')
+        try:
+            db.execute(GO_CLOSURE_DDL)
+            db.execute('DELETE FROM go_closure WHERE relationship_set=?;', (rel_key,))
+            db.executemany('INSERT INTO go_closure (ancestor, descendant, relationship_set, depth) '
+                           'VALUES (?, ?, ?, ?);',
+                           ((a, term, rel_key, d) for term, ancestors in closure.items() for a, d in ancestors.items()))
+            db.execute(GO_CLOSURE_INDEX)
+            record_state(db, state_name, digest, sources=[obo_file])
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        db.execute('ANALYZE go_closure;')
+        count(rows=sum(len(ancestors) for ancestors in closure.values()))
+        log.info(f'Table go_closure built for {rel_key}: {len(closure)} terms.')
+    finally:
+        db.close()
+
+
+def closure_is_current(db: sqlite3.Connection, obo_file='data/go.obo', relationships=DEFAULT_RELATIONSHIPS) -> bool:
+    """
+    True when go_closure holds the relationship set, built from this release of obo_file.
+    """
+    rel_key = relationship_set_key(relationships)
+    # get_state would create build_state, which fails on read-only connections
+    if not (table_exists(db, 'go_closure') and table_exists(db, 'build_state')):
+        return False
+    return get_state(db, f'go_closure[{rel_key}]') == sources_digest(obo_file, relationships=rel_key)
+
+
+def expand_term_sets(db: sqlite3.Connection, roots, relationships=DEFAULT_RELATIONSHIPS) -> list:
+    """
+    Members of many term sets in one indexed query. roots are (name, root term, min_depth) triples, min_depth 1
+    leaves the root itself out; returns the distinct (name, term) pairs.
+    """
+    roots = list(roots)
+    if not roots:
+        return list()
+    values = ', '.join(['(?, ?, ?)'] * len(roots))
+    sql = f'''WITH roots (name, root, min_depth) AS (VALUES {values})
+              SELECT DISTINCT R.name, C.descendant FROM roots AS R
+              CROSS JOIN go_closure AS C ON C.relationship_set = ? AND C.ancestor = R.root
+              WHERE C.depth >= R.min_depth'''
+    params = [v for r in roots for v in r] + [relationship_set_key(relationships)]
+    return db.execute(sql, params).fetchall()
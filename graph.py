@@ -0,0 +1,168 @@
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from build_state import get_state, table_exists
+from downloads import CACHE_FOLDER, save_atomically
+from interning import identifiers_current
+
+log = logging.getLogger('GO-db')
+
+
+class InteractomeGraph:
+    """
+    The interactome table held in memory: Ensembl ids interned to 0..n-1, the edge list as two index arrays
+    (in table order, self-interactions and duplicates kept) and a symmetric CSR adjacency for traversals.
+    """
+
+    def __init__(self, ids: np.ndarray, src: np.ndarray, dst: np.ndarray, digest=''):
+        self.ids = ids
+        self.src = src
+        self.dst = dst
+        self.digest = digest
+        self.index = pd.Index(ids)
+
+        n = len(ids)
+        # undirected adjacency, each interaction listed from both ends
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order].astype(np.int32)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_edges(cls, p1, p2, digest=''):
+        ids, inverse = np.unique(np.concatenate([np.asarray(p1, dtype=str), np.asarray(p2, dtype=str)]),
+                                 return_inverse=True)
+        inverse = inverse.astype(np.int32)
+        return cls(ids, inverse[:len(p1)], inverse[len(p1):], digest)
+
+    @classmethod
+    def from_db(cls, db: sqlite3.Connection):
+        digest = get_state(db, 'interactome') or ''
+        if table_exists(db, 'interactome_ids') and identifiers_current(db):
+            # interned ids are numbered in accession order, so nodes come out in the same order as from_edges
+            df = pd.read_sql('SELECT p1, p2 FROM interactome_ids;', db)
+            codes, inverse = np.unique(np.concatenate([df['p1'].values, df['p2'].values]), return_inverse=True)
+            accessions = pd.read_sql("SELECT id, accession FROM identifiers WHERE type='ensembl';", db,
+                                     index_col='id')['accession']
+            ids = accessions.reindex(codes).to_numpy(dtype=str)
+            inverse = inverse.astype(np.int32)
+            return cls(ids, inverse[:len(df)], inverse[len(df):], digest)
+        df = pd.read_sql('SELECT p1, p2 FROM interactome;', db)
+        return cls.from_edges(df['p1'].values, df['p2'].values, digest)
+
+    @classmethod
+    def load(cls, npz_file):
+        with np.load(npz_file, allow_pickle=False) as npz:
+            return cls(npz['ids'], npz['src'], npz['dst'], str(npz['digest']))
+
+    def save(self, npz_file):
+        save_atomically(npz_file, lambda tmp_file: np.savez(tmp_file, ids=self.ids, src=self.src, dst=self.dst,
+                                                            digest=np.array(self.digest)), suffix='.npz')
+
+    def mask(self, ids) -> np.ndarray:
+        """
+        Boolean node mask of the given Ensembl ids, ids not in the interactome are ignored.
+        """
+        positions = self.index.get_indexer(pd.Index(np.asarray(ids, dtype=str)))
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[positions[positions >= 0]] = True
+        return mask
+
+    def edge_mask(self, mask: np.ndarray) -> np.ndarray:
+        return mask[self.src] & mask[self.dst]
+
+    def induced_edges(self, mask: np.ndarray) -> pd.DataFrame:
+        """
+        Edges with both ends in mask, as Ensembl id pairs in interactome order.
+        """
+        keep = self.edge_mask(mask)
+        return pd.DataFrame({'p1': self.ids[self.src[keep]], 'p2': self.ids[self.dst[keep]]})
+
+    def expand(self, mask: np.ndarray, k=1) -> np.ndarray:
+        """
+        Nodes within k hops of mask.
+        """
+        reached = mask.copy()
+        frontier = np.flatnonzero(mask)
+        for _ in range(k):
+            if frontier.size == 0:
+                break
+            starts, ends = self.indptr[frontier], self.indptr[frontier + 1]
+            lengths = ends - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            neighbours = self.indices[offsets + np.arange(lengths.sum())]
+            neighbours = np.unique(neighbours[~reached[neighbours]])
+            reached[neighbours] = True
+            frontier = neighbours
+        return reached
+
+    def degrees(self, mask: np.ndarray = None) -> np.ndarray:
+        """
+        Degree of every node, counting only edges of the subgraph induced by mask when given.
+        """
+        keep = np.ones(len(self.src), dtype=bool) if mask is None else self.edge_mask(mask)
+        return (np.bincount(self.src[keep], minlength=len(self.ids))
+                + np.bincount(self.dst[keep], minlength=len(self.ids)))
+
+    def components(self, mask: np.ndarray) -> np.ndarray:
+        """
+        Connected component label of each node of the induced subgraph, -1 outside of mask.
+        """
+        nodes = np.flatnonzero(mask)
+        keep = self.edge_mask(mask)
+        local = np.full(len(self.ids), -1, dtype=np.int64)
+        local[nodes] = np.arange(len(nodes))
+        adjacency = csr_matrix((np.ones(keep.sum(), dtype=np.int8), (local[self.src[keep]], local[self.dst[keep]])),
+                               shape=(len(nodes), len(nodes)))
+        _, labels = connected_components(adjacency, directed=False)
+        out = np.full(len(self.ids), -1, dtype=np.int64)
+        out[nodes] = labels
+        return out
+
+    def stats(self, mask: np.ndarray) -> dict:
+        keep = self.edge_mask(mask)
+        labels = self.components(mask)[mask]
+        sizes = np.bincount(labels) if labels.size else np.zeros(0, dtype=np.int64)
+        degrees = self.degrees(mask)[mask]
+        return {
+            'nodes': int(mask.sum()),
+            'edges': int(keep.sum()),
+            'mean_degree': float(degrees.mean()) if degrees.size else 0.0,
+            'max_degree': int(degrees.max()) if degrees.size else 0,
+            'isolated': int((degrees == 0).sum()),
+            'components': int(len(sizes)),
+            'largest_component': int(sizes.max()) if sizes.size else 0,
+        }
+
+
+def load_graph(db_sqlite, cache_folder=CACHE_FOLDER) -> InteractomeGraph:
+    """
+    Interactome graph of the database, reused from the .npz cache while the interactome table is unchanged.
+    """
+    db = sqlite3.connect(f"file:{db_sqlite}", uri=True)
+    digest = get_state(db, 'interactome') or ''
+    npz_file = None
+    if cache_folder is not None and digest:
+        os.makedirs(cache_folder, exist_ok=True)
+        npz_file = os.path.join(cache_folder, f'interactome-{digest[:16]}.npz')
+        if os.path.exists(npz_file):
+            db.close()
+            return InteractomeGraph.load(npz_file)
+
+    graph = InteractomeGraph.from_db(db)
+    db.close()
+    log.info(f'Interactome graph: {len(graph)} nodes, {len(graph.src)} edges.')
+    if npz_file is not None:
+        graph.save(npz_file)
+    return graph
@@ -0,0 +1,173 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+
+from interactomes import HURI
+from termsets import CATEGORIES_FILE, load_categories, resolve_categories
+
+log = logging.getLogger('GO-db')
+
+# indexes derived from the queries in load_to_cytoscape, name -> (table, columns)
+INDEXES = {
+    # SQL_FILTERED_INSERT: M.Ensembl = H.ensembl_gene_id, covering the UniProt accession
+    'map_index': ('mapping', ['Ensembl', 'UniProtKB_AC']),
+    # SQL_FILTERED_INSERT: A.goId = T.goId AND A.db = 'UniProtKB', covering id and the evidence filter
+    'annotations_go_index': ('annotations', ['goId', 'db', 'id', 'evidenceCode']),
+    # SQL_FILTERED_INSERT: U.uniprot = G.id, each accession of a gene on its own row
+    'hgnc_uniprot_uniprot_index': ('hgnc_uniprot', ['uniprot', 'hgnc_id']),
+    # differential.SQL_PROTEIN_GENES: H.uniprot_ids = P.accession, then the Ensembl gene
+    'hgnc_uniprot_index': ('hgnc', ['uniprot_ids', 'ensembl_gene_id']),
+    'hgnc_ensembl_index': ('hgnc', ['ensembl_gene_id']),
+    # SQL_FILTERED_INSERT and SQL_FILTERED_INSERT_IDS: from the gene to its symbol, name and Ensembl gene
+    'hgnc_id_index': ('hgnc', ['hgnc_id']),
+    # SQL_INTERACTIONS and SQL_NODES_INSERT join filtered on either end of an interaction
+    'interactome_p1_index': ('interactome', ['p1', 'p2']),
+    'interactome_p2_index': ('interactome', ['p2', 'p1']),
+    # the same joins when the STRING links are merged in (string_db.py), covering the edge weight
+    'weighted_interactome_p1_index': ('weighted_interactome', ['p1', 'p2', 'weight']),
+    'weighted_interactome_p2_index': ('weighted_interactome', ['p2', 'p1']),
+    # integer link tables of interning.py, the same lookups on interned ids
+    'interactome_ids_p1_index': ('interactome_ids', ['p1', 'p2']),
+    'interactome_ids_p2_index': ('interactome_ids', ['p2', 'p1']),
+    'mapping_ids_uniprot_index': ('mapping_ids', ['uniprot', 'ensembl']),
+    'hgnc_ids_uniprot_index': ('hgnc_ids', ['uniprot', 'ensembl', 'hgnc']),
+    'hgnc_ids_ensembl_index': ('hgnc_ids', ['ensembl']),
+    'annotations_ids_go_index': ('annotations_ids', ['go', 'protein', 'evidenceCode']),
+}
+
+# indexes of earlier builds that named columns which do not exist
+LEGACY_INDEXES = ['gaf_index', 'hgnc_index']
+
+# indexes only the text queries use: once the identifiers are current the queries run on the integer tables,
+# so these are dropped (see main.update_indexes) and only exist between a text table rebuild and the next interning
+TEXT_QUERY_INDEXES = ['map_index', 'annotations_go_index', 'hgnc_uniprot_uniprot_index', 'interactome_p1_index',
+                      'interactome_p2_index']
+
+
+def index_sql(table, skip=()) -> list:
+    """
+    CREATE INDEX statements for one table, to run right after it is bulk loaded.
+    """
+    statements = list()
+    for name, (t, columns) in INDEXES.items():
+        if t == table and name not in skip:
+            columns = ', '.join(f'"{c}" ASC' for c in columns)
+            statements.append(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{t}" ({columns});')
+    return statements
+
+
+def existing_tables(db: sqlite3.Connection) -> set:
+    return {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+
+
+def create_indexes(db: sqlite3.Connection, tables=None, analyze=True, skip=()):
+    tables = existing_tables(db) if tables is None else set(tables) & existing_tables(db)
+    for name in LEGACY_INDEXES:
+        db.execute(f'DROP INDEX IF EXISTS "{name}";')
+    for table in sorted(tables):
+        for sql in index_sql(table, skip):
+            db.execute(sql)
+    db.commit()
+    if analyze:
+        analyze_stale(db, tables)
+
+
+def analyze_stale(db: sqlite3.Connection, tables):
+    """
+    ANALYZE only the tables with an index that has no statistics yet. Swapping a table in drops the old one and
+    its sqlite_stat1 rows, so tables that were not rebuilt keep their statistics and are not scanned again.
+    """
+    analyzed = set()
+    if 'sqlite_stat1' in existing_tables(db):
+        analyzed = {row[0] for row in db.execute('SELECT DISTINCT idx FROM sqlite_stat1;')}
+    indexes = db.execute("SELECT tbl_name, name FROM sqlite_master WHERE type='index';").fetchall()
+    stale = sorted({t for t, name in indexes if t in set(tables) and name not in analyzed})
+    for table in stale:
+        db.execute(f'ANALYZE "{table}";')
+    db.commit()
+    return stale
+
+
+def drop_text_query_indexes(db: sqlite3.Connection) -> list:
+    existing = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='index';")}
+    dropped = [name for name in TEXT_QUERY_INDEXES if name in existing]
+    for name in dropped:
+        db.execute(f'DROP INDEX "{name}";')
+    db.commit()
+    return dropped
+
+
+def drop_indexes(db: sqlite3.Connection, keep=()):
+    for name in INDEXES:
+        if name not in keep:
+            db.execute(f'DROP INDEX IF EXISTS "{name}";')
+    db.execute('DROP TABLE IF EXISTS sqlite_stat1;')
+    db.commit()
+
+
+def time_workload(db: sqlite3.Connection, df_terms, categories, interactome=HURI) -> dict:
+    """
+    Runs the load_to_cytoscape queries once on db and returns the wall time of each.
+    """
+    # imported here so building the database does not pull in py4cytoscape
+    from load_to_cytoscape import (SQL_NODES_UPDATE, create_filtered_table, create_nodes_table, load_term_sets,
+                                   workload_queries)
+
+    timings = dict()
+    cur = db.cursor()
+    flags = [c.name for c in categories]
+    create_filtered_table(cur)
+    create_nodes_table(cur, flags)
+    load_term_sets(db, df_terms, categories)
+
+    queries = workload_queries(db, interactome)
+    steps = [('filtered_insert', queries['filtered_insert'], ()),
+             ('interactions', queries['interactions'], ()),
+             ('nodes_insert', queries['nodes_insert'], ())]
+    steps += [(f'nodes_update[{f}]', SQL_NODES_UPDATE.format(flag=f), (f,)) for f in flags]
+    for name, sql, params in steps:
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        timings[name] = time.perf_counter() - start
+    db.rollback()
+    return timings
+
+
+def benchmark_queries(db_sqlite, categories_file=CATEGORIES_FILE, obo_file='data/go.obo',
+                      category_names=('cell_cycle', 'mitochondria'), interactome=HURI) -> pd.DataFrame:
+    """
+    Times each query of load_to_cytoscape on a scratch copy of the database, first with the index set of the
+    original build (map_index only) and then with the workload indexes declared in INDEXES.
+    """
+    categories = load_categories(categories_file, list(category_names))
+
+    fd, scratch = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(db_sqlite)))
+    os.close(fd)
+    try:
+        src = sqlite3.connect(f"file:{db_sqlite}?mode=ro", uri=True)
+        df_terms = resolve_categories(categories, obo_file, db=src)
+        db = sqlite3.connect(scratch)
+        src.backup(db)
+        src.close()
+
+        drop_indexes(db, keep=('map_index',))
+        before = time_workload(db, df_terms, categories, interactome)
+        create_indexes(db)
+        after = time_workload(db, df_terms, categories, interactome)
+        db.close()
+    finally:
+        os.remove(scratch)
+
+    df = pd.DataFrame({'before_s': before, 'after_s': after})
+    df['speedup'] = df['before_s'] / df['after_s']
+    return df
+
+
+if __name__ == '__main__':
+    db_sqlite = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go-interactome.db'
+    print(benchmark_queries(db_sqlite))
@@ -0,0 +1,244 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import platform
+import resource
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+log = logging.getLogger('GO-db')
+
+REPORT_FOLDER = 'logs'
+# a pipeline run records a few hundred stages, a long-running QueryService one per query: keep the latest only
+MAX_RECORDS = 10_000
+
+# process-wide switches, also settable through the environment for scripts run as __main__
+settings = {
+    'profile': os.environ.get('GO_DB_PROFILE', '') not in ('', '0'),
+    'trace_memory': os.environ.get('GO_DB_TRACEMALLOC', '') not in ('', '0'),
+    'report_folder': os.environ.get('GO_DB_REPORT_FOLDER', REPORT_FOLDER),
+}
+
+_lock = threading.Lock()
+# stages nest per thread, so concurrent queries each get their own stage paths
+_local = threading.local()
+_records = deque(maxlen=MAX_RECORDS)
+_started = datetime.now(timezone.utc)
+
+
+def configure(profile=None, trace_memory=None, report_folder=None):
+    for key, value in (('profile', profile), ('trace_memory', trace_memory), ('report_folder', report_folder)):
+        if value is not None:
+            settings[key] = value
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _children_peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def _cpu_seconds() -> float:
+    # own CPU plus that of finished worker processes (GAF parsing, downloads run in threads)
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _bytes_read() -> int:
+    # rchar counts every read() of the process, files and sockets alike; not available outside Linux
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class Stage:
+    """
+    Measurements of one pipeline stage, rows and extra bytes are added by the code being measured.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.rows = 0
+        self.bytes = 0
+        self.extra = dict()
+        self.traced_peak = 0
+        self.profiling = False
+
+    def add(self, rows=0, bytes_read=0, **extra):
+        self.rows += int(rows)
+        self.bytes += int(bytes_read)
+        self.extra.update(extra)
+
+
+def _stack() -> list:
+    if not hasattr(_local, 'stack'):
+        _local.stack = list()
+    return _local.stack
+
+
+def current_stage():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def count(rows=0, bytes_read=0, **extra):
+    """
+    Adds to the innermost running stage, a no-op outside of any stage.
+    """
+    s = current_stage()
+    if s is not None:
+        with _lock:
+            s.add(rows, bytes_read, **extra)
+
+
+@contextmanager
+def stage(name, profile=None, trace_memory=None):
+    profile = settings['profile'] if profile is None else profile
+    trace_memory = settings['trace_memory'] if trace_memory is None else trace_memory
+    stack = _stack()
+    path = '/'.join([s.name for s in stack] + [name])
+    s = Stage(name, path)
+
+    started_tracing = False
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        tracemalloc.reset_peak()
+    # only the outermost profiled stage runs a profiler, its stats include the nested stages
+    profiler = cProfile.Profile() if profile and not any(p.profiling for p in stack) else None
+    s.profiling = profiler is not None
+
+    stack.append(s)
+    wall, cpu, read = time.perf_counter(), _cpu_seconds(), _bytes_read()
+    if profiler is not None:
+        profiler.enable()
+    ok = False
+    try:
+        yield s
+        ok = True
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall, cpu, read = time.perf_counter() - wall, _cpu_seconds() - cpu, _bytes_read() - read
+        stack.pop()
+
+        record = {
+            'stage': path,
+            'ok': ok,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'rows': s.rows,
+            'bytes_read': s.bytes or read,
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': _children_peak_rss_mb(),
+        }
+        if trace_memory:
+            # nested stages reset the peak, so keep the largest one seen by them as well
+            s.traced_peak = max(s.traced_peak, tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = s.traced_peak / 2 ** 20
+            if stack:
+                stack[-1].traced_peak = max(stack[-1].traced_peak, s.traced_peak)
+            if started_tracing:
+                tracemalloc.stop()
+        if profiler is not None:
+            os.makedirs(settings['report_folder'], exist_ok=True)
+            prof_file = os.path.join(settings['report_folder'], f'{path.replace("/", ".")}.prof')
+            profiler.dump_stats(prof_file)
+            record['profile'] = prof_file
+        record.update(s.extra)
+        with _lock:
+            _records.append(record)
+        log.debug(f'[{path}] {wall:.3f} s wall, {cpu:.3f} s CPU, {s.rows} rows, '
+                  f'peak RSS {record["peak_rss_mb"]:.0f} MiB')
+
+
+def instrumented(name=None, **stage_kwargs):
+    """
+    Decorator running every call of the function as a stage, named after the function by default.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__, **stage_kwargs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_execute(cur, name, sql, params=()):
+    """
+    Executes one SQL statement as a stage, counting the rows it changed.
+    """
+    with stage(f'sql:{name}') as s:
+        cur.execute(sql, params)
+        if cur.rowcount > 0:
+            s.add(rows=cur.rowcount)
+    return cur
+
+
+def records() -> list:
+    with _lock:
+        return list(_records)
+
+
+def reset():
+    global _started
+    with _lock:
+        _records.clear()
+        _started = datetime.now(timezone.utc)
+
+
+def summary_table() -> pd.DataFrame:
+    df = pd.DataFrame(records())
+    if df.empty:
+        return df
+    df['rows_per_s'] = df['rows'] / df['wall_s'].where(df['wall_s'] > 0)
+    df['read_mb'] = df['bytes_read'] / 2 ** 20
+    columns = ['stage', 'ok', 'wall_s', 'cpu_s', 'rows', 'rows_per_s', 'read_mb', 'peak_rss_mb']
+    if 'traced_peak_mb' in df.columns:
+        columns.append('traced_peak_mb')
+    return df[columns]
+
+
+def write_report(report_file=None, **meta) -> str:
+    """
+    Writes the stages recorded so far as a JSON run report and logs the summary table.
+    By default the report goes to a timestamped file in the report folder, so runs can be compared.
+    """
+    if report_file is None:
+        os.makedirs(settings['report_folder'], exist_ok=True)
+        report_file = os.path.join(settings['report_folder'], f'run-{_started.strftime("%Y%m%dT%H%M%SZ")}.json')
+    report = {
+        'started': _started.isoformat(),
+        'finished': datetime.now(timezone.utc).isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'meta': meta,
+        'stages': records(),
+    }
+    tmp_file = f'{report_file}.part'
+    with open(tmp_file, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(tmp_file, report_file)
+    log.info(f'Run report written to {report_file}\n{summary_table().to_string(index=False)}')
+    return report_file
@@ -0,0 +1,9 @@
+# the interactomes the subnetwork queries can run on, as format arguments of SQL_INTERACTIONS and SQL_NODES_INSERT
+# in load_to_cytoscape: HuRI alone with unit weights, or HuRI merged with STRING by
+# string_db.build_weighted_interactome
+HURI = 'huri'
+HURI_STRING = 'huri_string'
+INTERACTOMES = {
+    HURI: {'interactome': 'interactome', 'weight': '1.0', 'source': "'HuRI'"},
+    HURI_STRING: {'interactome': 'weighted_interactome', 'weight': 'I.weight', 'source': 'I.source'},
+}
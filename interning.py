@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from build_state import get_state, is_current, record_state, table_exists
+from downloads import CACHE_FOLDER, save_atomically
+from indexes import analyze_stale, index_sql
+from instrument import count, instrumented
+
+log = logging.getLogger('GO-db')
+
+# bumped whenever the identifiers or a link table change shape, so existing databases rebuild them
+IDENTIFIERS_VERSION = 2
+
+# identifier types, in the order SQLite sorts their names so ids follow (type, accession)
+ID_TYPES = ('ensembl', 'go', 'hgnc', 'uniprot')
+
+# every (table, column) holding identifiers of a type, with an optional row filter
+ID_SOURCES = [
+    ('interactome', 'p1', 'ensembl', None),
+    ('interactome', 'p2', 'ensembl', None),
+    ('mapping', 'Ensembl', 'ensembl', None),
+    ('mapping', 'UniProtKB_AC', 'uniprot', None),
+    ('hgnc', 'ensembl_gene_id', 'ensembl', None),
+    ('hgnc', 'uniprot_ids', 'uniprot', None),
+    ('hgnc', 'hgnc_id', 'hgnc', None),
+    ('annotations', 'id', 'uniprot', "db = 'UniProtKB'"),
+    ('annotations', 'goId', 'go', "db = 'UniProtKB'"),
+]
+# multi-valued columns and their separator, "P12345|Q67890"
+MULTI_VALUED = {('hgnc', 'uniprot_ids'): '|'}
+
+
+def split_values(column, separator='|') -> str:
+    # table-valued SQL expression with one row per value of a multi-valued text column, in J.value
+    return f"""json_each('["' || replace({column}, '{separator}', '","') || '"]') AS J"""
+
+
+IDENTIFIERS_DDL = '''CREATE TABLE "identifiers" (
+                    "id"	INTEGER PRIMARY KEY,
+                    "type"	TEXT NOT NULL,
+                    "accession"	TEXT NOT NULL,
+                    UNIQUE ("type", "accession")
+                );'''
+
+# integer link tables, name -> (source table, DDL, fill statement)
+LINK_TABLES = {
+    'interactome_ids': ('interactome', '''CREATE TABLE "interactome_ids" (
+                    "p1"	INTEGER,
+                    "p2"	INTEGER
+                );''', """
+        INSERT INTO interactome_ids (p1, p2)
+        SELECT A.id, B.id FROM interactome I
+        CROSS JOIN identifiers A ON A.type = 'ensembl' AND A.accession = I.p1
+        CROSS JOIN identifiers B ON B.type = 'ensembl' AND B.accession = I.p2
+        ORDER BY I.rowid;
+        """),
+    'mapping_ids': ('mapping', '''CREATE TABLE "mapping_ids" (
+                    "uniprot"	INTEGER,
+                    "ensembl"	INTEGER,
+                    PRIMARY KEY ("ensembl", "uniprot")
+                ) WITHOUT ROWID;''', """
+        INSERT OR IGNORE INTO mapping_ids (uniprot, ensembl)
+        SELECT U.id, E.id FROM mapping M
+        CROSS JOIN identifiers U ON U.type = 'uniprot' AND U.accession = M.UniProtKB_AC
+        CROSS JOIN identifiers E ON E.type = 'ensembl' AND E.accession = M.Ensembl;
+        """),
+    # one row per UniProt accession of a gene
+    'hgnc_ids': ('hgnc', '''CREATE TABLE "hgnc_ids" (
+                    "hgnc"	INTEGER,
+                    "uniprot"	INTEGER,
+                    "ensembl"	INTEGER
+                );''', f"""
+        INSERT INTO hgnc_ids (hgnc, uniprot, ensembl)
+        SELECT DISTINCT G.id, U.id, E.id FROM hgnc H
+        CROSS JOIN identifiers G ON G.type = 'hgnc' AND G.accession = H.hgnc_id
+        LEFT JOIN {split_values('H.uniprot_ids')}
+        LEFT JOIN identifiers U ON U.type = 'uniprot' AND U.accession = J.value
+        LEFT JOIN identifiers E ON E.type = 'ensembl' AND E.accession = H.ensembl_gene_id;
+        """),
+    'annotations_ids': ('annotations', '''CREATE TABLE "annotations_ids" (
+                    "protein"	INTEGER,
+                    "go"	INTEGER,
+                    "evidenceCode"	TEXT,
+                    "taxon"	INTEGER
+                );''', """
+        INSERT INTO annotations_ids (protein, go, evidenceCode, taxon)
+        SELECT U.id, G.id, A.evidenceCode, A.taxon FROM annotations A
+        CROSS JOIN identifiers U ON U.type = 'uniprot' AND U.accession = A.id
+        CROSS JOIN identifiers G ON G.type = 'go' AND G.accession = A.goId
+        WHERE A.db = 'UniProtKB';
+        """),
+}
+
+
+def identifiers_digest(db: sqlite3.Connection) -> str:
+    """
+    Hash of the build state of the tables the identifiers are drawn from.
+    """
+    tables = sorted({t for t, _, _, _ in ID_SOURCES if table_exists(db, t)})
+    state = {t: get_state(db, t) for t in tables}
+    return hashlib.sha256(json.dumps({'version': IDENTIFIERS_VERSION, **state}).encode()).hexdigest()
+
+
+def identifiers_current(db: sqlite3.Connection) -> bool:
+    """
+    True when the identifiers and every link table were built from the text tables as they are now.
+    """
+    # get_state would create build_state, which fails on read-only connections
+    if not (table_exists(db, 'build_state') and table_exists(db, 'identifiers')):
+        return False
+    if any(table_exists(db, source) and not table_exists(db, name) for name, (source, _, _) in LINK_TABLES.items()):
+        return False
+    return get_state(db, 'identifiers') == identifiers_digest(db)
+
+
+def identifiers_sql(tables) -> str:
+    parts = list()
+    for table, column, id_type, where in ID_SOURCES:
+        if table not in tables:
+            continue
+        condition = f'"{column}" IS NOT NULL' + (f' AND {where}' if where else '')
+        if (table, column) in MULTI_VALUED:
+            values = split_values(f'"{table}"."{column}"', MULTI_VALUED[table, column])
+            parts.append(f"SELECT '{id_type}' AS type, J.value AS accession FROM \"{table}\", {values} "
+                         f"WHERE {condition} AND J.value <> ''")
+        else:
+            parts.append(f"SELECT '{id_type}' AS type, \"{column}\" AS accession FROM \"{table}\" WHERE {condition}")
+    # UNION removes duplicates, inserting in order numbers the ids by (type, accession)
+    return f'INSERT INTO identifiers (type, accession) SELECT type, accession FROM ({" UNION ".join(parts)}) ' \
+           f'ORDER BY type, accession;'
+
+
+@instrumented()
+def build_identifiers(db_sqlite_file, force=False):
+    """
+    (Re)builds the identifiers dictionary and the integer link tables next to the text tables they mirror,
+    whenever any of those was rebuilt.
+    """
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        digest = identifiers_digest(db)
+        if not force and is_current(db, 'identifiers', digest):
+            return
+
+        tables = {t for t, _, _, _ in ID_SOURCES if table_exists(db, t)}
+        db.execute('PRAGMA temp_store=MEMORY;')
+        db.execute(f'PRAGMA cache_size={-1024 * 1024};')
+        db.commit()
+        db.execute('BEGIN;')
+        try:
+            for name in list(LINK_TABLES) + ['identifiers']:
+                db.execute(f'DROP TABLE IF EXISTS "{name}";')
+            db.execute(IDENTIFIERS_DDL)
+            count(rows=db.execute(identifiers_sql(tables)).rowcount)
+            for name, (source, ddl, fill) in LINK_TABLES.items():
+                if source not in tables:
+                    continue
+                db.execute(ddl)
+                count(rows=db.execute(fill).rowcount)
+                for sql in index_sql(name):
+                    db.execute(sql)
+            record_state(db, 'identifiers', digest, sources=sorted(tables))
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        analyze_stale(db, ['identifiers'] + [name for name, (source, _, _) in LINK_TABLES.items() if source in tables])
+        log.info(f'Table identifiers built from {", ".join(sorted(tables))}.')
+    finally:
+        db.close()
+
+
+class IdentifierIndex:
+    """
+    Bidirectional accession <-> integer id lookup held in flat arrays, sorted by (type, accession):
+    fixed-width byte strings for binary search, and the ids aligned with them. Ids are numbered in the same order,
+    so the one sort order serves both directions. Saved as .npy files so it can be memory-mapped by many processes
+    instead of loaded.
+    """
+
+    def __init__(self, type_codes: np.ndarray, accessions: np.ndarray, ids: np.ndarray, digest=''):
+        self.type_codes = type_codes
+        self.accessions = accessions
+        self.ids = ids
+        self.digest = digest
+        # rows of each type are contiguous
+        self.type_starts = np.searchsorted(type_codes, np.arange(len(ID_TYPES) + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_db(cls, db: sqlite3.Connection):
+        df = pd.read_sql('SELECT id, type, accession FROM identifiers;', db)
+        type_codes = pd.Categorical(df['type'], categories=ID_TYPES).codes.astype(np.uint8)
+        accessions = np.char.encode(df['accession'].to_numpy(dtype=str), 'utf-8')
+        order = np.lexsort((accessions, type_codes))
+        if np.any(np.diff(df['id'].values[order]) <= 0):
+            raise ValueError('identifiers are not numbered in (type, accession) order, rebuild them with force=True')
+        return cls(type_codes[order], accessions[order], df['id'].values.astype(np.int64)[order],
+                   get_state(db, 'identifiers') or '')
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        mode = 'r' if mmap else None
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(np.load(os.path.join(folder, 'type_codes.npy'), mmap_mode=mode),
+                   np.load(os.path.join(folder, 'accessions.npy'), mmap_mode=mode),
+                   np.load(os.path.join(folder, 'ids.npy'), mmap_mode=mode),
+                   meta['digest'])
+
+    def save(self, folder):
+        def write(tmp_folder):
+            os.makedirs(tmp_folder)
+            np.save(os.path.join(tmp_folder, 'type_codes.npy'), self.type_codes)
+            np.save(os.path.join(tmp_folder, 'accessions.npy'), self.accessions)
+            np.save(os.path.join(tmp_folder, 'ids.npy'), self.ids)
+            with open(os.path.join(tmp_folder, 'meta.json'), 'w') as f:
+                json.dump({'digest': self.digest, 'types': ID_TYPES}, f)
+        save_atomically(folder, write)
+
+    def encode(self, accessions, id_type) -> np.ndarray:
+        """
+        Integer ids of the accessions of one type, -1 for unknown accessions.
+        """
+        t = ID_TYPES.index(id_type)
+        start, end = self.type_starts[t], self.type_starts[t + 1]
+        query = np.char.encode(np.asarray(accessions, dtype=str), 'utf-8')
+        out = np.full(len(query), -1, dtype=np.int64)
+        # longer than any stored accession, the fixed width comparison would match a truncated prefix
+        fits = np.char.str_len(query) <= self.accessions.dtype.itemsize
+        block = self.accessions[start:end]
+        positions = np.searchsorted(block, query[fits].astype(self.accessions.dtype))
+        positions = np.minimum(positions, len(block) - 1) if len(block) else positions
+        found = np.zeros(fits.sum(), dtype=bool)
+        if len(block):
+            found = block[positions] == query[fits]
+        out[np.flatnonzero(fits)[found]] = self.ids[start + positions[found]]
+        return out
+
+    def decode(self, ids) -> np.ndarray:
+        """
+        Accessions of the ids, None for unknown ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[positions] == ids
+        out = np.full(len(ids), None, dtype=object)
+        out[found] = np.char.decode(self.accessions[positions[found]], 'utf-8')
+        return out
+
+    def types(self, ids) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.asarray(ID_TYPES, dtype=object)[self.type_codes[positions]]
+
+
+def load_identifier_index(db_sqlite, cache_folder=CACHE_FOLDER) -> IdentifierIndex:
+    """
+    Identifier index of the database, memory-mapped from the cache while the identifiers table is unchanged.
+    """
+    db = sqlite3.connect(f"file:{db_sqlite}?mode=ro", uri=True)
+    digest = get_state(db, 'identifiers') if table_exists(db, 'build_state') else None
+    folder = None
+    if cache_folder is not None and digest:
+        os.makedirs(cache_folder, exist_ok=True)
+        folder = os.path.join(cache_folder, f'identifiers-{digest[:16]}')
+        if os.path.exists(os.path.join(folder, 'meta.json')):
+            db.close()
+            return IdentifierIndex.load(folder)
+
+    index = IdentifierIndex.from_db(db)
+    db.close()
+    if folder is not None:
+        index.save(folder)
+    return index
@@ -5,276 +5,309 @@ import py4cytoscape as p4c
 from goatools.godag.go_tasks import get_go2parents, get_go2children
 from goatools.obo_parser import GODag
 
+from build_state import table_exists
+from cyrest import push_network
 from downloads import download_files
+from export import export_results
+from interning import identifiers_current
+from instrument import instrumented, stage, timed_execute, write_report
+from interactomes import HURI, HURI_STRING, INTERACTOMES
+from termsets import CATEGORIES_FILE, category_tables, load_categories, resolve_categories
 
 
 def get_children(ontology: GODag, node: str, levels=1, all_children=None, optional_relationships=None) -> set:
-    all_terms = set()
-    if levels >= 1:
-        if all_children is None:
-            if optional_relationships is None:
-                optional_relationships = {'is_a'}
-            all_children = get_go2children(ontology, optional_relationships)
-        if node in all_children:
-            parents = all_children[node]
-            for term in parents:
-                all_terms = all_terms.union(
-                    parents,
-                    get_children(ontology, term,
-                                 levels=levels - 1,
-                                 all_children=all_children,
-                                 optional_relationships=optional_relationships)
-                )
-
-    return all_terms
+    if all_children is None:
+        if optional_relationships is None:
+            optional_relationships = {'is_a'}
+        all_children = get_go2children(ontology, optional_relationships)
+    return _walk(all_children, node, levels)
 
 
 def get_parents(ontology: GODag, node: str, levels=1, all_parents=None, optional_relationships=None) -> set:
-    all_terms = set()
-    if levels >= 1:
-        if all_parents is None:
-            if optional_relationships is None:
-                optional_relationships = {'is_a'}
-            all_parents = get_go2parents(ontology, optional_relationships)
-        if node in all_parents:
-            parents = all_parents[node]
-            for term in parents:
-                all_terms = all_terms.union(
-                    parents,
-                    get_parents(ontology, term,
-                                levels=levels - 1,
-                                all_parents=all_parents,
-                                optional_relationships=optional_relationships)
-
-                )
+    if all_parents is None:
+        if optional_relationships is None:
+            optional_relationships = {'is_a'}
+        all_parents = get_go2parents(ontology, optional_relationships)
+    return _walk(all_parents, node, levels)
+
 
+def _walk(edges: dict, node: str, levels: int) -> set:
+    # breadth-first, so every term is expanded once at its shortest distance from node
+    all_terms = set()
+    frontier = {node}
+    for _ in range(levels):
+        frontier = set().union(*(edges.get(t, ()) for t in frontier)) - all_terms
+        if not frontier:
+            break
+        all_terms |= frontier
     return all_terms
 
 
-def carlton_cell_cycle_tags():
-    g = GODag("data/go.obo", optional_attrs={'relationship'})
-
-    carlton_go_tags = [
-        g.query_term('GO:0051301', verbose=False),  # Cell  Division
-        g.query_term('GO:0010458', verbose=False),  # Exit  from  Mitosis
-        g.query_term('GO:0000278', verbose=False),  # Mitotic  Cell  Cycle
-        g.query_term('GO:0000281', verbose=False),  # Mitotic  Cytokinesis
-        g.query_term('GO:1902412', verbose=False),  # Regulation of Mitotic Cytokinesis
-    ]
-
-    # search and add children of the terms to the list
-    terms = list()
-    optional_relationships = {'is_a', 'part_of', 'regulates', 'negatively_regulates', 'positively_regulates'}
-    for cc in carlton_go_tags:
-        terms.append({'goId': cc.item_id, 'name': cc.name, 'ns': cc.namespace})
-        cc_children = get_children(g, cc.item_id, levels=100, optional_relationships=optional_relationships)
-        for c in cc_children:
-            go_node = g.query_term(c, verbose=False)
-            terms.append({'goId': go_node.item_id, 'name': go_node.name, 'ns': go_node.namespace})
-
-    df_go = pd.DataFrame(terms)
-    with pd.ExcelWriter('cytoscape_ontology.xlsx', mode='w') as writer:
-        df_go.sort_values(by='goId').to_excel(writer, sheet_name='CelCycle-GO')
+def category_tags(name, categories_file=CATEGORIES_FILE, obo_file='data/go.obo'):
+    df_go = resolve_categories(load_categories(categories_file, [name]), obo_file)
     return df_go['goId'].values
 
 
+def carlton_cell_cycle_tags():
+    return category_tags('carlton_cell_cycle')
+
+
 def carlton_mitochondria_tags():
-    g = GODag("data/go.obo", optional_attrs={'relationship'})
-
-    cc_terms = [
-        g.query_term('GO:0005743', verbose=False),  # Mitochondrial inner membrane
-        g.query_term('GO:0005758', verbose=False),  # Mitochondrial intermembrane space
-        g.query_term('GO:0005759', verbose=False),  # Mitochondrial matrix
-        g.query_term('GO:0005741', verbose=False),  # Mitochondrial outer membrane
-        g.query_term('GO:0005739', verbose=False),  # Mitochondrion
-    ]
-
-    # search and add children of the terms to the list
-    terms = list()
-    optional_relationships = {'is_a', 'part_of', 'regulates', 'negatively_regulates', 'positively_regulates'}
-    for cc in cc_terms:
-        terms.append({'goId': cc.item_id, 'name': cc.name, 'ns': cc.namespace})
-        cc_children = get_children(g, cc.item_id, levels=100, optional_relationships=optional_relationships)
-        for c in cc_children:
-            go_node = g.query_term(c, verbose=False)
-            terms.append({'goId': go_node.item_id, 'name': go_node.name, 'ns': go_node.namespace})
-
-    df_go = pd.DataFrame(terms)
-    with pd.ExcelWriter('cytoscape_ontology.xlsx', mode='w') as writer:
-        df_go.sort_values(by='goId').to_excel(writer, sheet_name='Mitochondria-GO')
-    return df_go['goId'].values
+    return category_tags('mitochondria')
 
 
 def carlton_er_tags():
-    g = GODag("data/go.obo", optional_attrs={'relationship'})
-
-    er_terms = [
-        g.query_term('GO:0005783', verbose=False),  # Endoplasmic reticulum
-        g.query_term('GO:0005788', verbose=False),  # Endoplasmic reticulum lumen
-        g.query_term('GO:0005789', verbose=False),  # Endoplasmic reticulum membrane
-        g.query_term('GO:0005793', verbose=False),  # Endoplasmic reticulum-Golgi intermediate compartment membrane
-        g.query_term('GO:0030176', verbose=False),  # Integral component of endoplasmic reticulum membrane
-    ]
-
-    # search and add children of the terms to the list
-    terms = list()
-    optional_relationships = {'is_a', 'part_of', 'regulates', 'negatively_regulates', 'positively_regulates'}
-    for cc in er_terms:
-        terms.append({'goId': cc.item_id, 'name': cc.name, 'ns': cc.namespace})
-        cc_children = get_children(g, cc.item_id, levels=100, optional_relationships=optional_relationships)
-        for c in cc_children:
-            go_node = g.query_term(c, verbose=False)
-            terms.append({'goId': go_node.item_id, 'name': go_node.name, 'ns': go_node.namespace})
-
-    df_go = pd.DataFrame(terms)
-    with pd.ExcelWriter('cytoscape_ontology.xlsx', mode='w') as writer:
-        df_go.sort_values(by='goId').to_excel(writer, sheet_name='EndopasmicReticulum-GO')
-    return df_go['goId'].values
+    return category_tags('endoplasmic_reticulum')
 
 
 def my_cell_cycle_tags():
-    g = GODag("data/go.obo", optional_attrs={'relationship'})
-    cell_cycle = g.query_term('GO:0007049', verbose=False)
-
-    optional_relationships = {'is_a', 'part_of', 'regulates', 'negatively_regulates', 'positively_regulates'}
-    cc_children = get_children(g, cell_cycle.item_id, levels=100, optional_relationships=optional_relationships)
-
-    print(cell_cycle)
-    terms = list()
-    for p in cc_children:
-        go_node = g.query_term(p, verbose=False)
-        terms.append({'goId': go_node.item_id, 'name': go_node.name, 'ns': go_node.namespace})
-        print(go_node)
-
-    df_go = pd.DataFrame(terms)
-    with pd.ExcelWriter('cytoscape_ontology.xlsx', mode='w') as writer:
-        df_go.sort_values(by='goId').to_excel(writer, sheet_name='Ontology')
-    return df_go['goId'].values
+    return category_tags('my_cell_cycle')
 
 
-def interactors(db_sqlite):
-    db = sqlite3.connect(f"file:{db_sqlite}", uri=True)
+def load_term_sets(db: sqlite3.Connection, df_terms: pd.DataFrame, categories):
+    """
+    Loads the category term sets into indexed temporary tables of this connection, so the filtering query
+    joins against them with bound parameters instead of inlining thousands of GO ids.
+    """
     cur = db.cursor()
-    csep_str = "', '"
+    cur.execute('DROP TABLE IF EXISTS temp.category_terms;')
+    cur.execute('DROP TABLE IF EXISTS temp.category_evidence;')
+    cur.execute('DROP TABLE IF EXISTS temp.categories;')
+    cur.execute('''CREATE TEMP TABLE category_terms (
+                    "category"	TEXT,
+                    "goId"	TEXT,
+                    PRIMARY KEY ("goId", "category")
+                ) WITHOUT ROWID;''')
+    cur.execute('''CREATE TEMP TABLE categories (
+                    "category"	TEXT PRIMARY KEY,
+                    "any_evidence"	INTEGER
+                );''')
+    cur.execute('''CREATE TEMP TABLE category_evidence (
+                    "category"	TEXT,
+                    "evidenceCode"	TEXT,
+                    PRIMARY KEY ("category", "evidenceCode")
+                ) WITHOUT ROWID;''')
+    cur.executemany('INSERT OR IGNORE INTO temp.category_terms (category, goId) VALUES (?, ?);',
+                    df_terms[['category', 'goId']].astype(str).itertuples(index=False, name=None))
+    cur.executemany('INSERT INTO temp.categories (category, any_evidence) VALUES (?, ?);',
+                    [(c.name, int(c.evidence_codes is None)) for c in categories])
+    cur.executemany('INSERT INTO temp.category_evidence (category, evidenceCode) VALUES (?, ?);',
+                    [(c.name, e) for c in categories for e in (c.evidence_codes or ())])
+    cur.execute('ANALYZE temp;')
+    db.commit()
 
-    go_tags = set(carlton_cell_cycle_tags()).union(my_cell_cycle_tags())
-    print(go_tags)
-    print(len(go_tags))
 
-    print("Populating table of filtered gene products.")
-    cur.execute('DROP TABLE IF EXISTS filtered;')
-    cur.execute('CREATE TABLE filtered ("Ensembl" TEXT, "UniProtKB" TEXT, "symbol" TEXT, "alias_symbol" TEXT, '
-                '"name" TEXT, "related_to" TEXT);')
+# every category is filled in the same statement, from the term sets loaded by load_term_sets;
+# CROSS JOIN pins the join order so the small term sets drive the index lookups into the large tables
+SQL_FILTERED_INSERT = """
+    INSERT INTO filtered (Ensembl, UniProtKB, symbol, alias_symbol, name, related_to)
+    SELECT DISTINCT M.Ensembl, H.uniprot_ids, H.symbol, H.alias_symbol, H.name, G.category
+    FROM (
+        SELECT DISTINCT T.category, A.id
+        FROM temp.category_terms AS T
+        CROSS JOIN annotations A ON A.goId = T.goId
+        INNER JOIN temp.categories C ON C.category = T.category
+        WHERE A.db = 'UniProtKB'
+        AND (C.any_evidence = 1 OR EXISTS (
+            SELECT 1 FROM temp.category_evidence E
+            WHERE E.category = T.category AND E.evidenceCode = A.evidenceCode))
+    ) AS G
+    CROSS JOIN hgnc_uniprot U ON U.uniprot = G.id
+    CROSS JOIN hgnc H ON H.hgnc_id = U.hgnc_id
+    CROSS JOIN mapping M ON M.Ensembl = H.ensembl_gene_id;
+    """
+
+
+def query_plan_scans(db: sqlite3.Connection, sql, params=(), allowed=('T', 'C', 'E', 'G')) -> list:
+    """
+    Returns the EXPLAIN QUERY PLAN steps that do not look rows up through a real index:
+    full table or index scans, and automatic indexes built on the fly.
+    Scans of the small term-set tables and materialized subqueries (aliases in `allowed`) are expected.
+    """
+    scans = list()
+    for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+        detail = row[-1]
+        if (detail.startswith('SCAN ') and detail.split()[1] not in allowed) or 'AUTOMATIC' in detail:
+            scans.append(detail)
+    return scans
+
+
+# formatted with the interactome table and its weight and source columns, see interactomes.INTERACTOMES
+SQL_INTERACTIONS = """
+    SELECT DISTINCT
+        I.p1 AS p1e,
+        I.p2 AS p2e,
+        F1.symbol as p1gn,
+        F2.symbol as p2gn,
+        {weight} as weight,
+        {source} as source
+    FROM {interactome} as I
+    INNER JOIN filtered F1 ON F1.Ensembl = I.p1
+    INNER JOIN filtered F2 ON F2.Ensembl = I.p2;
+    """
+
+SQL_NODES_INSERT = """
+    INSERT INTO nodes (id, name, desc)
+    SELECT DISTINCT id, name, desc FROM
+    (
+        SELECT DISTINCT I1.p1 as id, F1.symbol as name, F1.name as desc FROM {interactome} as I1
+        INNER JOIN filtered F1 ON F1.Ensembl = I1.p1
+        UNION
+        SELECT DISTINCT I2.p2 as id, F2.symbol as name, F2.name as desc FROM {interactome} as I2
+        INNER JOIN filtered F2 ON F2.Ensembl = I2.p2
+    ) AS N;
+    """
+
+# formatted with the flag column, the category name is bound as parameter
+SQL_NODES_UPDATE = """
+    UPDATE nodes SET "{flag}"=1
+    WHERE id IN (
+        SELECT F.Ensembl FROM filtered as F
+        WHERE F.related_to=?
+    );
+    """
+
+# the same queries on the integer tables of interning.py: filtered keeps the interned Ensembl id next to the
+# accession, so the interactome is joined on integers and the results need no separate decoding step
+SQL_FILTERED_INSERT_IDS = """
+    INSERT INTO filtered (Ensembl, UniProtKB, symbol, alias_symbol, name, related_to, ensembl_id)
+    SELECT DISTINCT H.ensembl_gene_id, H.uniprot_ids, H.symbol, H.alias_symbol, H.name, G.category, X.ensembl
+    FROM (
+        SELECT DISTINCT T.category, A.protein
+        FROM temp.category_terms AS T
+        CROSS JOIN identifiers GI ON GI.type = 'go' AND GI.accession = T.goId
+        CROSS JOIN annotations_ids A ON A.go = GI.id
+        INNER JOIN temp.categories C ON C.category = T.category
+        WHERE C.any_evidence = 1 OR EXISTS (
+            SELECT 1 FROM temp.category_evidence E
+            WHERE E.category = T.category AND E.evidenceCode = A.evidenceCode)
+    ) AS G
+    CROSS JOIN hgnc_ids X ON X.uniprot = G.protein
+    CROSS JOIN mapping_ids M ON M.ensembl = X.ensembl
+    CROSS JOIN identifiers HI ON HI.id = X.hgnc
+    CROSS JOIN hgnc H ON H.hgnc_id = HI.accession;
+    """
+
+SQL_INTERACTIONS_IDS = """
+    SELECT DISTINCT
+        F1.Ensembl AS p1e,
+        F2.Ensembl AS p2e,
+        F1.symbol as p1gn,
+        F2.symbol as p2gn,
+        1.0 as weight,
+        'HuRI' as source
+    FROM filtered F1
+    CROSS JOIN interactome_ids I ON I.p1 = F1.ensembl_id
+    CROSS JOIN filtered F2 ON F2.ensembl_id = I.p2;
+    """
+
+SQL_NODES_INSERT_IDS = """
+    INSERT INTO nodes (id, name, desc)
+    SELECT DISTINCT id, name, desc FROM
+    (
+        SELECT F1.Ensembl as id, F1.symbol as name, F1.name as desc FROM filtered as F1
+        WHERE EXISTS (SELECT 1 FROM interactome_ids I1 WHERE I1.p1 = F1.ensembl_id)
+        UNION
+        SELECT F2.Ensembl as id, F2.symbol as name, F2.name as desc FROM filtered as F2
+        WHERE EXISTS (SELECT 1 FROM interactome_ids I2 WHERE I2.p2 = F2.ensembl_id)
+    ) AS N;
+    """
+
+INTERACTION_COLUMNS = ['id1', 'id2', 'GeneName1', 'GeneName2', 'weight', 'source']
+
+
+def workload_queries(db: sqlite3.Connection, interactome=HURI) -> dict:
+    """
+    The filtering, interactions and nodes queries on the given interactome, on the interned integer tables when
+    they are current and on the text tables otherwise.
+    """
+    sources = INTERACTOMES[interactome]
+    if not table_exists(db, sources['interactome']):
+        raise ValueError(f'Interactome {interactome} needs the {sources["interactome"]} table, build it first.')
+    interned = identifiers_current(db)
+    queries = {'filtered_insert': SQL_FILTERED_INSERT_IDS if interned else SQL_FILTERED_INSERT}
+    if interned and interactome == HURI:
+        queries.update(interactions=SQL_INTERACTIONS_IDS, nodes_insert=SQL_NODES_INSERT_IDS)
+    else:
+        queries.update(interactions=SQL_INTERACTIONS.format(**sources),
+                       nodes_insert=SQL_NODES_INSERT.format(**sources))
+    return queries
+
+
+def create_filtered_table(cur: sqlite3.Cursor, temp=False):
+    # a temp table is private to the connection and shadows main.filtered in the unqualified queries below
+    cur.execute(f'DROP TABLE IF EXISTS {"temp" if temp else "main"}.filtered;')
+    cur.execute(f'CREATE {"TEMP " if temp else ""}TABLE filtered ("Ensembl" TEXT, "UniProtKB" TEXT, "symbol" TEXT, '
+                '"alias_symbol" TEXT, "name" TEXT, "related_to" TEXT, "ensembl_id" INTEGER);')
     cur.execute('''CREATE INDEX "filtered_index" ON "filtered" (
                     "Ensembl" ASC,
                     "symbol" ASC
                 );''')
-    db.commit()
+    # covers the interned interactions join, which returns the accession and symbol of the partner
+    cur.execute('''CREATE INDEX "filtered_id_index" ON "filtered" (
+                    "ensembl_id" ASC,
+                    "Ensembl" ASC,
+                    "symbol" ASC
+                );''')
 
-    fensmbl_qstr = f"""
-        INSERT INTO filtered
-        SELECT M.Ensembl, H.uniprot_ids, H.symbol, H.alias_symbol, H.name, 'cell_cycle'
-            FROM mapping AS M
-            INNER JOIN hgnc H ON H.ensembl_gene_id = M.Ensembl
-            WHERE H.uniprot_ids IN (
-                SELECT DISTINCT a.id as FilteredGenes
-                FROM annotations a
-                WHERE a.db='UniProtKB' 
-                AND goId IN ('{csep_str.join(go_tags)}')
-                --AND evidenceCode IN ('EXP','IDA','IPI','IMP','IGI','IEP', 'HTP','HDA','HMP','HGI','HEP')
-        );
-        """
-    cur.execute(fensmbl_qstr)
-    db.commit()
-    print("Table filled with cell cycle entries.")
 
-    organelle = 'mitochondria'
-    organelle_go_tags = carlton_mitochondria_tags()
-    in_organelle_qstr = f"""
-        INSERT INTO filtered
-        SELECT M.Ensembl, H.uniprot_ids, H.symbol, H.alias_symbol, H.name, '{organelle}'
-            FROM mapping AS M
-            INNER JOIN hgnc H ON H.ensembl_gene_id = M.Ensembl
-            WHERE H.uniprot_ids IN (
-                SELECT DISTINCT a.id as FilteredGenes
-                FROM annotations a
-                WHERE a.db='UniProtKB' 
-                AND goId IN ('{csep_str.join(organelle_go_tags)}')
-                --AND evidenceCode IN ('EXP','IDA','IPI','IMP','IGI','IEP', 'HTP','HDA','HMP','HGI','HEP')
-        );
-    """
-    print(in_organelle_qstr)
-    cur.execute(in_organelle_qstr)
+def create_nodes_table(cur: sqlite3.Cursor, flags, temp=False):
+    cur.execute(f'DROP TABLE IF EXISTS {"temp" if temp else "main"}.nodes;')
+    columns = ['"id" TEXT', '"name" TEXT', '"desc" TEXT'] + [f'"{f}" NUMERIC DEFAULT 0' for f in flags]
+    cur.execute(f'CREATE {"TEMP " if temp else ""}TABLE nodes ({", ".join(columns)});')
+    cur.execute(f'''CREATE INDEX "node_index" ON "nodes" (
+                    "id" ASC,
+                    {", ".join(f'"{f}" ASC' for f in flags)}
+                );''')
+
+
+@instrumented()
+def interactors(db_sqlite, categories_file=CATEGORIES_FILE, obo_file='data/go.obo',
+                category_names=('cell_cycle', 'mitochondria'), categories=None, df_terms=None, interactome=HURI):
+    db = sqlite3.connect(f"file:{db_sqlite}", uri=True)
+    cur = db.cursor()
+
+    # resolve all categories in one pass, unless the caller already did to export the term lists
+    if categories is None:
+        categories = load_categories(categories_file, list(category_names))
+    category_names = [c.name for c in categories]
+    if df_terms is None:
+        df_terms = resolve_categories(categories, obo_file, db=db)
+    print(df_terms.groupby('category', observed=True).size())
+
+    print("Populating table of filtered gene products.")
+    create_filtered_table(cur)
     db.commit()
-    print("Table filled with organelle entries.")
-
-    sql_filtered_genes = f"""
-    SELECT DISTINCT 
-        I.p1 AS p1e, 
-        I.p2 AS p2e, 
-        F1.symbol as p1gn, 
-        F2.symbol as p2gn
-    FROM interactome as I
-    INNER JOIN filtered F1 ON F1.Ensembl = I.p1
-    INNER JOIN filtered F2 ON F2.Ensembl = I.p2;
-    """
-    cur.execute(sql_filtered_genes)
-    df = pd.DataFrame(cur, columns=['id1', 'id2', 'GeneName1', 'GeneName2'])
-    db.close()
 
-    with pd.ExcelWriter('cytoscape_ontology.xlsx', engine="openpyxl", mode='a') as writer:
-        df.to_excel(writer, sheet_name='Interactions')
+    load_term_sets(db, df_terms, categories)
+    queries = workload_queries(db, interactome)
+    for scan in query_plan_scans(db, queries['filtered_insert']):
+        print(f"Warning: filtering query reads without an index: {scan}")
+    timed_execute(cur, 'filtered_insert', queries['filtered_insert'])
+    db.commit()
+    print(f"Table filled with {', '.join(category_names)} entries.")
 
+    with stage('sql:interactions') as s:
+        cur.execute(queries['interactions'])
+        df = pd.DataFrame(cur, columns=INTERACTION_COLUMNS)
+        s.add(rows=len(df))
+    db.close()
     return df
 
 
-def filtered_nodes(db_sqlite):
+@instrumented()
+def filtered_nodes(db_sqlite, interactome=HURI):
     db = sqlite3.connect(f"file:{db_sqlite}", uri=True)
     cur = db.cursor()
     organelle = 'mitochondria'
 
     print("Creating table of network nodes.")
-    cur.execute('DROP TABLE IF EXISTS nodes;')
-    cur.execute('CREATE TABLE nodes ("id" TEXT, "name" TEXT, "desc" TEXT, '
-                '"cell_cycle" NUMERIC DEFAULT 0, '
-                f'"{organelle}" NUMERIC DEFAULT 0);')
-    cur.execute(f'''CREATE INDEX "node_index" ON "nodes" (
-                    "id" ASC,
-                    "cell_cycle" ASC,
-                    "{organelle}" ASC
-                );''')
+    create_nodes_table(cur, ['cell_cycle', organelle])
     db.commit()
 
-    sql_nodes_insert = f"""
-    INSERT INTO nodes
-    SELECT DISTINCT id, name, desc, 0, 0 FROM 
-    (
-        SELECT DISTINCT I1.p1 as id, F1.symbol as name, F1.name as desc FROM interactome as I1
-        INNER JOIN filtered F1 ON F1.Ensembl = I1.p1
-        UNION 
-        SELECT DISTINCT I2.p2 as id, F2.symbol as name, F2.name as desc FROM interactome as I2
-        INNER JOIN filtered F2 ON F2.Ensembl = I2.p2
-    );
-    """
-    cur.execute(sql_nodes_insert)
-
-    sql_nodes_update_1 = f"""
-    UPDATE nodes SET cell_cycle=1
-    WHERE id IN (
-        SELECT F.Ensembl FROM filtered as F
-        WHERE F.related_to='cell_cycle'
-    );
-    """
-    cur.execute(sql_nodes_update_1)
-
-    sql_nodes_update_2 = f"""
-    UPDATE nodes SET {organelle}=1
-    WHERE id IN (
-        SELECT F.Ensembl FROM filtered as F
-        WHERE F.related_to='{organelle}'
-    );
-    """
-    cur.execute(sql_nodes_update_2)
+    timed_execute(cur, 'nodes_insert', workload_queries(db, interactome)['nodes_insert'])
+    for flag in ['cell_cycle', organelle]:
+        timed_execute(cur, f'nodes_update[{flag}]', SQL_NODES_UPDATE.format(flag=flag), (flag,))
     db.commit()
 
     df = pd.read_sql("SELECT DISTINCT * FROM nodes;", db)
@@ -287,23 +320,33 @@ if __name__ == '__main__':
     download_files()
     db_sqlite = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go-interactome.db'
 
-    print(dir(p4c))
     print(p4c.cytoscape_ping())
     print(p4c.cytoscape_version_info())
-    p4c.close_session(save_before_closing=False)
 
-    interactions = interactors(db_sqlite)
-    nodes = filtered_nodes(db_sqlite)
+    categories = load_categories(CATEGORIES_FILE, ['cell_cycle', 'mitochondria'])
+    db = sqlite3.connect(f"file:{db_sqlite}?mode=ro", uri=True)
+    df_terms = resolve_categories(categories, 'data/go.obo', db=db)
+    # main.py merges the STRING links into weighted_interactome, whose weights the edges should carry
+    interactome = HURI_STRING if table_exists(db, INTERACTOMES[HURI_STRING]['interactome']) else HURI
+    db.close()
+    interactions = interactors(db_sqlite, categories=categories, df_terms=df_terms, interactome=interactome)
+    nodes = filtered_nodes(db_sqlite, interactome=interactome)
     edges = pd.DataFrame(data={
         'source':      interactions['id1'],
         'target':      interactions['id2'],
-        'interaction': ["interacts"] * len(interactions),
-        'weight':      [1.0] * len(interactions)})
+        'interaction': "interacts",
+        'weight':      interactions['weight']})
 
     print(interactions)
     print(nodes)
     print(edges)
-    p4c.create_network_from_data_frames(nodes, edges,
-                                        title="cell cycle & endoplasmic_reticulum",
-                                        collection="HuRI")
-    p4c.set_visual_style('Marquee')
+    # every table and the network in one pass; the workbook is only for reading by hand and written once, last
+    export_results('results', {**category_tables(df_terms, categories), 'Nodes': nodes, 'Interactions': interactions},
+                   nodes=nodes, edges=edges, formats=('parquet', 'feather'),
+                   graph_formats=('sif', 'graphml', 'edgelist'), excel_file='cytoscape_ontology.xlsx')
+    # streams the network in batches and only sends the difference when it is already loaded
+    push_network(nodes, edges,
+                 title="cell cycle & endoplasmic_reticulum",
+                 collection="HuRI+STRING" if interactome == HURI_STRING else "HuRI",
+                 style='Marquee')
+    write_report(db=db_sqlite)
@@ -1,137 +1,238 @@
 import gzip
+import itertools
 import logging
-import os
 import sqlite3
 import sys
+import time
 
 import pandas as pd
-from Bio.UniProt.GOA import gafiterator
 
+from build_state import begin_shadow, is_current, sources_digest, swap_in
 from downloads import download_files
+from gaf import load_gaf_files
+from go_closure import build_go_closure
+from indexes import TEXT_QUERY_INDEXES, create_indexes, drop_text_query_indexes, index_sql
+from instrument import count, instrumented, peak_rss_mb, write_report
+from interning import build_identifiers, identifiers_current, split_values
+from string_db import build_weighted_interactome, import_string_to_sqlite
 
-logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
 log = logging.getLogger('GO-db')
 pd.set_option('display.width', 1000)
 pd.set_option('display.max_rows', 50)
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.max_colwidth', 100)
 
-
-def import_mappings_to_sqlite(db_sqlite_file, huri_tsv_file, mapping_tsv_file):
-    # create database with interactome and ID mappings in SQL
-    if os.path.exists(db_sqlite_file):
-        os.remove(db_sqlite_file)
-
-    newdb = sqlite3.connect(db_sqlite_file)
-    cur = newdb.cursor()
-
-    # populate interactome database
-    for df in pd.read_csv(huri_tsv_file, sep='\t', encoding='utf-8',
-                          chunksize=1e6, iterator=True,
-                          names=['p1', 'p2']):
-        df.to_sql('interactome', newdb, index=False, if_exists='append')
-
-    # populate ID mapping database from file
-    hdr = ['UniProtKB_AC', 'UniProtKB_ID', 'GeneID (EntrezGene)', 'RefSeq', 'GI', 'PDB', 'GO', 'UniRef100',
-           'UniRef90', 'UniRef50', 'UniParc', 'PIR', 'NCBI_taxon', 'MIM', 'UniGene', 'PubMed', 'EMBL',
-           'EMBL_CDS', 'Ensembl', 'Ensembl_TRS', 'Ensembl_PRO', 'Additional PubMed']
-    for df in pd.read_csv(mapping_tsv_file, sep='\t', encoding='utf-8',
-                          chunksize=1e6, iterator=True,
-                          names=hdr, usecols=['UniProtKB_AC', 'Ensembl'],
-                          dtype={'UniProtKB_AC': 'str', 'Ensembl': 'str'}):
-        print(df.size)
-        df = df.rename(columns={c: c.replace(' ', '') for c in df.columns})  # Remove spaces from columns
-
-        df.to_sql('mapping', newdb, index=False, if_exists='append')
-
-    cur.execute('''CREATE INDEX "map_index" ON "mapping" (
-                    "Ensembl"	ASC,
-                    "UniProtKB_AC"
-                );''')
-    newdb.commit()
-
-    newdb.close()
-
-
-def import_hgnc_to_sqlite(db_sqlite_file):
-    hgnc_file = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/hgnc_complete_set.txt'
-    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+IDMAPPING_HDR = ['UniProtKB_AC', 'UniProtKB_ID', 'GeneID (EntrezGene)', 'RefSeq', 'GI', 'PDB', 'GO', 'UniRef100',
+                 'UniRef90', 'UniRef50', 'UniParc', 'PIR', 'NCBI_taxon', 'MIM', 'UniGene', 'PubMed', 'EMBL',
+                 'EMBL_CDS', 'Ensembl', 'Ensembl_TRS', 'Ensembl_PRO', 'Additional PubMed']
+
+BULK_PRAGMAS = {
+    'journal_mode': 'WAL',  # a journal is needed so shadow tables can be swapped in transactionally
+    'synchronous': 'OFF',
+    'cache_size': -1024 * 1024,  # negative values are KiB, i.e. 1 GiB of page cache
+    'temp_store': 'MEMORY',
+    # no EXCLUSIVE locking mode: it would hold the file lock for the whole import and lock out WAL readers
+}
+
+
+def set_pragmas(db, pragmas):
+    for k, v in pragmas.items():
+        db.execute(f'PRAGMA {k}={v};')
+
+
+def open_text(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'rt', encoding='utf-8')
+
+
+def iter_ensembl_pairs(mapping_tsv_file):
+    """
+    Stream (UniProtKB_AC, Ensembl) pairs out of idmapping_selected.tab(.gz).
+    Rows without an Ensembl gene are dropped and multi-valued cells ("ENSG1; ENSG2") are split into one pair each.
+    """
+    ac_col, ensembl_col = IDMAPPING_HDR.index('UniProtKB_AC'), IDMAPPING_HDR.index('Ensembl')
+    with open_text(mapping_tsv_file) as handle:
+        for line in handle:
+            fields = line.split('\t', ensembl_col + 1)
+            if len(fields) <= ensembl_col or not fields[ensembl_col]:
+                continue
+            ac = fields[ac_col]
+            for ensembl in fields[ensembl_col].split(';'):
+                ensembl = ensembl.strip()
+                if ensembl:
+                    yield ac, ensembl
+
+
+def bulk_load_mappings(db, mapping_tsv_file, table='mapping', batch_size=500_000):
     cur = db.cursor()
-    cur.execute('DROP TABLE IF EXISTS hgnc;')
-    db.commit()
-
-    for df in pd.read_csv(hgnc_file, sep='\t', encoding='utf-8',
-                          chunksize=1e6, iterator=True,
-                          usecols=['hgnc_id',
-                                   'symbol', 'name',
-                                   'alias_symbol', 'alias_name',
-                                   'locus_group', 'locus_type',
-                                   'entrez_id', 'ensembl_gene_id', 'uniprot_ids']):
-        print(df.size)
-        df = df.rename(columns={c: c.replace(' ', '') for c in df.columns})  # Remove spaces from columns
-
-        df.to_sql('hgnc', db, index=False, if_exists='append')
-    cur.execute('''CREATE INDEX "hgnc_index" ON "hgnc" (
-                    "symbol" ASC,
-                    "evidenceCode" ASC,
-                    "name" ASC
-                );''')
+    cur.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ("UniProtKB_AC" TEXT, "Ensembl" TEXT);')
+
+    start = time.perf_counter()
+    rows = 0
+    pairs = iter_ensembl_pairs(mapping_tsv_file)
+    while batch := list(itertools.islice(pairs, batch_size)):
+        cur.executemany(f'INSERT INTO "{table}" (UniProtKB_AC, Ensembl) VALUES (?, ?);', batch)
+        rows += len(batch)
+        count(rows=len(batch))
+        elapsed = time.perf_counter() - start
+        log.info(f'mapping: {rows} rows, {rows / elapsed:.0f} rows/s, peak RSS {peak_rss_mb():.0f} MiB')
     db.commit()
+    return rows
 
 
-def import_annotations_from_gaf(db_sqlite_file):
+@instrumented()
+def import_mappings_to_sqlite(db_sqlite_file, huri_tsv_file, mapping_tsv_file, bulk=True, force=False):
+    # create or refresh the interactome and ID mapping tables, each one is only rebuilt when its source changed
+    newdb = sqlite3.connect(db_sqlite_file)
+    try:
+        if bulk:
+            set_pragmas(newdb, BULK_PRAGMAS)
+
+        # populate interactome database
+        digest = sources_digest(huri_tsv_file)
+        if force or not is_current(newdb, 'interactome', digest):
+            shadow = begin_shadow(newdb, 'interactome')
+            for df in pd.read_csv(huri_tsv_file, sep='\t', encoding='utf-8',
+                                  chunksize=1e6, iterator=True,
+                                  names=['p1', 'p2']):
+                count(rows=len(df))
+                df.to_sql(shadow, newdb, index=False, if_exists='append')
+            swap_in(newdb, 'interactome', digest, sources=[huri_tsv_file], index_sql=index_sql('interactome'))
+
+        digest = sources_digest(mapping_tsv_file, bulk=bulk)
+        if force or not is_current(newdb, 'mapping', digest):
+            shadow = begin_shadow(newdb, 'mapping')
+            if bulk:
+                bulk_load_mappings(newdb, mapping_tsv_file, table=shadow)
+            else:
+                # populate ID mapping database from file
+                for df in pd.read_csv(mapping_tsv_file, sep='\t', encoding='utf-8',
+                                      chunksize=1e6, iterator=True,
+                                      names=IDMAPPING_HDR, usecols=['UniProtKB_AC', 'Ensembl'],
+                                      dtype={'UniProtKB_AC': 'str', 'Ensembl': 'str'}):
+                    count(rows=len(df))
+                    df = df.rename(columns={c: c.replace(' ', '') for c in df.columns})  # Remove spaces from columns
+
+                    df.to_sql(shadow, newdb, index=False, if_exists='append')
+
+            swap_in(newdb, 'mapping', digest, sources=[mapping_tsv_file],
+                    index_sql=index_sql('mapping'))
+            log.info(f'mapping index built, peak RSS {peak_rss_mb():.0f} MiB')
+    finally:
+        newdb.close()
+
+
+HGNC_UNIPROT_DDL = '''CREATE TABLE "{table}" (
+                    "uniprot"	TEXT,
+                    "hgnc_id"	TEXT
+                );'''
+
+# one row per UniProt accession of a gene, hgnc.uniprot_ids holds them all as "P12345|Q67890"
+SQL_HGNC_UNIPROT_INSERT = f"""
+    INSERT INTO "{{table}}" (uniprot, hgnc_id)
+    SELECT DISTINCT J.value, H.hgnc_id FROM "{{hgnc}}" H, {split_values('H.uniprot_ids')}
+    WHERE H.uniprot_ids IS NOT NULL AND J.value <> '';
+    """
+
+
+@instrumented()
+def import_hgnc_to_sqlite(db_sqlite_file, hgnc_file='data/hgnc_complete_set.txt', force=False):
     db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
-    cur = db.cursor()
-
-    cur.execute("DROP TABLE IF EXISTS annotations;")
-    cur.execute('''CREATE TABLE "annotations" (
-                    "db"	TEXT,
-                    "id"	TEXT,
-                    "objectSymbol"	TEXT,
-                    -- "qualifier"	TEXT,
-                    "goId"	TEXT,
-                    -- "reference "	TEXT,
-                    "evidenceCode"	TEXT,
-                    -- "withFrom"	TEXT,
-                    "aspect"	TEXT,
-                    "objectName"	INTEGER,
-                    -- "objectSynonym"	TEXT,
-                    "objectType"	TEXT,
-                    -- "taxon"	TEXT,
-                    "date"	TEXT,
-                    "assignedBy"	TEXT,
-                    "annotationExtension"	TEXT,
-                    "geneProductFromId"	TEXT
-                );''')
-    db.commit()
-
-    with gzip.open('data/goa_human.gaf.gz', 'rt') as handle:
-        it = gafiterator(handle)
-        # cur.executemany("""INSERT INTO gaf_annotations (db, id, objectSymbol, qualifier, goId,
-        #                  evidenceCode, withFrom, aspect, objectName, objectSynonym,
-        #                  objectType, taxon, date, assignedBy, annotationExtension, geneProductFromId) VALUES (
-        #                  :DB,:DB_Object_ID,:DB_Object_Symbol,:Qualifier,:GO_ID,
-        #                  :Evidence,:With,:Aspect,:DB_Object_Name,:Synonym,
-        #                  :DB_Object_Type,:Taxon_ID,:Date,:Assigned_By,:Annotation_Extension,
-        #                  :Gene_Product_Form_ID)""", it)
-        cur.executemany("""INSERT INTO annotations (db, id, objectSymbol, goId, evidenceCode, 
-                         aspect, objectName, objectType, date, assignedBy, annotationExtension, 
-                         geneProductFromId) VALUES (
-                         :DB,:DB_Object_ID,:DB_Object_Symbol,:GO_ID,
-                         :Evidence,:Aspect,:DB_Object_Name,
-                         :DB_Object_Type,:Date,:Assigned_By,:Annotation_Extension,
-                         :Gene_Product_Form_ID)""", it)
-    db.commit()
-
-    cur.execute('''CREATE INDEX "gaf_index" ON "annotations" (
-                    "goId" ASC,
-                    "goEvidence" ASC
-                );''')
-    db.commit()
-    db.close()
+    try:
+        digest = sources_digest(hgnc_file)
+        if not force and is_current(db, 'hgnc', digest) and is_current(db, 'hgnc_uniprot', digest):
+            return
+
+        shadow = begin_shadow(db, 'hgnc')
+        for df in pd.read_csv(hgnc_file, sep='\t', encoding='utf-8',
+                              chunksize=1e6, iterator=True,
+                              usecols=['hgnc_id',
+                                       'symbol', 'name',
+                                       'alias_symbol', 'alias_name',
+                                       'locus_group', 'locus_type',
+                                       'entrez_id', 'ensembl_gene_id', 'uniprot_ids']):
+            count(rows=len(df))
+            df = df.rename(columns={c: c.replace(' ', '') for c in df.columns})  # Remove spaces from columns
+
+            df.to_sql(shadow, db, index=False, if_exists='append')
+        links = begin_shadow(db, 'hgnc_uniprot')
+        db.execute(HGNC_UNIPROT_DDL.format(table=links))
+        db.execute(SQL_HGNC_UNIPROT_INSERT.format(table=links, hgnc=shadow))
+        swap_in(db, 'hgnc', digest, sources=[hgnc_file],
+                index_sql=index_sql('hgnc'))
+        swap_in(db, 'hgnc_uniprot', digest, sources=[hgnc_file],
+                index_sql=index_sql('hgnc_uniprot'))
+    finally:
+        db.close()
+
+
+@instrumented()
+def import_annotations_from_gaf(db_sqlite_file, gaf_files=('data/goa_human.gaf.gz',), workers=None, force=False):
+    if isinstance(gaf_files, str):
+        gaf_files = [gaf_files]
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        digest = sources_digest(*gaf_files)
+        if not force and is_current(db, 'annotations', digest):
+            return
+
+        cur = db.cursor()
+        shadow = begin_shadow(db, 'annotations')
+        cur.execute(f'''CREATE TABLE "{shadow}" (
+                        "db"	TEXT,
+                        "id"	TEXT,
+                        "objectSymbol"	TEXT,
+                        -- "qualifier"	TEXT,
+                        "goId"	TEXT,
+                        -- "reference "	TEXT,
+                        "evidenceCode"	TEXT,
+                        -- "withFrom"	TEXT,
+                        "aspect"	TEXT,
+                        "objectName"	INTEGER,
+                        -- "objectSynonym"	TEXT,
+                        "objectType"	TEXT,
+                        "taxon"	INTEGER,
+                        "date"	TEXT,
+                        "assignedBy"	TEXT,
+                        "annotationExtension"	TEXT,
+                        "geneProductFromId"	TEXT,
+                        "source"	TEXT
+                    );''')
+        db.commit()
+
+        set_pragmas(db, BULK_PRAGMAS)
+        rows = load_gaf_files(db, shadow, list(gaf_files), workers=workers)
+        count(rows=rows)
+        log.info(f'annotations: {rows} rows from {len(gaf_files)} GAF files, peak RSS {peak_rss_mb():.0f} MiB')
+
+        swap_in(db, 'annotations', digest, sources=gaf_files,
+                index_sql=index_sql('annotations'))
+    finally:
+        db.close()
+
+
+@instrumented()
+def update_indexes(db_sqlite_file):
+    # adds indexes missing from tables that were not rebuilt and refreshes the planner statistics
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        if not identifiers_current(db):
+            create_indexes(db)
+            return
+        # the queries run on the integer tables, the text indexes they replace would only take up space
+        create_indexes(db, skip=TEXT_QUERY_INDEXES)
+        dropped = drop_text_query_indexes(db)
+        if dropped:
+            log.info(f'Dropped {", ".join(dropped)}, compacting the database.')
+            db.execute('VACUUM;')
+    finally:
+        db.close()
 
 
 if __name__ == '__main__':
+    # configured here, not on import, so scripts importing the build steps keep their own logging setup
+    logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
     huri_file = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/HI-union.tsv'
     map_file = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/idmapping_selected.tab.gz'
     raw_map_file = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/idmapping.dat.gz'
@@ -140,5 +241,12 @@ if __name__ == '__main__':
 
     # load interactions from HuRI database in Ensembl format
     import_mappings_to_sqlite(db_sqlite, huri_file, map_file)
-    import_hgnc_to_sqlite(db_sqlite)
+    import_hgnc_to_sqlite(db_sqlite, hgnc_file='/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/hgnc_complete_set.txt')
     import_annotations_from_gaf(db_sqlite)
+    build_go_closure(db_sqlite, obo_file='/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go.obo')
+    # human STRING links of at least medium confidence, merged with HuRI into the weighted interactome
+    import_string_to_sqlite(db_sqlite)
+    build_weighted_interactome(db_sqlite)
+    build_identifiers(db_sqlite)
+    update_indexes(db_sqlite)
+    write_report(db=db_sqlite)
@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+from goatools.obo_parser import GODag
+
+from build_state import file_digest
+from downloads import CACHE_FOLDER, save_atomically
+from instrument import stage
+
+log = logging.getLogger('GO-db')
+
+# relationships followed by all the term-set builders in load_to_cytoscape
+DEFAULT_RELATIONSHIPS = frozenset({'is_a', 'part_of', 'regulates', 'negatively_regulates', 'positively_regulates'})
+
+_cache = dict()
+_cache_lock = threading.Lock()
+
+
+def relationship_set_key(relationships) -> str:
+    # 'is_a' is always followed by goatools, keep it explicit so equal sets share one key
+    return ','.join(sorted(set(relationships) | {'is_a'}))
+
+
+def _pack_strings(values):
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_string(blob, offsets, i) -> str:
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+
+def _csr(n, edges):
+    """
+    Compressed adjacency of (source, target) index pairs, sorted by source.
+    """
+    edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=n), out=indptr[1:])
+    return indptr, edges[:, 1].copy()
+
+
+def _neighbours(indptr, indices, nodes):
+    starts, ends = indptr[nodes], indptr[nodes + 1]
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.empty(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(lengths.sum())]
+
+
+class Ontology:
+    """
+    Compact, read-only view of go.obo for one relationship set.
+    Terms are numbered 0..n-1 and the child/parent links are kept as CSR arrays.
+    """
+
+    def __init__(self, arrays: dict, relationships):
+        self.relationships = relationship_set_key(relationships)
+        self.arrays = arrays
+        self.ids = arrays['ids']
+        self.index = {go_id: i for i, go_id in enumerate(self.ids.tolist())}
+        for alt_id, i in zip(arrays['alt_ids'].tolist(), arrays['alt_targets'].tolist()):
+            self.index.setdefault(alt_id, i)
+        self.namespaces = arrays['namespaces'].tolist()
+        self.child_indptr, self.child_indices = arrays['child_indptr'], arrays['child_indices']
+        self.parent_indptr, self.parent_indices = arrays['parent_indptr'], arrays['parent_indices']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, go_id):
+        return go_id in self.index
+
+    @classmethod
+    def from_godag(cls, dag: GODag, relationships=DEFAULT_RELATIONSHIPS):
+        terms = sorted({t for t in dag.values()}, key=lambda t: t.item_id)
+        index = {t.item_id: i for i, t in enumerate(terms)}
+        namespaces = sorted({t.namespace for t in terms})
+        ns_index = {ns: i for i, ns in enumerate(namespaces)}
+
+        edges = list()
+        for t in terms:
+            parents = {p.item_id for p in t.parents}
+            for rel in set(getattr(t, 'relationship', dict()).keys()).intersection(relationships):
+                parents.update(p.item_id for p in t.relationship[rel])
+            edges.extend((index[p], index[t.item_id]) for p in parents if p in index)
+        edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+
+        alt = sorted((a, index[t.item_id]) for a, t in dag.items() if a != t.item_id)
+        names, name_offsets = _pack_strings([t.name for t in terms])
+        child_indptr, child_indices = _csr(len(terms), edges)
+        parent_indptr, parent_indices = _csr(len(terms), edges[:, ::-1])
+        arrays = {
+            'ids': np.array([t.item_id for t in terms]),
+            'names': names,
+            'name_offsets': name_offsets,
+            'namespaces': np.array(namespaces),
+            'namespace_codes': np.array([ns_index[t.namespace] for t in terms], dtype=np.uint8),
+            'alt_ids': np.array([a for a, _ in alt], dtype=str),
+            'alt_targets': np.array([i for _, i in alt], dtype=np.int32),
+            'child_indptr': child_indptr,
+            'child_indices': child_indices,
+            'parent_indptr': parent_indptr,
+            'parent_indices': parent_indices,
+        }
+        return cls(arrays, relationships)
+
+    @classmethod
+    def load(cls, npz_file, relationships):
+        with np.load(npz_file, allow_pickle=False) as npz:
+            return cls({k: npz[k] for k in npz.files}, relationships)
+
+    def save(self, npz_file):
+        save_atomically(npz_file, lambda tmp_file: np.savez(tmp_file, **self.arrays), suffix='.npz')
+
+    def name(self, i) -> str:
+        return _unpack_string(self.arrays['names'], self.arrays['name_offsets'], i)
+
+    def namespace(self, i) -> str:
+        return self.namespaces[self.arrays['namespace_codes'][i]]
+
+    def term(self, go_id) -> dict:
+        i = self.index[go_id]
+        return {'goId': str(self.ids[i]), 'name': self.name(i), 'ns': self.namespace(i)}
+
+    def indices(self, go_ids) -> np.ndarray:
+        return np.array([self.index[g] for g in go_ids], dtype=np.int64)
+
+    def children(self, nodes) -> np.ndarray:
+        return np.unique(_neighbours(self.child_indptr, self.child_indices, np.asarray(nodes, dtype=np.int64)))
+
+    def _reach(self, indptr, indices, nodes, levels=None) -> np.ndarray:
+        seen = np.zeros(len(self.ids), dtype=bool)
+        frontier = np.unique(np.asarray(nodes, dtype=np.int64))
+        level = 0
+        while frontier.size and (levels is None or level < levels):
+            nxt = _neighbours(indptr, indices, frontier)
+            nxt = np.unique(nxt[~seen[nxt]])
+            seen[nxt] = True
+            frontier = nxt.astype(np.int64)
+            level += 1
+        return seen
+
+    def descendants(self, go_ids, levels=None) -> set:
+        """
+        GO ids of all terms below go_ids (not including them), following the ontology's relationship set.
+        """
+        mask = self._reach(self.child_indptr, self.child_indices, self.indices(go_ids), levels)
+        return set(self.ids[mask].tolist())
+
+    def ancestors(self, go_ids, levels=None) -> set:
+        mask = self._reach(self.parent_indptr, self.parent_indices, self.indices(go_ids), levels)
+        return set(self.ids[mask].tolist())
+
+    def go2parents(self) -> dict:
+        ids = self.ids.tolist()
+        return {ids[i]: {ids[p] for p in self.parent_indices[self.parent_indptr[i]:self.parent_indptr[i + 1]]}
+                for i in range(len(ids)) if self.parent_indptr[i + 1] > self.parent_indptr[i]}
+
+
+def load_ontology(obo_file='data/go.obo', relationships=DEFAULT_RELATIONSHIPS, cache_folder=CACHE_FOLDER) -> Ontology:
+    """
+    Process-wide cached ontology, keyed by the content hash of obo_file and the relationship set.
+    The parsed graph is also kept on disk, so go.obo is only parsed by goatools once per release.
+    """
+    rel_key = relationship_set_key(relationships)
+    digest = file_digest(obo_file)
+    key = (digest, rel_key)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+
+        npz_file = None
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+            rel_hash = hashlib.sha256(rel_key.encode()).hexdigest()[:8]
+            npz_file = os.path.join(cache_folder, f'{os.path.basename(obo_file)}-{digest[:16]}-{rel_hash}.npz')
+
+        with stage('ontology_load') as s:
+            cached = npz_file is not None and os.path.exists(npz_file)
+            if cached:
+                ontology = Ontology.load(npz_file, relationships)
+            else:
+                log.info(f'Parsing {obo_file} for {rel_key}.')
+                ontology = Ontology.from_godag(GODag(obo_file, optional_attrs={'relationship'}, prt=None),
+                                               relationships)
+                if npz_file is not None:
+                    ontology.save(npz_file)
+            s.add(rows=len(ontology.ids), cached=cached)
+        _cache[key] = ontology
+        return ontology
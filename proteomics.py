@@ -0,0 +1,249 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+log = logging.getLogger('GO-db')
+
+CHUNK_SIZE = 500_000
+
+# the two cohorts compared in casas-vila2017.ipynb, group -> experiments of summary.txt
+COHORTS = {
+    'A': [f'01h_{i}' for i in range(10)],
+    'B': [f'10h_{i}' for i in range(10)],
+}
+
+ALL_PEPTIDES_COLUMNS = ['Raw file', 'Type', 'Charge', 'm/z', 'Mass', 'Retention time', 'Sequence', 'Modifications',
+                        'Proteins', 'Score', 'Intensity', 'Intensities']
+PEPTIDES_COLUMNS = ['Sequence', 'Proteins', 'Leading razor protein', 'Gene names', 'Unique (Groups)', 'PEP', 'Score',
+                    'Intensity', 'Reverse', 'Potential contaminant']
+PROTEIN_GROUPS_COLUMNS = ['Protein IDs', 'Majority protein IDs', 'Gene names', 'Peptides', 'Unique peptides',
+                          'Q-value', 'Score', 'Intensity', 'Reverse', 'Only identified by site',
+                          'Potential contaminant']
+# repetitive text columns, held as categoricals
+CATEGORICAL_COLUMNS = ['Raw file', 'Type', 'Modifications', 'Proteins', 'Leading razor protein', 'Gene names',
+                       'Majority protein IDs']
+# per experiment columns of the wide tables, e.g. 'Intensity 01h_3'
+EXPERIMENT_PREFIXES = ['Intensity ', 'LFQ intensity ', 'iBAQ ', 'MS/MS count ']
+# rows flagged with '+' in any of these are decoys or contaminants
+FLAG_COLUMNS = ['Reverse', 'Potential contaminant', 'Only identified by site']
+
+
+class RaggedArray:
+    """
+    Variable length rows of floats held as one flat array: row i is values[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> np.ndarray:
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def from_lengths(cls, values: np.ndarray, lengths: np.ndarray):
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(values, offsets)
+
+    @classmethod
+    def concat(cls, arrays):
+        arrays = list(arrays)
+        if not arrays:
+            return cls(np.zeros(0), np.zeros(1, dtype=np.int64))
+        return cls.from_lengths(np.concatenate([a.values for a in arrays]),
+                                np.concatenate([a.lengths for a in arrays]))
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def take(self, rows) -> 'RaggedArray':
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        lengths = self.lengths[rows]
+        starts = np.repeat(self.offsets[rows] - np.cumsum(lengths) + lengths, lengths)
+        return RaggedArray.from_lengths(self.values[starts + np.arange(lengths.sum())], lengths)
+
+    def sum(self) -> np.ndarray:
+        return np.bincount(self.row_ids(), weights=self.values, minlength=len(self))
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum() / self.lengths
+
+    def top_n_mean(self, n) -> np.ndarray:
+        """
+        Mean of the n largest values of every row, all rows at once.
+        """
+        row_ids = self.row_ids()
+        # sort descending within each row, then keep the first n positions of each row
+        order = np.lexsort((-self.values, row_ids))
+        rank = np.arange(len(order)) - np.repeat(self.offsets[:-1], self.lengths)
+        keep = rank < n
+        sums = np.bincount(row_ids[order][keep], weights=self.values[order][keep], minlength=len(self))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / np.minimum(self.lengths, n)
+
+
+def parse_intensities(strings: pd.Series, sep=';') -> RaggedArray:
+    """
+    Parses MaxQuant lists such as '1.2E7;3.4E6' in a single pass over the joined column,
+    missing or empty entries become empty rows.
+    """
+    strings = strings.fillna('').astype(str)
+    lengths = np.where(strings.str.len() > 0, strings.str.count(sep) + 1, 0)
+    joined = sep.join(strings[lengths > 0])
+    values = np.array(joined.split(sep), dtype=np.float64) if joined else np.zeros(0)
+    if len(values) != lengths.sum():
+        raise ValueError(f'Intensity lists contain empty values ({len(values)} parsed, {lengths.sum()} expected).')
+    return RaggedArray.from_lengths(values, lengths)
+
+
+def read_summary(folder) -> pd.DataFrame:
+    return pd.read_csv(Path(folder) / 'summary.txt', sep='\t', usecols=['Raw file', 'Experiment'],
+                       dtype={'Raw file': str, 'Experiment': str}).dropna()
+
+
+def cohort_raw_files(summary: pd.DataFrame, cohorts=COHORTS) -> pd.DataFrame:
+    """
+    Raw files of the cohort experiments with their group, experiment and replicate number
+    (the trailing number of the file name, e.g. ..._7 is replicate 7).
+    """
+    experiment_group = {e: g for g, experiments in cohorts.items() for e in experiments}
+    df = summary[summary['Experiment'].isin(experiment_group)].drop_duplicates('Raw file').copy()
+    df['group'] = df['Experiment'].map(experiment_group).astype(pd.CategoricalDtype(list(cohorts)))
+    df['replicate'] = df['Raw file'].str.rsplit('_', n=1).str[-1].astype(int)
+    return df.reset_index(drop=True)
+
+
+def _concat_chunks(chunks, categorical_columns) -> pd.DataFrame:
+    if not chunks:
+        return pd.DataFrame()
+    # chunks categorize independently, unify the categories instead of falling back to object columns
+    columns = dict()
+    for c in chunks[0].columns:
+        if c in categorical_columns and isinstance(chunks[0][c].dtype, pd.CategoricalDtype):
+            columns[c] = union_categoricals([chunk[c] for chunk in chunks])
+    df = pd.concat([chunk.drop(columns=list(columns)) for chunk in chunks], ignore_index=True)
+    for c, values in columns.items():
+        df[c] = values
+    return df[chunks[0].columns]
+
+
+def _categorize(chunk: pd.DataFrame, categorical_columns):
+    for c in categorical_columns:
+        if c in chunk.columns and not isinstance(chunk[c].dtype, pd.CategoricalDtype):
+            chunk[c] = chunk[c].astype('category')
+
+
+def read_all_peptides(folder, raw_files=None, columns=ALL_PEPTIDES_COLUMNS, chunksize=CHUNK_SIZE,
+                      parse_lists=True):
+    """
+    Streams allPeptides.txt in chunks, keeping only rows of raw_files that are assigned to proteins.
+    Returns the table and, with parse_lists, the Intensities lists as a RaggedArray aligned with its rows
+    (the text column is dropped as soon as each chunk is parsed).
+    """
+    wanted = set(columns)
+    dtype = {c: 'category' for c in CATEGORICAL_COLUMNS if c in wanted}
+    dtype['Intensities'] = str
+    raw_files = None if raw_files is None else set(raw_files)
+
+    chunks, intensities = list(), list()
+    rows = 0
+    reader = pd.read_csv(Path(folder) / 'allPeptides.txt', sep='\t', usecols=lambda c: c in wanted,
+                         dtype=dtype, chunksize=chunksize)
+    for chunk in reader:
+        rows += len(chunk)
+        # isin on a categorical only compares its few categories
+        keep = chunk['Raw file'].isin(raw_files) if raw_files is not None else chunk['Raw file'].notna()
+        if 'Proteins' in chunk.columns:
+            keep &= chunk['Proteins'].notna()
+        chunk = chunk[keep]
+        if parse_lists and 'Intensities' in chunk.columns:
+            intensities.append(parse_intensities(chunk['Intensities']))
+            chunk = chunk.drop(columns='Intensities')
+        chunks.append(chunk.reset_index(drop=True))
+
+    df = _concat_chunks(chunks, CATEGORICAL_COLUMNS)
+    if 'Raw file' in df.columns:
+        df['Raw file'] = df['Raw file'].cat.remove_unused_categories()
+    log.info(f'allPeptides: kept {len(df)} of {rows} rows.')
+    if not parse_lists:
+        return df
+    return df, RaggedArray.concat(intensities)
+
+
+def _read_wide(file, columns, experiments, chunksize, drop_flagged=True) -> pd.DataFrame:
+    experiment_columns = set()
+    if experiments is not None:
+        experiment_columns = {f'{prefix}{e}' for prefix in EXPERIMENT_PREFIXES for e in experiments}
+
+    def usecol(c):
+        return c in columns or c in experiment_columns or (experiments is None and
+                                                           any(c.startswith(p) for p in EXPERIMENT_PREFIXES))
+
+    chunks = list()
+    rows = 0
+    for chunk in pd.read_csv(file, sep='\t', usecols=usecol, chunksize=chunksize,
+                             dtype={c: str for c in FLAG_COLUMNS}):
+        rows += len(chunk)
+        if drop_flagged:
+            flagged = np.zeros(len(chunk), dtype=bool)
+            for c in FLAG_COLUMNS:
+                if c in chunk.columns:
+                    flagged |= (chunk[c] == '+').values
+            chunk = chunk[~flagged].drop(columns=[c for c in FLAG_COLUMNS if c in chunk.columns])
+        _categorize(chunk, CATEGORICAL_COLUMNS)
+        chunks.append(chunk.reset_index(drop=True))
+
+    df = _concat_chunks(chunks, CATEGORICAL_COLUMNS)
+    log.info(f'{os.path.basename(file)}: kept {len(df)} of {rows} rows.')
+    return df
+
+
+def read_peptides(folder, experiments=None, columns=PEPTIDES_COLUMNS, chunksize=CHUNK_SIZE, drop_flagged=True):
+    """
+    Streams peptides.txt keeping the per experiment columns of the given experiments only,
+    reverse hits and contaminants are dropped while reading.
+    """
+    return _read_wide(Path(folder) / 'peptides.txt', set(columns), experiments, chunksize, drop_flagged)
+
+
+def read_protein_groups(folder, experiments=None, columns=PROTEIN_GROUPS_COLUMNS, chunksize=CHUNK_SIZE,
+                        drop_flagged=True):
+    return _read_wide(Path(folder) / 'proteinGroups.txt', set(columns), experiments, chunksize, drop_flagged)
+
+
+def load_cohort_peptides(folder, cohorts=COHORTS, chunksize=CHUNK_SIZE):
+    """
+    allPeptides rows of the cohort raw files labelled with 'group' and 'replicate', as in casas-vila2017.ipynb,
+    with their Intensities lists.
+    """
+    raw = cohort_raw_files(read_summary(folder), cohorts)
+    df, intensities = read_all_peptides(folder, raw['Raw file'], chunksize=chunksize)
+    # one lookup per raw file category instead of one per row
+    labels = raw.set_index('Raw file').reindex(df['Raw file'].cat.categories)
+    codes = df['Raw file'].cat.codes.values
+    df['group'] = pd.Categorical.from_codes(labels['group'].cat.codes.values[codes], dtype=raw['group'].dtype)
+    df['replicate'] = labels['replicate'].values.astype(np.int16)[codes]
+    return df, intensities
+
+
+if __name__ == '__main__':
+    folder = Path('/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/dev-proteome-vila2017-PXD005713/txt/')
+    peptides, intensities = load_cohort_peptides(folder)
+    print(peptides)
+    print(peptides.groupby(['group', 'replicate'], observed=True).size())
+    print(f'{len(intensities.values)} intensity values, {peptides.memory_usage(deep=True).sum() / 2**20:.1f} MB')
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+from build_state import database_version, file_digest
+from instrument import instrumented
+from interactomes import HURI
+from termsets import CATEGORIES_FILE, Category, load_categories, resolve_categories
+
+log = logging.getLogger('GO-db')
+
+READ_PRAGMAS = {
+    'mmap_size': 1024 ** 3,  # map up to 1 GiB of the database file instead of copying pages into the cache
+    'cache_size': -256 * 1024,  # KiB, per connection
+    'temp_store': 'MEMORY',  # the per-request scratch tables
+}
+
+
+class ReadOnlyPool:
+    """
+    Fixed set of read-only connections to one database, leased to a single thread at a time.
+    With the database in WAL mode (as left by main.py) readers never block each other or a writer.
+    """
+
+    def __init__(self, db_sqlite, size=4, pragmas=None, timeout=30):
+        self.db_sqlite = db_sqlite
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        pragmas = READ_PRAGMAS if pragmas is None else pragmas
+        for _ in range(size):
+            db = sqlite3.connect(f'file:{db_sqlite}?mode=ro', uri=True, check_same_thread=False, timeout=timeout)
+            for k, v in pragmas.items():
+                db.execute(f'PRAGMA {k}={v};')
+            self._idle.put(db)
+
+    @contextmanager
+    def connection(self):
+        db = self._idle.get(timeout=self.timeout)
+        try:
+            yield db
+        finally:
+            # scratch state never outlives a request
+            db.rollback()
+            for (name,) in db.execute("SELECT name FROM sqlite_temp_master WHERE type='table' "
+                                      "AND name NOT LIKE 'sqlite_%';").fetchall():
+                db.execute(f'DROP TABLE IF EXISTS temp."{name}";')
+            self._idle.put(db)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get(timeout=self.timeout).close()
+
+
+def subnetwork(db: sqlite3.Connection, categories, df_terms: pd.DataFrame, interactome=HURI) -> tuple:
+    """
+    Nodes flagged by category and their interactions, the queries of interactors() and filtered_nodes() run
+    against temp tables of this connection only.
+    """
+    # imported here so the service does not need py4cytoscape until a query runs
+    from load_to_cytoscape import (INTERACTION_COLUMNS, SQL_NODES_UPDATE, create_filtered_table, create_nodes_table,
+                                   load_term_sets, workload_queries)
+
+    flags = [c.name for c in categories]
+    cur = db.cursor()
+    create_filtered_table(cur, temp=True)
+    create_nodes_table(cur, flags, temp=True)
+    load_term_sets(db, df_terms, categories)
+    queries = workload_queries(db, interactome)
+    cur.execute(queries['filtered_insert'])
+    interactions = pd.DataFrame(cur.execute(queries['interactions']).fetchall(), columns=INTERACTION_COLUMNS)
+    cur.execute(queries['nodes_insert'])
+    for flag in flags:
+        cur.execute(SQL_NODES_UPDATE.format(flag=flag), (flag,))
+    nodes = pd.read_sql('SELECT DISTINCT * FROM temp.nodes;', db)
+    db.commit()
+    return nodes, interactions
+
+
+class QueryService:
+    """
+    Serves "nodes and edges for these categories" to many concurrent callers from one shared database.
+    Results are cached by category definitions, interactome, ontology release and database version, and identical
+    requests in flight share a single query. Returned frames are copies, callers may modify them.
+    """
+
+    def __init__(self, db_sqlite, obo_file='data/go.obo', categories_file=CATEGORIES_FILE, workers=4,
+                 max_cached=64):
+        self.obo_file = obo_file
+        self.categories_file = categories_file
+        self.max_cached = max_cached
+        self.pool = ReadOnlyPool(db_sqlite, size=workers)
+        # version lookups get their own connection, so cache hits never wait for a pooled one
+        self._version_db = sqlite3.connect(f'file:{db_sqlite}?mode=ro', uri=True, check_same_thread=False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='go-query')
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        self._version_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def version(self) -> str:
+        with self._lock:
+            version = database_version(self._version_db)
+            # end the read transaction so the next lookup sees tables swapped in meanwhile
+            self._version_db.rollback()
+            return version
+
+    def _categories(self, categories) -> tuple:
+        categories = list(categories)
+        names = [c for c in categories if not isinstance(c, Category)]
+        by_name = {c.name: c for c in load_categories(self.categories_file, names)} if names else dict()
+        return tuple(c if isinstance(c, Category) else by_name[c] for c in categories)
+
+    def cache_key(self, categories, interactome=HURI) -> tuple:
+        return self.version(), file_digest(self.obo_file), interactome, self._categories(categories)
+
+    def submit(self, categories, interactome=HURI) -> Future:
+        """
+        Future of (nodes, interactions) for the categories, given as names of the categories file or Category,
+        on the interactome: HURI or HURI_STRING (see interactomes.INTERACTOMES).
+        """
+        key = self.cache_key(categories, interactome)
+        with self._lock:
+            future = self._cache.get(key)
+            created = future is None
+            if created:
+                future = self._executor.submit(self._run, key[3], interactome)
+                self._cache[key] = future
+                while len(self._cache) > self.max_cached:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+        if created:
+            # registered outside the lock: a future already done runs its callbacks right here
+            future.add_done_callback(lambda f, k=key: self._forget_failed(k, f))
+
+        result = Future()
+
+        def copy_result(f):
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                nodes, interactions = f.result()
+                result.set_result((nodes.copy(), interactions.copy()))
+
+        future.add_done_callback(copy_result)
+        return result
+
+    def query(self, categories, timeout=None, interactome=HURI) -> tuple:
+        return self.submit(categories, interactome).result(timeout)
+
+    async def query_async(self, categories, interactome=HURI) -> tuple:
+        loop = asyncio.get_running_loop()
+        # the cache key reads the database version, keep it off the event loop
+        future = await loop.run_in_executor(None, self.submit, categories, interactome)
+        return await asyncio.wrap_future(future)
+
+    def _forget_failed(self, key, future):
+        if future.exception() is not None:
+            with self._lock:
+                if self._cache.get(key) is future:
+                    del self._cache[key]
+
+    @instrumented('subnetwork_query')
+    def _run(self, categories, interactome) -> tuple:
+        with self.pool.connection() as db:
+            df_terms = resolve_categories(categories, self.obo_file, db=db)
+            nodes, interactions = subnetwork(db, categories, df_terms, interactome)
+        log.info(f'Subnetwork of {", ".join(c.name for c in categories)}: '
+                 f'{len(nodes)} nodes, {len(interactions)} interactions.')
+        return nodes, interactions
+
+
+if __name__ == '__main__':
+    db_sqlite = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go-interactome.db'
+
+    async def main():
+        with QueryService(db_sqlite) as service:
+            results = await asyncio.gather(service.query_async(['cell_cycle', 'mitochondria']),
+                                           service.query_async(['cell_cycle', 'endoplasmic_reticulum']),
+                                           service.query_async(['cell_cycle', 'mitochondria']))
+            for nodes, interactions in results:
+                print(len(nodes), len(interactions))
+
+    asyncio.run(main())
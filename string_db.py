@@ -0,0 +1,258 @@
+import gzip
+import logging
+import re
+import sqlite3
+import time
+
+from build_state import begin_shadow, get_state, is_current, sources_digest, swap_in, table_exists
+from indexes import index_sql
+from instrument import count, instrumented, peak_rss_mb
+
+log = logging.getLogger('GO-db')
+
+STRING_VERSION = '11.5'
+ITEMS_FILE = f'data/items_schema.v{STRING_VERSION}.sql.gz'
+NETWORK_FILE = f'data/network_schema.v{STRING_VERSION}.sql.gz'
+
+HUMAN = 9606
+# STRING's own "medium confidence" cut-off, scores are 0..1000
+DEFAULT_MIN_SCORE = 400
+# alias sources naming the Ensembl gene of a STRING protein, most specific first
+ENSEMBL_ALIAS_SOURCES = ('Ensembl_gene', 'Ensembl_HGNC_ensembl_gene_id')
+
+COPY_HEADER = re.compile(r'^COPY ([\w.]+) \(([^)]*)\) FROM stdin;')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '\\': '\\'}
+
+
+def proteins_table(species) -> str:
+    return f'string_proteins_{species}'
+
+
+def edges_table(species) -> str:
+    return f'string_edges_{species}'
+
+
+def copy_value(field):
+    """
+    Value of one field of a COPY text row: \\N is NULL, backslash escapes are undone.
+    """
+    if field == '\\N':
+        return None
+    if '\\' not in field:
+        return field
+    return re.sub(r'\\(.)', lambda m: COPY_ESCAPES.get(m.group(1), m.group(1)), field)
+
+
+def iter_copy(dump_file, table, columns):
+    """
+    Streams the rows of one table out of a (gzip) pg_dump file, as lists of the raw text of the requested columns.
+    Only the COPY block of the table is split into fields, everything else is skipped line by line, so memory
+    does not grow with the size of the dump.
+    """
+    opener = gzip.open if str(dump_file).endswith('.gz') else open
+    with opener(dump_file, 'rt', encoding='utf-8') as handle:
+        for line in handle:
+            m = COPY_HEADER.match(line)
+            if m is None or m.group(1) != table:
+                continue
+            header = [c.strip().strip('"') for c in m.group(2).split(',')]
+            positions = [header.index(c) for c in columns]
+            last = max(positions)
+            for line in handle:
+                if line.startswith('\\.'):
+                    return
+                fields = line.rstrip('\n').split('\t', last + 1)
+                yield [fields[p] for p in positions]
+    raise ValueError(f'{dump_file} has no COPY block for {table}')
+
+
+def load_proteins(items_file, species) -> dict:
+    """
+    STRING proteins of the species, species -> {protein_id: [external id, preferred name, Ensembl gene]},
+    protein ids kept as the text they have in the dumps.
+    """
+    species = {str(s) for s in species}
+    proteins = {s: dict() for s in species}
+    for protein_id, external_id, species_id, name in iter_copy(
+            items_file, 'items.proteins', ['protein_id', 'protein_external_id', 'species_id', 'preferred_name']):
+        if species_id in species:
+            proteins[species_id][protein_id] = [copy_value(external_id), copy_value(name), None]
+
+    rank = {source: i for i, source in enumerate(ENSEMBL_ALIAS_SOURCES)}
+    ranks = dict()
+    for alias, protein_id, species_id, source in iter_copy(
+            items_file, 'items.proteins_names', ['protein_name', 'protein_id', 'species_id', 'source']):
+        if species_id not in species or source not in rank or protein_id not in proteins[species_id]:
+            continue
+        if rank[source] < ranks.get(protein_id, len(rank)):
+            ranks[protein_id] = rank[source]
+            proteins[species_id][protein_id][2] = copy_value(alias)
+    return {int(s): p for s, p in proteins.items()}
+
+
+def iter_links(network_file, proteins: dict, min_score=DEFAULT_MIN_SCORE, keep_evidence=False):
+    """
+    Streams (species, (protein_a, protein_b, combined_score[, evidence_scores])) of the links between proteins of
+    the requested species scoring at least min_score. STRING lists every link in both directions, only a < b is kept.
+    """
+    # a link's species is that of its first node, the second must be a protein of the same species
+    owner = {protein_id: (s, members) for s, members in proteins.items() for protein_id in members}
+    columns = ['node_id_a', 'node_id_b', 'combined_score'] + (['evidence_scores'] if keep_evidence else [])
+    for fields in iter_copy(network_file, 'network.node_node_links', columns):
+        a, b, score = fields[0], fields[1], fields[2]
+        hit = owner.get(a)
+        if hit is None or b not in hit[1]:
+            continue
+        score = int(score)
+        a, b = int(a), int(b)
+        if score < min_score or a >= b:
+            continue
+        yield hit[0], ((a, b, score, copy_value(fields[3])) if keep_evidence else (a, b, score))
+
+
+def create_string_tables(db: sqlite3.Connection, species, keep_evidence=False):
+    proteins, edges = begin_shadow(db, proteins_table(species)), begin_shadow(db, edges_table(species))
+    db.execute(f'''CREATE TABLE "{proteins}" (
+                    "protein_id"	INTEGER PRIMARY KEY,
+                    "external_id"	TEXT,
+                    "preferred_name"	TEXT,
+                    "ensembl_gene"	TEXT
+                );''')
+    evidence = ',\n                    "evidence_scores"	TEXT' if keep_evidence else ''
+    db.execute(f'''CREATE TABLE "{edges}" (
+                    "protein_a"	INTEGER,
+                    "protein_b"	INTEGER,
+                    "combined_score"	INTEGER{evidence}
+                );''')
+    db.commit()
+    return proteins, edges
+
+
+def string_index_sql(species) -> list:
+    # one edge table per species, so the indexes are named after it instead of being listed in INDEXES
+    table = edges_table(species)
+    return [f'CREATE INDEX IF NOT EXISTS "{table}_a_index" ON "{table}" ("protein_a" ASC, "protein_b" ASC);',
+            f'CREATE INDEX IF NOT EXISTS "{table}_b_index" ON "{table}" ("protein_b" ASC, "protein_a" ASC);',
+            f'CREATE INDEX IF NOT EXISTS "{table}_score_index" ON "{table}" ("combined_score" ASC);']
+
+
+@instrumented()
+def import_string_to_sqlite(db_sqlite_file, species=(HUMAN,), min_score=DEFAULT_MIN_SCORE, items_file=ITEMS_FILE,
+                            network_file=NETWORK_FILE, keep_evidence=False, batch_size=500_000, force=False):
+    """
+    Loads the STRING proteins and links of each species into its own string_proteins_<taxon> and
+    string_edges_<taxon> tables, reading both dumps once for all species that need a rebuild.
+    """
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        digests = {s: sources_digest(items_file, network_file, species=s, min_score=min_score,
+                                     keep_evidence=keep_evidence) for s in species}
+        pending = [s for s in species
+                   if force or not (is_current(db, edges_table(s), digests[s]) and
+                                    is_current(db, proteins_table(s), digests[s]))]
+        if not pending:
+            return
+
+        proteins = load_proteins(items_file, pending)
+        shadows = {s: create_string_tables(db, s, keep_evidence) for s in pending}
+        for s in pending:
+            db.executemany(f'INSERT INTO "{shadows[s][0]}" (protein_id, external_id, preferred_name, ensembl_gene) '
+                           f'VALUES (?, ?, ?, ?);',
+                           ((int(k), *v) for k, v in proteins[s].items()))
+            log.info(f'STRING {s}: {len(proteins[s])} proteins, '
+                     f'{sum(v[2] is not None for v in proteins[s].values())} with an Ensembl gene')
+        db.commit()
+
+        placeholders = ', '.join('?' * (4 if keep_evidence else 3))
+        batches = {s: list() for s in pending}
+        start = time.perf_counter()
+        rows = 0
+        for s, link in iter_links(network_file, proteins, min_score, keep_evidence):
+            batch = batches[s]
+            batch.append(link)
+            if len(batch) >= batch_size:
+                db.executemany(f'INSERT INTO "{shadows[s][1]}" VALUES ({placeholders});', batch)
+                rows += len(batch)
+                count(rows=len(batch))
+                batch.clear()
+                elapsed = time.perf_counter() - start
+                log.info(f'STRING links: {rows} rows, {rows / elapsed:.0f} rows/s, peak RSS {peak_rss_mb():.0f} MiB')
+        for s, batch in batches.items():
+            db.executemany(f'INSERT INTO "{shadows[s][1]}" VALUES ({placeholders});', batch)
+            rows += len(batch)
+            count(rows=len(batch))
+        db.commit()
+
+        for s in pending:
+            swap_in(db, proteins_table(s), digests[s], sources=[items_file])
+            swap_in(db, edges_table(s), digests[s], sources=[items_file, network_file], index_sql=string_index_sql(s))
+        log.info(f'STRING: {rows} links of {", ".join(map(str, pending))} with score >= {min_score}, '
+                 f'peak RSS {peak_rss_mb():.0f} MiB')
+    finally:
+        db.close()
+
+
+WEIGHTED_INTERACTOME_DDL = '''CREATE TABLE "{table}" (
+                    "p1"	TEXT,
+                    "p2"	TEXT,
+                    "weight"	REAL,
+                    "source"	TEXT,
+                    "string_score"	INTEGER
+                );'''
+
+# both sources as undirected Ensembl gene pairs (p1 <= p2), one row per pair with the weight of each source;
+# formatted with the STRING tables, the HuRI weight and the score cut-off are bound as parameters
+SQL_WEIGHTED_INSERT = """
+    INSERT INTO "{table}" (p1, p2, weight, source, string_score)
+    SELECT p1, p2,
+        1 - (1 - COALESCE(MAX(huri), 0)) * (1 - COALESCE(MAX(string) / 1000.0, 0)),
+        CASE WHEN MAX(huri) IS NULL THEN 'STRING' WHEN MAX(string) IS NULL THEN 'HuRI' ELSE 'HuRI,STRING' END,
+        MAX(string)
+    FROM (
+        SELECT MIN(I.p1, I.p2) AS p1, MAX(I.p1, I.p2) AS p2, ? AS huri, NULL AS string
+        FROM interactome AS I
+        UNION ALL
+        SELECT MIN(A.ensembl_gene, B.ensembl_gene), MAX(A.ensembl_gene, B.ensembl_gene), NULL, E.combined_score
+        FROM "{edges}" AS E
+        CROSS JOIN "{proteins}" AS A ON A.protein_id = E.protein_a
+        CROSS JOIN "{proteins}" AS B ON B.protein_id = E.protein_b
+        WHERE E.combined_score >= ? AND A.ensembl_gene <> B.ensembl_gene
+    )
+    GROUP BY p1, p2;
+    """
+
+
+@instrumented()
+def build_weighted_interactome(db_sqlite_file, species=HUMAN, huri_weight=0.9, min_score=DEFAULT_MIN_SCORE,
+                               force=False):
+    """
+    Merges HuRI and the STRING links of one species, mapped to Ensembl genes, into weighted_interactome.
+    A pair found by both gets the probability of either being right: 1 - (1 - huri_weight) * (1 - score / 1000).
+    """
+    db = sqlite3.connect(f"file:{db_sqlite_file}", uri=True)
+    try:
+        edges, proteins = edges_table(species), proteins_table(species)
+        if not (table_exists(db, 'interactome') and table_exists(db, edges)):
+            log.info(f'weighted_interactome needs the interactome and {edges} tables, skipping.')
+            return
+        digest = sources_digest(interactome=get_state(db, 'interactome'), string=get_state(db, edges),
+                                huri_weight=huri_weight, min_score=min_score)
+        if not force and is_current(db, 'weighted_interactome', digest):
+            return
+
+        shadow = begin_shadow(db, 'weighted_interactome')
+        db.execute(WEIGHTED_INTERACTOME_DDL.format(table=shadow))
+        cur = db.execute(SQL_WEIGHTED_INSERT.format(table=shadow, edges=edges, proteins=proteins),
+                         (huri_weight, min_score))
+        count(rows=cur.rowcount)
+        swap_in(db, 'weighted_interactome', digest, sources=['interactome', edges],
+                index_sql=index_sql('weighted_interactome'))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    db_sqlite = '/media/lab/Data/Fabio/Dev/Python-InteractomeGO/data/go-interactome.db'
+    import_string_to_sqlite(db_sqlite)
+    build_weighted_interactome(db_sqlite)
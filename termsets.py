@@ -0,0 +1,140 @@
+import json
+import logging
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from go_closure import closure_is_current, expand_term_sets
+from instrument import count, instrumented
+from ontology import DEFAULT_RELATIONSHIPS, Ontology, load_ontology, relationship_set_key
+
+log = logging.getLogger('GO-db')
+
+CATEGORIES_FILE = 'categories.json'
+
+
+@dataclass(frozen=True)
+class Category:
+    name: str
+    roots: tuple
+    relationships: frozenset = DEFAULT_RELATIONSHIPS
+    evidence_codes: Optional[tuple] = None
+    include_roots: bool = True
+    # roots that only contribute the terms below them, whatever include_roots says
+    exclude_roots: tuple = ()
+    sheet: Optional[str] = None
+    description: str = field(default='', compare=False)
+
+    @classmethod
+    def from_dict(cls, spec: dict):
+        evidence_codes = spec.get('evidence_codes')
+        return cls(name=spec['name'],
+                   roots=tuple(spec['roots']),
+                   relationships=frozenset(spec.get('relationships', DEFAULT_RELATIONSHIPS)),
+                   evidence_codes=tuple(evidence_codes) if evidence_codes else None,
+                   include_roots=spec.get('include_roots', True),
+                   exclude_roots=tuple(spec.get('exclude_roots', ())),
+                   sheet=spec.get('sheet'),
+                   description=spec.get('description', ''))
+
+
+def load_categories(categories_file=CATEGORIES_FILE, names=None) -> list:
+    """
+    Reads category specs from a JSON or YAML file, optionally keeping only the given names in that order.
+    """
+    with open(categories_file, 'r') as f:
+        if categories_file.endswith(('.yaml', '.yml')):
+            import yaml
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    categories = {spec['name']: Category.from_dict(spec) for spec in specs['categories']}
+    if names is None:
+        return list(categories.values())
+    return [categories[n] for n in names]
+
+
+def propagate(ontology: Ontology, seeds: np.ndarray) -> np.ndarray:
+    """
+    Pushes a (terms x categories) boolean matrix down the ontology until every descendant of a seeded term
+    carries the seed's categories. All categories advance together, one vectorized step per ontology level,
+    so overlapping roots share the same traversal.
+    """
+    parents = np.repeat(np.arange(len(ontology)), np.diff(ontology.child_indptr))
+    children = ontology.child_indices
+    reached = seeds.copy()
+    frontier = seeds.any(axis=1)
+    while frontier.any():
+        active = frontier[parents]
+        step = np.zeros_like(reached)
+        np.logical_or.at(step, children[active], reached[parents[active]])
+        changed = (step & ~reached).any(axis=1)
+        reached |= step
+        frontier = changed
+    return reached
+
+
+@instrumented('term_expansion')
+def resolve_categories(categories, obo_file='data/go.obo', db: sqlite3.Connection = None) -> pd.DataFrame:
+    """
+    Expands every category to its GO terms, returns one (category, goId, name, ns) row per member term.
+    Categories that share a relationship set are resolved together: with one query on the go_closure table of db
+    when it was built from this obo_file for that set, otherwise in a single pass over the ontology.
+    """
+    frames = list()
+    groups = dict()
+    for c in categories:
+        groups.setdefault(relationship_set_key(c.relationships), list()).append(c)
+
+    for group in groups.values():
+        ontology = load_ontology(obo_file, group[0].relationships)
+        roots = list()
+        for j, c in enumerate(group):
+            missing = [r for r in c.roots if r not in ontology]
+            if missing:
+                log.warning(f'Category {c.name}: unknown root terms {missing}')
+            # (category column, root index, min_depth), min_depth 1 leaves the root itself out
+            roots.extend((j, ontology.index[r], 0 if c.include_roots and r not in c.exclude_roots else 1)
+                         for r in c.roots if r in ontology)
+
+        if db is not None and closure_is_current(db, obo_file, group[0].relationships):
+            rows = expand_term_sets(db, [(j, str(ontology.ids[i]), d) for j, i, d in roots],
+                                    group[0].relationships)
+            cols = np.array([j for j, _ in rows], dtype=np.int64)
+            terms = ontology.indices([t for _, t in rows])
+        else:
+            seeds = np.zeros((len(ontology), len(group)), dtype=bool)
+            for j, i, d in roots:
+                if d == 0:
+                    seeds[i, j] = True
+                else:
+                    # seeding with the direct children keeps a root only when it is below another root
+                    seeds[ontology.children([i]), j] = True
+            terms, cols = np.nonzero(propagate(ontology, seeds))
+
+        frames.append(pd.DataFrame({
+            'category': pd.Categorical([group[j].name for j in cols], categories=[c.name for c in categories]),
+            'goId': ontology.ids[terms],
+            'name': [ontology.name(i) for i in terms],
+            'ns': [ontology.namespace(i) for i in terms],
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=['category', 'goId', 'name', 'ns'])
+    df = pd.concat(frames, ignore_index=True).sort_values(by=['category', 'goId'], ignore_index=True)
+    count(rows=len(df))
+    return df
+
+
+def category_terms(df_terms: pd.DataFrame, name) -> np.ndarray:
+    return df_terms.loc[df_terms['category'] == name, 'goId'].values
+
+
+def category_tables(df_terms: pd.DataFrame, categories) -> dict:
+    # term list of each category, keyed by its sheet name
+    return {c.sheet or c.name: df_terms.loc[df_terms['category'] == c.name, ['goId', 'name', 'ns']]
+            for c in categories}
+
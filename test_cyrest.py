@@ -0,0 +1,111 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from cyrest import CyRestClient, delete_elements, push_network
+
+
+class FakeCytoscape(CyRestClient):
+    """
+    In-memory stand-in for the CyREST endpoints push_network uses, recording every request.
+    """
+
+    def __init__(self):
+        super().__init__('http://cytoscape.invalid/v1')
+        self.suids = itertools.count(100)
+        self.networks = dict()
+        self.calls = list()
+
+    def request(self, method, path, params=None, body=None):
+        self.calls.append((method, path, body))
+        parts = path.split('/')
+        if path == 'networks' and method == 'GET':
+            return [s for s, n in self.networks.items() if n['title'] == params['query']]
+        if path == 'networks' and method == 'POST':
+            suid = next(self.suids)
+            self.networks[suid] = {'title': params['title'], 'nodes': dict(), 'edges': dict()}
+            return {'networkSUID': suid}
+        if path == 'commands/network/delete':
+            network = self.networks[int(body['network'].split(':')[1])]
+            kind = 'nodes' if 'nodeList' in body else 'edges'
+            for element in body.get('nodeList', body.get('edgeList')).split(','):
+                del network[kind][int(element.split(':')[1])]
+            if kind == 'nodes':
+                network['edges'] = {s: e for s, e in network['edges'].items()
+                                    if e['source'] in network['nodes'] and e['target'] in network['nodes']}
+            return None
+        if parts[0] == 'apply':
+            return None
+        network = self.networks[int(parts[1])]
+        if parts[2] == 'nodes':
+            created = [{'SUID': next(self.suids), 'name': name} for name in body]
+            network['nodes'].update({n['SUID']: dict(n) for n in created})
+            return created
+        if parts[2] == 'edges':
+            created = [{'SUID': next(self.suids), 'source': e['source'], 'target': e['target'],
+                        'interaction': e['interaction']} for e in body]
+            network['edges'].update({e['SUID']: dict(e) for e in created})
+            return created
+        elements = network['nodes' if parts[3] == 'defaultnode' else 'edges']
+        if method == 'GET':
+            return [dict(e) for e in elements.values()]
+        for row in body['data']:
+            elements[row['SUID']].update(row)
+        return None
+
+    def posts(self, path_end):
+        return [body for method, path, body in self.calls if method == 'POST' and path.endswith(path_end)]
+
+
+def network_frames(n_nodes, pairs):
+    nodes = pd.DataFrame({'id': [f'ENSG{i}' for i in range(n_nodes)], 'name': [f'S{i}' for i in range(n_nodes)]})
+    edges = pd.DataFrame({'source': [f'ENSG{a}' for a, _ in pairs], 'target': [f'ENSG{b}' for _, b in pairs],
+                          'weight': [0.5] * len(pairs)})
+    return nodes, edges
+
+
+def edge_set(network):
+    ids = {s: n['id'] for s, n in network['nodes'].items()}
+    return {(ids[e['source']], ids[e['target']], e['weight']) for e in network['edges'].values()}
+
+
+@pytest.fixture
+def client():
+    return FakeCytoscape()
+
+
+def test_new_network_is_sent_in_batches(client):
+    nodes, edges = network_frames(12, [(i, i + 1) for i in range(11)])
+    suid = push_network(nodes, edges, 'net', 'HuRI', client=client, batch_size=5)
+    assert [len(b) for b in client.posts('/nodes')] == [5, 5, 2]
+    assert [len(b) for b in client.posts('/edges')] == [5, 5, 1]
+    network = client.networks[suid]
+    assert sorted(n['name'] for n in network['nodes'].values()) == sorted(nodes['name'])
+    assert edge_set(network) == {(f'ENSG{i}', f'ENSG{i + 1}', 0.5) for i in range(11)}
+
+
+def test_existing_network_gets_only_the_difference(client):
+    nodes, edges = network_frames(12, [(i, i + 1) for i in range(11)])
+    suid = push_network(nodes, edges, 'net', 'HuRI', client=client, batch_size=5)
+    client.calls.clear()
+
+    # ENSG0 and its edge go, ENSG12 comes in with an edge, ENSG3-ENSG4 is rewired to ENSG3-ENSG7
+    nodes, edges = network_frames(13, [(i, i + 1) for i in range(1, 12) if i != 3] + [(3, 7)])
+    nodes = nodes[nodes['id'] != 'ENSG0']
+    assert push_network(nodes, edges, 'net', 'HuRI', client=client, batch_size=5) == suid
+    assert client.posts('/nodes') == [['ENSG12']]
+    assert [len(b) for b in client.posts('/edges')] == [2]
+    assert [c['edgeList'].count('SUID:') for c in client.posts('commands/network/delete') if 'edgeList' in c] == [1]
+    network = client.networks[suid]
+    assert sorted(n['id'] for n in network['nodes'].values()) == sorted(nodes['id'])
+    assert edge_set(network) == {(s, t, 0.5) for s, t in zip(edges['source'], edges['target'])}
+
+
+def test_delete_elements_sends_one_command_per_batch(client):
+    client.networks[1] = {'title': 'net', 'nodes': {s: {} for s in range(12)}, 'edges': dict()}
+    delete_elements(client, 1, 'nodes', range(12), batch_size=5)
+    commands = client.posts('commands/network/delete')
+    assert [c['nodeList'].count('SUID:') for c in commands] == [5, 5, 2]
+    assert all(c['network'] == 'SUID:1' for c in commands)
+    assert client.networks[1]['nodes'] == dict()
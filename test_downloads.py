@@ -0,0 +1,121 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloads
+from downloads import MANIFEST_FILE, Manifest, download_url, sha256_file
+
+CONTENT = bytes(range(256)) * 400
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # set per test: the file served, the start a 206 answer claims (None for the requested one) and every
+    # request seen as (method, Range header)
+    content = CONTENT
+    claimed_start = None
+    requests = list()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', self.headers.get('Range')))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.content)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.requests.append(('GET', self.headers.get('Range')))
+        if self.path.endswith('missing'):
+            self.send_error(404)
+            return
+        requested = self.headers.get('Range')
+        if requested is None:
+            self.send_response(200)
+            body = self.content
+        else:
+            start = int(requested.split('=')[1].split('-')[0])
+            if start >= len(self.content):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(self.content)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = start if self.claimed_start is None else self.claimed_start
+            body = self.content[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(self.content) - 1}/{len(self.content)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    RangeHandler.content = CONTENT
+    RangeHandler.claimed_start = None
+    RangeHandler.requests = list()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(server, tmp_path, name='file.bin'):
+    output = tmp_path / name
+    entry = download_url(f'{server}/{name}', str(output), Manifest(str(tmp_path / MANIFEST_FILE)), timeout=5)
+    return output, entry
+
+
+def test_download_records_manifest_and_skips_repeats(server, tmp_path):
+    output, entry = download(server, tmp_path)
+    assert output.read_bytes() == CONTENT
+    assert entry['size'] == len(CONTENT)
+    assert entry['sha256'] == sha256_file(output).hexdigest()
+    RangeHandler.requests.clear()
+    assert download(server, tmp_path)[1] == entry
+    assert RangeHandler.requests == []
+
+
+def test_resumes_partial_download(server, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(CONTENT[:1000])
+    output, entry = download(server, tmp_path)
+    assert RangeHandler.requests == [('GET', 'bytes=1000-')]
+    assert output.read_bytes() == CONTENT
+    assert entry['sha256'] == sha256_file(output).hexdigest()
+    assert not (tmp_path / 'file.bin.part').exists()
+
+
+def test_complete_partial_download_is_finished_on_416(server, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(CONTENT)
+    output, entry = download(server, tmp_path)
+    assert RangeHandler.requests == [('GET', f'bytes={len(CONTENT)}-')]
+    assert output.read_bytes() == CONTENT
+    assert entry['size'] == len(CONTENT)
+
+
+def test_longer_partial_download_restarts_on_416(server, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(CONTENT + b'stale tail')
+    output, _ = download(server, tmp_path)
+    assert RangeHandler.requests[-1] == ('GET', None)
+    assert output.read_bytes() == CONTENT
+
+
+def test_mismatched_content_range_restarts(server, tmp_path):
+    (tmp_path / 'file.bin.part').write_bytes(CONTENT[:1000])
+    RangeHandler.claimed_start = 0
+    output, _ = download(server, tmp_path)
+    assert RangeHandler.requests == [('GET', 'bytes=1000-'), ('GET', None)]
+    assert output.read_bytes() == CONTENT
+
+
+def test_download_files_raises_after_failures(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloads, 'URLS', [f'{server}/file.bin', f'{server}/missing'])
+    with pytest.raises(IOError, match='1 of 2 downloads failed'):
+        downloads.download_files(data_folder=str(tmp_path))
+    # the other downloads still complete
+    assert (tmp_path / 'file.bin').read_bytes() == CONTENT
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from indexes import INDEXES, TEXT_QUERY_INDEXES, create_indexes
+from interning import build_identifiers
+from main import HGNC_UNIPROT_DDL, SQL_HGNC_UNIPROT_INSERT, update_indexes
+from load_to_cytoscape import (SQL_FILTERED_INSERT, SQL_FILTERED_INSERT_IDS, create_filtered_table, create_nodes_table,
+                               load_term_sets, query_plan_scans, workload_queries)
+from termsets import Category
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = sqlite3.connect(tmp_path / 'go-interactome.db')
+    db.execute('CREATE TABLE annotations ("db" TEXT, "id" TEXT, "goId" TEXT, "evidenceCode" TEXT, "taxon" INTEGER);')
+    db.execute('CREATE TABLE hgnc ("hgnc_id" TEXT, "symbol" TEXT, "name" TEXT, "alias_symbol" TEXT, '
+               '"ensembl_gene_id" TEXT, "uniprot_ids" TEXT);')
+    db.execute('CREATE TABLE mapping ("UniProtKB_AC" TEXT, "Ensembl" TEXT);')
+    db.execute('CREATE TABLE interactome ("p1" TEXT, "p2" TEXT);')
+    db.executemany('INSERT INTO annotations VALUES (?, ?, ?, ?, 9606);',
+                   [('UniProtKB', f'P{i % 500:05d}', f'GO:{i % 300:07d}', ('IDA', 'IEA')[i % 2]) for i in range(5000)])
+    db.executemany('INSERT INTO hgnc VALUES (?, ?, ?, NULL, ?, ?);',
+                   [(f'HGNC:{i}', f'S{i}', f'gene {i}', f'ENSG{i:011d}', f'P{i:05d}') for i in range(500)])
+    db.executemany('INSERT INTO mapping VALUES (?, ?);', [(f'P{i:05d}', f'ENSG{i:011d}') for i in range(500)])
+    # a gene with several accessions, only the second one annotated
+    db.execute("INSERT INTO hgnc VALUES ('HGNC:500', 'S500', 'gene 500', NULL, 'ENSG00000000500', 'Q00500|P00000');")
+    db.execute("INSERT INTO mapping VALUES ('Q00500', 'ENSG00000000500');")
+    db.execute(HGNC_UNIPROT_DDL.format(table='hgnc_uniprot'))
+    db.execute(SQL_HGNC_UNIPROT_INSERT.format(table='hgnc_uniprot', hgnc='hgnc'))
+    db.executemany('INSERT INTO interactome VALUES (?, ?);',
+                   [(f'ENSG{i:011d}', f'ENSG{i * 7 % 600:011d}') for i in range(600)])
+    assert {t for t, _ in INDEXES.values()} >= {'annotations', 'hgnc', 'hgnc_uniprot', 'interactome', 'mapping'}
+    create_indexes(db)
+    yield db
+    db.close()
+
+
+def load_test_categories(db):
+    categories = [Category('cell_cycle', ('GO:0000001',)),
+                  Category('mitochondria', ('GO:0000002',), evidence_codes=('IDA',))]
+    df_terms = pd.DataFrame({'category': ['cell_cycle'] * 20 + ['mitochondria'] * 20,
+                             'goId': [f'GO:{i:07d}' for i in range(40)]})
+    create_filtered_table(db.cursor())
+    load_term_sets(db, df_terms, categories)
+
+
+def test_filtered_insert_uses_indexes(db):
+    load_test_categories(db)
+    assert query_plan_scans(db, SQL_FILTERED_INSERT) == []
+
+
+def test_interned_filtered_insert_uses_indexes(db, tmp_path):
+    db.commit()
+    build_identifiers(tmp_path / 'go-interactome.db')
+    create_indexes(db)
+    load_test_categories(db)
+    assert query_plan_scans(db, SQL_FILTERED_INSERT_IDS) == []
+
+
+def test_text_and_interned_filtered_rows_match(db, tmp_path):
+    load_test_categories(db)
+    db.execute(SQL_FILTERED_INSERT)
+    text = sorted(db.execute('SELECT Ensembl, symbol, related_to FROM filtered;').fetchall())
+    db.commit()
+    build_identifiers(tmp_path / 'go-interactome.db')
+    load_test_categories(db)
+    db.execute(SQL_FILTERED_INSERT_IDS)
+    interned = sorted(db.execute('SELECT Ensembl, symbol, related_to FROM filtered;').fetchall())
+    assert text == interned
+    assert ('ENSG00000000500', 'S500', 'cell_cycle') in text
+
+
+@pytest.mark.parametrize('interned', [False, True])
+def test_interactome_queries_use_indexes(db, tmp_path, interned):
+    if interned:
+        db.commit()
+        build_identifiers(tmp_path / 'go-interactome.db')
+        update_indexes(tmp_path / 'go-interactome.db')
+        existing = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='index';")}
+        assert existing.isdisjoint(TEXT_QUERY_INDEXES)
+    load_test_categories(db)
+    create_nodes_table(db.cursor(), ['cell_cycle', 'mitochondria'])
+    queries = workload_queries(db)
+    assert ('interactome_ids' in queries['interactions']) == interned
+    assert query_plan_scans(db, queries['filtered_insert']) == []
+    # the text queries read the interactome once, the interned ones the filtered genes
+    driving = ('F1', 'F2', 'N') if interned else ('I', 'I1', 'I2', 'N')
+    assert query_plan_scans(db, queries['interactions'], allowed=driving) == []
+    if interned:
+        plan = [row[-1] for row in db.execute(f"EXPLAIN QUERY PLAN {queries['interactions']}")]
+        assert 'SEARCH F2 USING COVERING INDEX filtered_id_index (ensembl_id=?)' in plan
+    assert query_plan_scans(db, queries['nodes_insert'], allowed=driving) == []